@@ -23,6 +23,7 @@ import pyxcel.engine.centralizer
 import pyxcel.engine.optimization.mo_combined as opti_mo
 import pyxcel.engine.optimization.multi_combined as opti_multi
 import pyxcel.engine.optimization.scipy_d_e_combined as opti_scipy
+import pyxcel.engine.optimization.least_squares_combined as opti_lsq
 from paf.port import Port
 from pyxcel.uni import uni
 from pyxcel.controller import type_inst
@@ -38,6 +39,12 @@ def create_combine_inspyred():
         """
         pipeline.add_to_essential("optimization_filter", "algo",
                                   uni("Optimization algorithm"))
+        pipeline.add_to_essential("optimization_filter", "workers",
+                                  uni("Worker processes (0: all CPU)"))
+        pipeline.add_to_essential("optimization_filter", "adaptive_tolerance",
+                                  uni("Adaptive sampling tolerance (0: off)"))
+        pipeline.add_to_essential("optimization_filter", "kinematic_factor",
+                                  uni("Kinematic XRR factor (0: off)"))
     operation = CombinedOptimization(opti_multi.OptimisationFilter())
     operation.config_special(add_spec)
     operation.fom_XRR = fom.log2d
@@ -54,6 +61,12 @@ def create_combine_inspyred_mo():
         """
         pipeline.add_to_essential("optimization_filter", "algo",
                                   uni("Optimization algorithm"))
+        pipeline.add_to_essential("optimization_filter", "workers",
+                                  uni("Worker processes (0: all CPU)"))
+        pipeline.add_to_essential("optimization_filter", "adaptive_tolerance",
+                                  uni("Adaptive sampling tolerance (0: off)"))
+        pipeline.add_to_essential("optimization_filter", "kinematic_factor",
+                                  uni("Kinematic XRR factor (0: off)"))
     operation = CombinedOptimization(opti_mo.OptimisationFilter())
     operation.config_special(add_spec)
     operation.fom_XRR = fom.b_log_module
@@ -70,6 +83,14 @@ def create_combine_scipy():
         """
         pipeline.add_to_essential("optimization_filter", "polish",
                                   uni("Final refinement"))
+        pipeline.add_to_essential("optimization_filter", "vectorized",
+                                  uni("Evaluate whole generations"))
+        pipeline.add_to_essential("optimization_filter", "workers",
+                                  uni("Worker processes (0: all CPU)"))
+        pipeline.add_to_essential("optimization_filter", "adaptive_tolerance",
+                                  uni("Adaptive sampling tolerance (0: off)"))
+        pipeline.add_to_essential("optimization_filter", "kinematic_factor",
+                                  uni("Kinematic XRR factor (0: off)"))
     operation = CombinedOptimization(opti_scipy.OptimisationFilter())
     operation.config_special(add_spec)
     operation.fom_XRR = fom.log2d
@@ -77,6 +98,22 @@ def create_combine_scipy():
     return operation
 
 
+def create_combine_least_squares():
+    """ create a pipeline refining with scipy least squares
+    """
+
+    def add_spec(pipeline):
+        """ add special element
+        """
+        pipeline.add_to_essential("optimization_filter", "method",
+                                  uni("Least squares method (trf, lm)"))
+    operation = CombinedOptimization(opti_lsq.OptimisationFilter())
+    operation.config_special(add_spec)
+    operation.fom_XRR = fom.log2d
+    operation.fom_GiXRF = fom.chi2d
+    return operation
+
+
 class FomSelector(paf.data.CompositeData):
     """ composite data to select an FOM
     """
@@ -600,6 +600,7 @@ class Database(CompositeDataObservable):
         stack = self[stack_name]
         new_layer = entity.LayerData(name=name)
         stack.real_value["layers"].append(new_layer)
+        stack.invalidate_layers()
 
     def add_exp_data(self, file_name, instrument_name, sample_name):
         """ add experimental data in database.
@@ -10,6 +10,7 @@ Correct (to a ppm digit) with en_array = [277.,525.,677,1487.,1554.,1740.]
 from scipy.interpolate import interp1d
 import xraylib
 import numpy as np
+from pyxcel.engine.gixrf import xraylib_cache
 
 
 def diode_interp(energy_array):
@@ -44,13 +45,10 @@ def eff_sdd1_09_kw49(energy_array):
     # in eV
     # makes sure we are dealing with an array, not a list
     energy_array = np.array(energy_array)
-    sdd_mu = []
-    for one_energy in energy_array:
-        sdd_mu = np.append(sdd_mu, xraylib.
-                           CS_Total(xraylib.SymbolToAtomicNumber('Si'),
-                                    one_energy / 1000.))
+    sdd_mu = xraylib_cache.cs_total_many(xraylib.SymbolToAtomicNumber('Si'),
+                                         energy_array / 1000.)
 
-    sdd_rho = xraylib.ElementDensity(xraylib.SymbolToAtomicNumber('Si'))
+    sdd_rho = xraylib_cache.ElementDensity(xraylib.SymbolToAtomicNumber('Si'))
     sdd_thickness = 0.04  # There are measurements on the KMC, which result in
     # a SDD efficiency of 0.91 at 10.5 keV ...
     sdd_abs = 1 - np.exp(-sdd_mu * sdd_rho * sdd_thickness)
@@ -61,14 +59,10 @@ def eff_sdd1_09_kw49(energy_array):
     front_thickness = np.zeros(mysize)
     front_mu = np.zeros((mysize, np.size(energy_array)))
     for el_idx, element in enumerate(elements):
-        mu = np.array([])
-        for one_energy in energy_array:
-            mu = np.append(mu, xraylib.
-                           CS_Total(xraylib.SymbolToAtomicNumber(element),
-                                    one_energy / 1000.))
-        front_mu[el_idx, :] = np.array(mu)
-        front_rho.append(xraylib.
-                         ElementDensity(xraylib.SymbolToAtomicNumber(element)))
+        atomic_number = xraylib.SymbolToAtomicNumber(element)
+        front_mu[el_idx, :] = xraylib_cache.cs_total_many(atomic_number,
+                                                          energy_array / 1000.)
+        front_rho.append(xraylib_cache.ElementDensity(atomic_number))
 
     # the SDD efficiency curve from HNS_09_kw49 fitted (CurveFit):
     # lead to an order of magnitude different start values ​​for deviations in
@@ -2,15 +2,19 @@
 """
 @author: JANOUSOV
 """
+import copy
 import numpy as np
 import xraylib
+from pyxcel.engine.gixrf import xraylib_cache
+from pyxcel.engine.simulator import periodic
+from pyxcel.engine.simulator.xrr_no_genx import first_change
 from pyxcel.engine.modeling.tools import wavelength_to_in_energy
 from pyxcel.engine.modeling.tools import extract_elements
 from pyxcel.engine.modeling.tools import extract_weight_fractions
 
 
 def calc_XRF_CS(one_element, transition, inc_en_eV):
-    find = xraylib.CS_FluorLine_Kissel_Cascade
+    find = xraylib_cache.CS_FluorLine_Kissel_Cascade
     XRF_CS = find(xraylib.SymbolToAtomicNumber(str(one_element)), transition,
                   inc_en_eV/1000.)
     return XRF_CS
@@ -108,7 +112,11 @@ def abso_layer(mass_dens, thickness, angle, mu_mass):
 
 
 class ElField:
-    def __init__(self, theta, wavelength, n_array, d_array, sigma_array):
+    #: arrays with one column per angle
+    ANGULAR = ("Er", "Et", "Hr", "Ht", "njz", "njz_eps", "Xs", "Xp")
+
+    def __init__(self, theta, wavelength, n_array, d_array, sigma_array,
+                 blocks=None, previous=None):
         # here only one number
         k = 2*np.pi/wavelength  # in A^-1
         # original GenX approach: remove "useless" layer properties
@@ -116,6 +124,19 @@ class ElField:
 
         nn = len(theta)
         mm = len(n_array)
+        # layers and interfaces of periodic blocks are calculated once per
+        # period and expanded
+        layers = np.arange(mm)
+        interfaces = np.arange(mm-1)
+        if blocks:
+            blocks = periodic.valid_blocks(blocks, n_array, d_array,
+                                           sigma_array)
+            layers = periodic.layer_map(mm, blocks)
+            interfaces = periodic.interface_map(mm, blocks)
+        layers, layer_index = np.unique(layers, return_inverse=True)
+        interfaces, interface_index = np.unique(interfaces,
+                                                return_inverse=True)
+        n_layers = n_array[layers]
         # original GenX layer sequence: 0: Substrate, -1: Ambient
         Xs = np.zeros((mm, nn), dtype=np.complex128)
         Xp = np.zeros((mm, nn), dtype=np.complex128)
@@ -129,15 +150,19 @@ class ElField:
         self.Ht[-1] = np.ones(nn, dtype=np.complex128)
 
         # original layers order (like genx): 0th is Substrate, -1 is Ambient
-        Qj = 2 * k * np.sqrt(n_array[:, np.newaxis] ** 2 -
+        Qj = 2 * k * np.sqrt(n_layers[:, np.newaxis] ** 2 -
                              (np.cos(theta*np.pi/180.)) ** 2)
         # original GenX ignores refraction from the Ambient
         # TODO: is this a reasonable assumption?
         # Calculates the wavevector in each layer
-        Qj_eps = Qj / n_array[:, np.newaxis] ** 2
-        self.njz = np.sqrt(n_array[:, np.newaxis] ** 2 -
-                           (np.cos(theta*np.pi/180.)) ** 2)
-        self.njz_eps = self.njz / n_array[:, np.newaxis] ** 2
+        Qj_eps = Qj / n_layers[:, np.newaxis] ** 2
+        njz = np.sqrt(n_layers[:, np.newaxis] ** 2 -
+                      (np.cos(theta*np.pi/180.)) ** 2)
+        njz_eps = njz / n_layers[:, np.newaxis] ** 2
+        Qj = Qj[layer_index]
+        Qj_eps = Qj_eps[layer_index]
+        self.njz = njz[layer_index]
+        self.njz_eps = njz_eps[layer_index]
 
         # Fresnel reflectivity for the interfaces
         # (Nevot-Croce) roughness already included:
@@ -161,25 +186,39 @@ class ElField:
         # let's define everything in loops
         # using genx layer convention: 0: substrate, -1: Ambient
         # GenX layers:
-        Ajs = np.exp(1.0J*k*self.njz*d_array[:, np.newaxis])
-        Ajp = np.exp(1.0J*k*self.njz_eps*d_array[:, np.newaxis])
+        Ajs = np.exp(1.0J*k*njz*d_array[layers, np.newaxis])[layer_index]
+        Ajp = np.exp(1.0J*k*njz_eps*d_array[layers, np.newaxis])[layer_index]
         # attention: original GenX definition gives shorter arrays!
-        rrs = (Qj[1:]-Qj[:-1])/(Qj[1:]+Qj[:-1])
-        tts = 2.*Qj[1:]/(Qj[1:]+Qj[:-1])
-        rrp = (Qj_eps[1:]-Qj_eps[:-1])/(Qj_eps[1:]+Qj_eps[:-1])
-        ttp = 2*Qj_eps[1:]/(Qj_eps[1:]+Qj_eps[:-1])
+        low = interfaces
+        up = interfaces + 1
+        rrs = ((Qj[up]-Qj[low])/(Qj[up]+Qj[low]))[interface_index]
+        tts = (2.*Qj[up]/(Qj[up]+Qj[low]))[interface_index]
+        rrp = ((Qj_eps[up]-Qj_eps[low]) /
+               (Qj_eps[up]+Qj_eps[low]))[interface_index]
+        ttp = (2*Qj_eps[up]/(Qj_eps[up]+Qj_eps[low]))[interface_index]
 
         # add roughness (GenX)
-        Ss_NC = np.exp(-1/2.*sigma[:, np.newaxis]**2*Qj[:-1]*Qj[1:])
-        Sp_NC = np.exp(-1/2.*sigma[:, np.newaxis]**2*Qj_eps[:-1]*Qj_eps[1:])
-        Ts_NC = np.exp(sigma[:, np.newaxis]**2 * k**2 *
-                       (self.njz[:-1]-self.njz[1:])**2/2.0)
-        Tp_NC = np.exp(sigma[:, np.newaxis]**2 * k**2 *
-                       (self.njz_eps[:-1]-self.njz_eps[1:])**2/2.0)
+        sigma = sigma[low, np.newaxis]
+        Ss_NC = np.exp(-1/2.*sigma**2*Qj[low]*Qj[up])[interface_index]
+        Sp_NC = np.exp(-1/2.*sigma**2*Qj_eps[low] *
+                       Qj_eps[up])[interface_index]
+        Ts_NC = np.exp(sigma**2 * k**2 *
+                       (self.njz[low]-self.njz[up])**2/2.0)[interface_index]
+        Tp_NC = np.exp(sigma**2 * k**2 *
+                       (self.njz_eps[low] -
+                        self.njz_eps[up])**2/2.0)[interface_index]
 
         # the rest needs loops
+        # ratios under unchanged layers are kept from the previous field
+        #: number of layers with ratios kept from the previous field
+        self.reused = 0
+        if previous is not None:
+            self.reused = previous.valid_layers(theta, wavelength, n_array,
+                                                d_array, sigma_array)
+            Xs[:self.reused] = previous.Xs[:self.reused]
+            Xp[:self.reused] = previous.Xp[:self.reused]
         # in the GenX order:
-        for kk in range(0, mm-1):
+        for kk in range(self.reused, mm-1):
             Xs[kk] = ((rrs[kk] * Ss_NC[kk] + Ajs[kk]**2 * Xs[kk-1]) /
                       (1 + Ajs[kk]**2 * Xs[kk-1] * rrs[kk] * Ss_NC[kk]))
             Xp[kk] = ((rrp[kk] * Sp_NC[kk] + Ajp[kk]**2 * Xp[kk-1]) /
@@ -198,6 +237,131 @@ class ElField:
         for kk in range(mm):
             self.Er[kk] = Ajs[kk]**2 * Xs[kk-1] * self.Et[kk]
             self.Hr[kk] = Ajp[kk]**2 * Xp[kk-1] * self.Ht[kk]
+        #: ratio of up and down going waves under each interface
+        self.Xs = Xs
+        self.Xp = Xp
+        self._inputs = (np.array(theta), wavelength, np.array(n_array),
+                        np.array(d_array), np.array(sigma_array))
+
+    def valid_layers(self, theta, wavelength, n_array, d_array, sigma_array):
+        """ number of layers from the substrate whose ratios of up and down
+        going waves are still valid for new parameters
+
+        :rtype: int
+        """
+        if self._inputs is None:
+            return 0
+        old_theta, old_wavelength, old_n, old_d, old_sigma = self._inputs
+        if (old_wavelength != wavelength or old_n.shape != np.shape(n_array)
+                or not np.array_equal(old_theta, theta)):
+            return 0
+        # the ratio under interface kk needs layers kk and kk+1
+        return max(min(first_change(old_n, n_array)-1,
+                       first_change(old_d, d_array),
+                       first_change(old_sigma, sigma_array)), 0)
+
+    def tangent(self, dn, dd, dsigma):
+        """ derivatives of the field along directions of the layer parameters
+        (forward mode through the same recursions). The field must have been
+        calculated for its own angles (not taken nor sampled).
+
+        :param dn: derivatives of the refractive index (directions, layers)
+        :param dd: derivatives of the thickness (directions, layers)
+        :param dsigma: derivatives of the roughness (directions, layers)
+        :return: dictionary of derivatives (directions, layers, angles) of
+                 Et, Er, Ht, Hr, Xs, Xp, njz and njz_eps
+        """
+        if self._inputs is None:
+            raise ValueError("the field has no parameters to differentiate")
+        _, wavelength, n_array, d_array, sigma_array = self._inputs
+        k = 2*np.pi/wavelength
+        n = n_array[:, np.newaxis]
+        d = d_array[:, np.newaxis]
+        dn = np.asarray(dn, dtype=np.complex128)[:, :, np.newaxis]
+        dd = np.asarray(dd, dtype=np.float64)[:, :, np.newaxis]
+        dsigma = np.asarray(dsigma, dtype=np.float64)[:, :-1, np.newaxis]
+        sigma = sigma_array[:-1, np.newaxis]
+        njz, njz_eps = self.njz, self.njz_eps
+        dnjz = n*dn/njz
+        dnjz_eps = dnjz/n**2 - 2*njz*dn/n**3
+
+        def interface(z, dz):
+            """ Fresnel coefficients, roughness factors and derivatives
+            """
+            low, up = z[:-1], z[1:]
+            dlow, dup = dz[:, :-1], dz[:, 1:]
+            total = low + up
+            # derivative of the reflection and transmission coefficients
+            dr = 2*(low*dup - up*dlow)/total**2
+            S = np.exp(-2*k**2*sigma**2*low*up)
+            dS = -2*k**2*S*(2*sigma*dsigma*low*up +
+                            sigma**2*(dlow*up + low*dup))
+            T = np.exp(sigma**2*k**2*(low-up)**2/2.)
+            dT = k**2*T*(sigma*dsigma*(low-up)**2 +
+                         sigma**2*(low-up)*(dlow-dup))
+            return (up-low)/total, 2*up/total, dr, S, dS, T, dT
+
+        def propagate(nz, dnz, X, E, quirk):
+            """ derivatives of the ratios, transmitted and reflected waves of
+            one polarization, quirk uses T instead of S in the denominator of
+            the transmitted wave (as the field does for p)
+            """
+            A = np.exp(1.0J*k*nz*d)
+            dA = 1.0J*k*A*(dnz*d + nz*dd)
+            r, t, dr, S, dS, T, dT = interface(nz, dnz)
+            a, da = r*S, dr*S + r*dS
+            c, dc = (r*T, dr*T + r*dT) if quirk else (a, da)
+            dX = np.zeros(dnz.shape, dtype=np.complex128)
+            for kk in range(len(nz)-1):
+                u = A[kk]**2*X[kk-1]
+                du = 2*A[kk]*dA[:, kk]*X[kk-1] + A[kk]**2*dX[:, kk-1]
+                dX[:, kk] = ((da[:, kk]*(1-u**2) + du*(1-a[kk]**2)) /
+                             (1 + a[kk]*u)**2)
+            dE = np.zeros(dnz.shape, dtype=np.complex128)
+            for kk in range(len(nz)-2, -1, -1):
+                num = E[kk+1]*A[kk+1]*t[kk]
+                dnum = (dE[:, kk+1]*A[kk+1]*t[kk] +
+                        E[kk+1]*dA[:, kk+1]*t[kk] + E[kk+1]*A[kk+1]*dr[:, kk])
+                if kk == 0:
+                    dE[:, kk] = dnum
+                    continue
+                u = A[kk]**2*X[kk-1]
+                du = 2*A[kk]*dA[:, kk]*X[kk-1] + A[kk]**2*dX[:, kk-1]
+                D = 1 + u*c[kk]
+                dD = du*c[kk] + u*dc[:, kk]
+                dE[:, kk] = ((dnum*T[kk] + num*dT[:, kk])*D -
+                             num*T[kk]*dD)/D**2
+            # reflected wave A**2 X[kk-1] E[kk], X[-1] is 0 under the substrate
+            X_below = np.roll(X, 1, axis=0)
+            dX_below = np.roll(dX, 1, axis=1)
+            dR = ((2*A*dA*X_below + A**2*dX_below)*E +
+                  A**2*X_below*dE)
+            return dX, dE, dR
+
+        result = {"njz": dnjz, "njz_eps": dnjz_eps}
+        (result["Xs"], result["Et"],
+         result["Er"]) = propagate(njz, dnjz, self.Xs, self.Et, False)
+        (result["Xp"], result["Ht"],
+         result["Hr"]) = propagate(njz_eps, dnjz_eps, self.Xp, self.Ht, True)
+        return result
+
+    def take(self, indices):
+        """ field for the angles at indices only
+
+        :param indices: indices of angles to keep
+        :rtype: ElField
+        """
+        field = copy.copy(self)
+        for name in self.ANGULAR:
+            setattr(field, name, getattr(self, name)[:, indices])
+        field._inputs = None
+        return field
+
+    @property
+    def reflectivity(self):
+        """ specular reflectivity (s polarization) for each angle
+        """
+        return np.abs(self.Xs[-2])**2
 
     def calcul_Ej(self, wavelength, d_array, z_start=-11, z_stop=11, dz=2):
         """
@@ -234,6 +398,38 @@ class ElField:
         return field_int_array
 
 
+class IncrementalElField(object):
+    """ ElField keeping the last field: when only upper layers changed, the
+    upward recursion resumes under the lowest changed layer.
+    """
+    def __init__(self):
+        """ initialization
+        """
+        #: False to always compute the whole recursion
+        self.enabled = True
+        self._last = None
+        #: number of field resumed from the previous one
+        self.hits = 0
+        #: number of field computed from the substrate
+        self.misses = 0
+
+    def __call__(self, theta, wavelength, n_array, d_array, sigma_array,
+                 blocks=None):
+        """ electric field with the signature of ElField
+
+        :rtype: ElField
+        """
+        previous = self._last if self.enabled else None
+        field = ElField(theta, wavelength, n_array, d_array, sigma_array,
+                        blocks, previous)
+        if field.reused:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._last = field
+        return field
+
+
 class FluoYield:
     """
     write documentation
@@ -242,20 +438,9 @@ class FluoYield:
     line_energy_cach = {}
 
     def __init__(self, inst, n_array, mass_dens_array, mat_array):
-        self.gam = 2*(np.real(n_array))*np.imag(n_array)
         # n_layers (without substrate and ambient)
         self._mm = np.size(n_array)
         self._elfield = None
-        self._mass_dens_array = mass_dens_array
-        self._mat_array = mat_array
-        
-#         # cleans mat_array from "_"
-#         for idx, each in enumerate(self._mat_array):
-#             self._mat_array[idx] = each.replace("_","")
-#                 # "_" removal in mat_array
-#         for idx, each in enumerate(mat_array):
-#             self._mat_array[idx] = each.replace("_","")
-                        
         self._inst = inst
         self._theta_array = None
         self.As = None
@@ -266,33 +451,93 @@ class FluoYield:
 
         self.mu_inc_lin = np.zeros(self._mm)
         # calculate mu_mass for all elements in all layers (just in case we
-        # need them)
-
-        all_elements = []
-        # cleans "_" from material array mat_array
-        for material in mat_array:
-            all_elements = np.append(all_elements, extract_elements(material))
-        # take only unique elements
-        all_elements = list(set(all_elements)) # removes doubles in all_elements ndarray (unicity is implied in python sets)
+        # need them), tables are kept between update
         self.mu_mass_array = {}
         self.concentrations = {}
-        for material in mat_array:
-            self.mu_mass_array[material] = {}
+        #: mass attenuation at incident energy for each material
+        self.mu_inc_mass = {}
+        self._inc_en_eV = None
+        self._elements = []
+        #: emission plan of each line for the current materials
+        self._plans = {}
+        self._mat_array = None
+        self.update(n_array, mass_dens_array, mat_array)
+
+        # initialize
+        self.abso_over_layers = {}
+
+    def update(self, n_array, mass_dens_array, mat_array):
+        """ change the sample. Attenuation tables are only calculated for new
+        materials and elements, tables of materials not used anymore are
+        dropped.
+
+        :param n_array: refractive index of each layer
+        :param mass_dens_array: mass density of each layer
+        :param mat_array: material of each layer
+        """
+        self.gam = 2*(np.real(n_array))*np.imag(n_array)
+        self._mass_dens_array = mass_dens_array
+        if self._mat_array is None or list(mat_array) != self._mat_array:
+            self._plans = {}
+        self._mat_array = list(mat_array)
+        used = set(mat_array)
+        for material in list(self.concentrations.keys()):
+            if material not in used:
+                del self.concentrations[material]
+                del self.mu_mass_array[material]
+                self.mu_inc_mass.pop(material, None)
+        new_materials = [material for material in used
+                         if material not in self.concentrations]
+        if len(new_materials) == 0:
+            return
+        new_elements = []
+        for material in new_materials:
+            Zs = extract_elements(material)
+            weight_fractions = extract_weight_fractions(material)
             self.concentrations[material] = {}
-            for one_element in all_elements:
+            for one_element, weight_fraction in zip(Zs, weight_fractions):
+                self.concentrations[material][one_element] = weight_fraction
+                if (one_element not in self._elements and
+                        one_element not in new_elements):
+                    new_elements.append(one_element)
+        self._elements.extend(new_elements)
+        for material in self.concentrations.keys():
+            if material in new_materials:
+                self.mu_mass_array[material] = {}
+                elements = self._elements
+            else:
+                elements = new_elements
+            for one_element in elements:
                 self.mu_mass_array[material][one_element] = {}
                 line_energy = self.calculate_line_energy(one_element)
-                for one_transition, line_en_keV in line_energy.items():
-                    mu_mass_array = xraylib.CS_Total_CP(material, line_en_keV)
+                transitions = list(line_energy.keys())
+                mu_mass = self.mass_attenuation(
+                    material, [line_energy[one_transition]
+                               for one_transition in transitions])
+                for one_transition, mu_mass_array in zip(transitions,
+                                                         mu_mass):
                     self.mu_mass_array[material][one_element][one_transition] = mu_mass_array
-            for one_element in extract_elements(material):
-                self.concentrations[material][one_element] = {}
-                Zs = extract_elements(material)
-                el_idx = np.where(Zs == one_element)
-                self.concentrations[material][one_element] = extract_weight_fractions(material)[el_idx]
 
-        # initialize
-        self.abso_over_layers = {}
+    def mass_attenuation(self, material, energies):
+        """ total cross section of a material for several energies in keV,
+        sum of the cross sections of its elements weighted by their mass
+        fraction
+
+        :rtype: numpy.ndarray
+        """
+        mu_mass = np.zeros(len(energies))
+        for one_element, weight_fraction in \
+                self.concentrations[material].items():
+            atomic_number = xraylib.SymbolToAtomicNumber(one_element)
+            mu_mass += weight_fraction * xraylib_cache.cs_total_many(
+                atomic_number, energies)
+        return mu_mass
+
+    @property
+    def mat_array(self):
+        """ material of each layer
+        """
+        return self._mat_array
 
     def calculate_line_energy(self, one_element):
         """ calculating all line enregie for one element
@@ -301,9 +546,10 @@ class FluoYield:
         if one_element in FluoYield.line_energy_cach.keys():
             return FluoYield.line_energy_cach[one_element]
         result = {}
-        for one_transition in range(-256, 256):
-            atomic_number = xraylib.SymbolToAtomicNumber(one_element)
-            line_en_keV = xraylib.LineEnergy(atomic_number, one_transition)
+        atomic_number = xraylib.SymbolToAtomicNumber(one_element)
+        transitions = range(-256, 256)
+        line_energy = xraylib_cache.line_energies(atomic_number, transitions)
+        for one_transition, line_en_keV in zip(transitions, line_energy):
             if line_en_keV != 0:
                 result[one_transition] = line_en_keV
         FluoYield.line_energy_cach[one_element] = result
@@ -332,11 +578,15 @@ class FluoYield:
         inst = self._inst
         wavelength = inst["source"]["wavelength"].value
         inc_en_eV = wavelength_to_in_energy(wavelength)
+        if inc_en_eV != self._inc_en_eV:
+            self._inc_en_eV = inc_en_eV
+            self.mu_inc_mass = {}
         for lay_idx in range(self._mm):
-            # TODO:
-            # do not calculate everything again!
-            mu_inc = xraylib.CS_Total_CP(mat_array[lay_idx],
-                                         inc_en_eV/1000.)
+            if mat_array[lay_idx] not in self.mu_inc_mass:
+                self.mu_inc_mass[mat_array[lay_idx]] = \
+                    self.mass_attenuation(mat_array[lay_idx],
+                                          [inc_en_eV/1000.])[0]
+            mu_inc = self.mu_inc_mass[mat_array[lay_idx]]
             # calculate lin. absorption coeff:
             self.mu_inc_lin[lay_idx] = mu_inc*mass_dens_array[lay_idx]
             # [cm-1]
@@ -377,96 +627,234 @@ class FluoYield:
             self.b[1, lay_idx, :] = -2*k*1e8*np.imag(elfield.njz[lay_idx])
             self.b[2, lay_idx, :] = -2*k*1e8*1.0j*np.real(elfield.njz[lay_idx])
 
+    def emission_plan(self, one_element, transition):
+        """ emission plan of a line for the current materials, compiled once
+        until the materials change.
+
+        :param one_element: symbol of the emitting element
+        :param transition: xraylib line
+        :rtype: EmissionPlan
+        """
+        key = (one_element, transition)
+        if key not in self._plans:
+            self._plans[key] = EmissionPlan(self, one_element, transition)
+        return self._plans[key]
+
+    def absorption_over_layers(self, plan, det_angle_array, mass_dens_array,
+                               d_array):
+        """ absorption of the line by all layers above each layer
+
+        :param plan: emission plan of the line
+        :type plan: EmissionPlan
+        :return: array (nb layer, nb angle), 1 for the top layer
+        """
+        attenuation = plan.mu_mass * mass_dens_array * d_array * 1e-8
+        # sum of attenuation of the layers above, from the top
+        above = np.zeros(np.size(attenuation))
+        above[:-1] = np.cumsum(attenuation[:0:-1])[::-1]
+        return np.exp(-above[:, np.newaxis] /
+                      np.sin(det_angle_array/180.*np.pi)[np.newaxis, :])
+
     def fluo_int(self, det_angle_array, n_array, d_array,
                  sigma_array, mass_dens_array, mat_array, one_element,
                  transition, XRF_CS):
-        mm = np.size(mat_array)  # number of strata
-        nn = np.size(self._theta_array)  # number of angular points
         # TODO
         # polarization
         sf = .5  # unpolarized
         pf = 1.0 - sf
-        abso_over_layers = np.ones((mm, nn))
-        for i in range(mm-2, -1, -1):  # I need to calculate absorption in all
-            # layers just in case my element is present everywhere
-            abso_out_above = abso_layer(mass_dens_array[i+1], d_array[i+1],
-                                        det_angle_array,
-                                        self.mu_mass_array[mat_array[i+1]]
-                                        [one_element][transition])
-            abso_over_layers_lay = abso_over_layers[i+1] * abso_out_above
-            abso_over_layers[i, :] = abso_over_layers_lay
-        fluo_intensity = 0.0
-        for j_layer in range(mm):
-            # to sum contributions for the same element+transition from several
-            # layers
-            tot_intensity = 0.0
-            if one_element in extract_elements(mat_array[j_layer]):
-                # calculate lin. absorption coeff:
-                muja_over_sin_ang_det = (mass_dens_array[j_layer] *
-                                         self.mu_mass_array[mat_array[j_layer]]
-                                         [one_element][transition] /
-                                         np.sin(det_angle_array/180.*np.pi))
-                dj = d_array[j_layer]*1e-8  # [cm]
-                three_comp = np.complex(0, 0)
-                for ii in range(3):
-                    arg_abs = self.b[ii, j_layer, :] + muja_over_sin_ang_det
-                    if j_layer == 0:  # sub
-                        three_comp = three_comp + (sf *
-                                                   self.As[ii, j_layer, :] +
-                                                   pf * self.Ap[ii, j_layer, :]
-                                                   ) / arg_abs
-                    else:
-                        three_comp = three_comp + (sf *
-                                                   self.As[ii, j_layer, :] +
-                                                   pf * self.Ap[ii, j_layer, :]
-                                                   ) * (1.0 - np.exp
-                                                        (-dj * arg_abs)
-                                                        ) / arg_abs
-                intensity = XRF_CS*np.real(three_comp)
-                tot_intensity = (intensity * abso_over_layers[j_layer+1] *
-                                 mass_dens_array[j_layer] *
-                                 self.concentrations[mat_array[j_layer]]
-                                 [one_element])
-            fluo_intensity = fluo_intensity + tot_intensity
-        return fluo_intensity
+        plan = self.emission_plan(one_element, transition)
+        # absorption in all layers just in case my element is present
+        # everywhere
+        abso_over_layers = self.absorption_over_layers(plan, det_angle_array,
+                                                       mass_dens_array,
+                                                       d_array)
+        layers = plan.layers
+        # calculate lin. absorption coeff of emitting layers:
+        muja_over_sin_ang_det = ((mass_dens_array[layers] *
+                                  plan.mu_mass[layers])[:, np.newaxis] /
+                                 np.sin(det_angle_array/180.*np.pi))
+        arg_abs = self.b[:, layers, :] + muja_over_sin_ang_det
+        three_comp = ((sf * self.As[:, layers, :] +
+                       pf * self.Ap[:, layers, :]) / arg_abs)
+        # no exit of the substrate
+        stratum = layers > 0
+        dj = d_array[layers[stratum]]*1e-8  # [cm]
+        three_comp[:, stratum] *= (1.0 - np.exp(-dj[:, np.newaxis] *
+                                                arg_abs[:, stratum]))
+        intensity = XRF_CS*np.real(np.sum(three_comp, axis=0))
+        # to sum contributions for the same element+transition from several
+        # layers
+        tot_intensity = (intensity * abso_over_layers[layers+1] *
+                         (mass_dens_array[layers] *
+                          plan.concentration[layers])[:, np.newaxis])
+        return np.sum(tot_intensity, axis=0)
+
+    def source_tangent(self, lay_idx, n_array, tangent, dn, dmass):
+        """ derivatives of As, Ap and b of one layer (see set_elfield)
+
+        :param n_array: refractive index of each layer
+        :param tangent: derivatives of the field (see ElField.tangent)
+        :param dn: derivatives of the refractive index (directions, layers)
+        :param dmass: derivatives of the mass density (directions, layers)
+        :return: dAs, dAp and db (3, directions, angles)
+        """
+        elfield = self._elfield
+        k = 2*np.pi*1e8/self._inst["source"]["wavelength"].value
+        n = n_array[lay_idx]
+        dn = np.asarray(dn)[:, lay_idx, np.newaxis]
+        mu_lin = self.mu_inc_lin[lay_idx]
+        dmu_lin = (self.mu_inc_mass[self._mat_array[lay_idx]] *
+                   np.asarray(dmass)[:, lay_idx, np.newaxis])
+        dgam = 2*(np.real(dn)*np.imag(n) + np.real(n)*np.imag(dn))
+        Et, Er = elfield.Et[lay_idx], elfield.Er[lay_idx]
+        Ht, Hr = elfield.Ht[lay_idx], elfield.Hr[lay_idx]
+        njz, njz_eps = elfield.njz[lay_idx], elfield.njz_eps[lay_idx]
+        dEt, dEr = tangent["Et"][:, lay_idx], tangent["Er"][:, lay_idx]
+        dHt, dHr = tangent["Ht"][:, lay_idx], tangent["Hr"][:, lay_idx]
+        dnjz = tangent["njz"][:, lay_idx]
+        dnjz_eps = tangent["njz_eps"][:, lay_idx]
+
+        def square(E, dE):
+            """ derivative of abs(E)**2
+            """
+            return 2*np.real(np.conj(E)*dE)
+
+        def ratio(value, dvalue):
+            """ derivative of value/mu_lin
+            """
+            return dvalue/mu_lin - value*dmu_lin/mu_lin**2
+        gam = self.gam[lay_idx]
+        s_factor, ds_factor = k*gam/mu_lin, k*ratio(gam, dgam)
+        dAs = np.array([
+            ds_factor*abs(Et)**2 + s_factor*square(Et, dEt),
+            ds_factor*abs(Er)**2 + s_factor*square(Er, dEr),
+            2*(ds_factor*Et*np.conj(Er) +
+               s_factor*(dEt*np.conj(Er) + Et*np.conj(dEr)))])
+        p_value = np.imag(njz)*np.real(njz_eps)
+        p_factor = 2*k*p_value/mu_lin
+        dp_factor = 2*k*ratio(p_value, np.imag(dnjz)*np.real(njz_eps) +
+                              np.imag(njz)*np.real(dnjz_eps))
+        c_value = np.real(njz)*np.imag(njz_eps)
+        c_factor = 4*k*c_value/mu_lin
+        dc_factor = 4*k*ratio(c_value, np.real(dnjz)*np.imag(njz_eps) +
+                              np.real(njz)*np.imag(dnjz_eps))
+        dAp = np.array([
+            dp_factor*abs(Ht)**2 + p_factor*square(Ht, dHt),
+            dp_factor*abs(Hr)**2 + p_factor*square(Hr, dHr),
+            dc_factor*Ht*np.conj(Hr) +
+            c_factor*(dHt*np.conj(Hr) + Ht*np.conj(dHr))])
+        db = np.array([2*k*np.imag(dnjz), -2*k*np.imag(dnjz),
+                       -2*k*1.0j*np.real(dnjz)])
+        return dAs, dAp, db
+
+    def fluo_int_jacobian(self, tangent, dn, dd, dmass, det_angle_array,
+                          n_array, d_array, mass_dens_array, one_element,
+                          transition, XRF_CS):
+        """ derivatives of fluo_int along directions of the layer parameters,
+        the field must be set.
+
+        :param tangent: derivatives of the field (see ElField.tangent)
+        :param dn: derivatives of the refractive index (directions, layers)
+        :param dd: derivatives of the thickness (directions, layers)
+        :param dmass: derivatives of the mass density (directions, layers)
+        :return: array (directions, angles)
+        """
+        sf = .5  # unpolarized
+        pf = 1.0 - sf
+        plan = self.emission_plan(one_element, transition)
+        dd = np.asarray(dd, dtype=np.float64)
+        dmass = np.asarray(dmass, dtype=np.float64)
+        d_array = np.asarray(d_array, dtype=np.float64)
+        mass_dens_array = np.asarray(mass_dens_array, dtype=np.float64)
+        sin_det = np.sin(det_angle_array/180.*np.pi)
+        abso_over_layers = self.absorption_over_layers(plan, det_angle_array,
+                                                       mass_dens_array,
+                                                       d_array)
+        # derivative of the attenuation of the layers above
+        attenuation = plan.mu_mass*(dmass*d_array + mass_dens_array*dd)*1e-8
+        above = np.zeros(attenuation.shape)
+        above[:, :-1] = np.cumsum(attenuation[:, :0:-1], axis=1)[:, ::-1]
+        result = np.zeros((len(dd), np.size(det_angle_array)))
+        for lay_idx in plan.layers:
+            dAs, dAp, db = self.source_tangent(lay_idx, n_array, tangent, dn,
+                                               dmass)
+            mu_det = plan.mu_mass[lay_idx]/sin_det
+            arg_abs = self.b[:, lay_idx, np.newaxis] + (
+                mass_dens_array[lay_idx]*mu_det)
+            darg = db + dmass[:, lay_idx, np.newaxis]*mu_det
+            comp = ((sf*self.As[:, lay_idx] +
+                     pf*self.Ap[:, lay_idx])[:, np.newaxis]/arg_abs)
+            dcomp = (sf*dAs + pf*dAp)/arg_abs - comp*darg/arg_abs
+            if lay_idx > 0:
+                # no exit of the substrate
+                dj = d_array[lay_idx]*1e-8
+                exit_ = np.exp(-dj*arg_abs)
+                dcomp = (dcomp*(1.0 - exit_) + comp*exit_ *
+                         (dd[:, lay_idx, np.newaxis]*1e-8*arg_abs + dj*darg))
+                comp = comp*(1.0 - exit_)
+            intensity = XRF_CS*np.real(np.sum(comp, axis=0))
+            dintensity = XRF_CS*np.real(np.sum(dcomp, axis=0))
+            abso = abso_over_layers[lay_idx+1]
+            dabso = -abso*above[:, lay_idx+1, np.newaxis]/sin_det
+            concentration = plan.concentration[lay_idx]
+            result += concentration*(
+                dintensity*abso*mass_dens_array[lay_idx] +
+                intensity*(dabso*mass_dens_array[lay_idx] +
+                           abso*dmass[:, lay_idx, np.newaxis]))
+        return result
 
     def fluo_thin_layer(self, theta_array, det_angle_array, n_array, d_array,
                         sigma_array, mass_dens_array, mat_array, one_element,
                         transition, XRF_CS, inst):
-        mm = np.size(mat_array)  # number of strata
-        nn = np.size(theta_array)  # number of angular points
         # TODO
         # polarization
-        abso_over_layers = np.ones((mm, nn))
-        for i in range(mm-2, -1, -1):
-            # I need to calculate absorption in all layers
-            # just in case my element is present everywhere
-            # abso_over_layers[j_layer] means absorption for signal (with E =
-            # transition energy) originating in j_layer
-            abso_out_above = abso_layer(mass_dens_array[i+1], d_array[i+1],
-                                        det_angle_array,
-                                        self.mu_mass_array[mat_array[i+1]]
-                                        [one_element][transition])
-            abso_over_layers_lay = abso_over_layers[i+1] * abso_out_above
-            abso_over_layers[i, :] = abso_over_layers_lay
-        fluo_intensity = 0.0
-        for j_layer in range(mm):
-            # to sum contributions for the same element+transition from several
-            # layers
-            intensity = 0.
-            if one_element in extract_elements(mat_array[j_layer]):
-                XSW_enhancement = (np.abs(self.Et[j_layer] +
-                                          self.Er[j_layer])) ** 2
-                dj = d_array[j_layer] * 1e-8  # [cm]
-                intensity = (self.gam[j_layer] / self.mu_inc_lin[j_layer] *
-                             inst.k * 1e8 * XRF_CS * XSW_enhancement *
-                             abso_over_layers[j_layer+1] * dj *
-                             abso_over_layers[j_layer+1] *
-                             mass_dens_array[j_layer] *
-                             self.concentrations[mat_array[j_layer]]
-                             [one_element])
-            fluo_intensity = fluo_intensity + intensity
-        return fluo_intensity
+        plan = self.emission_plan(one_element, transition)
+        # abso_over_layers[j_layer] means absorption for signal (with E =
+        # transition energy) originating in j_layer
+        abso_over_layers = self.absorption_over_layers(plan, det_angle_array,
+                                                       mass_dens_array,
+                                                       d_array)
+        layers = plan.layers
+        XSW_enhancement = (np.abs(self.Et[layers] + self.Er[layers])) ** 2
+        dj = d_array[layers] * 1e-8  # [cm]
+        factor = (self.gam[layers] / self.mu_inc_lin[layers] * inst.k * 1e8 *
+                  XRF_CS * dj * mass_dens_array[layers] *
+                  plan.concentration[layers])
+        intensity = (factor[:, np.newaxis] * XSW_enhancement *
+                     abso_over_layers[layers+1] ** 2)
+        # to sum contributions for the same element+transition from several
+        # layers
+        return np.sum(intensity, axis=0)
+
+
+class EmissionPlan(object):
+    """ arrays needed to calculate the fluorescence of one line in a stack,
+    one value by layer.
+    """
+    def __init__(self, fluo_yield, one_element, transition):
+        """ initialization
+
+        :param fluo_yield: fluorescence calculator with materials of layers
+        :type fluo_yield: FluoYield
+        :param one_element: symbol of the emitting element
+        :param transition: xraylib line
+        """
+        mat_array = fluo_yield.mat_array
+        #: True for layers containing the element
+        self.emitting = np.array([one_element in
+                                  fluo_yield.concentrations[material]
+                                  for material in mat_array], dtype=bool)
+        #: index of emitting layers
+        self.layers = np.nonzero(self.emitting)[0]
+        #: mass fraction of the element in each layer
+        self.concentration = np.zeros(len(mat_array))
+        for index in self.layers:
+            self.concentration[index] = \
+                fluo_yield.concentrations[mat_array[index]][one_element]
+        #: mass attenuation of the line in each layer
+        self.mu_mass = np.array([fluo_yield.mu_mass_array[material]
+                                 [one_element][transition]
+                                 for material in mat_array])
 
 
 def fluo_quanti(fluo_intensity, inc_flux, inst, det_efficiency,
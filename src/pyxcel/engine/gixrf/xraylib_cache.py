@@ -0,0 +1,246 @@
+# -*- coding: utf8 -*-
+"""
+Cache of xraylib cross sections, densities and line energies. Values are kept
+in memory (least recently used are dropped) and can be kept in a sqlite file
+shared by every process and session: set the PYXCEL_XRAYLIB_CACHE environment
+variable to its path or call CACHE.open(path).
+
+    :platform: Unix, Windows
+    :synopsis: cache of xraylib values.
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+import numbers
+import os
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+import xraylib
+
+#: environment variable containing the path of the on-disk store
+STORE_ENV = "PYXCEL_XRAYLIB_CACHE"
+
+
+def _normalize(arg):
+    """ convert numpy scalars and unicode to the python type given to xraylib
+    """
+    if isinstance(arg, numbers.Integral):
+        return int(arg)
+    if isinstance(arg, numbers.Real):
+        return float(arg)
+    return str(arg)
+
+
+class XraylibCache(object):
+    """ least recently used cache of xraylib functions with optional on-disk
+    store
+    """
+    def __init__(self, maxsize=200000, path=None):
+        """ initialization
+
+        :param maxsize: maximum number of values kept in memory
+        :type maxsize: int
+        :param path: path of the on-disk store (None for memory only)
+        :type path: str
+        """
+        self._maxsize = maxsize
+        self._memory = OrderedDict()
+        self._path = None
+        self._connection = None
+        #: process owning the connection (sqlite connection can't be forked)
+        self._pid = None
+        #: number of value found in memory or on disk
+        self.hits = 0
+        #: number of value calculated with xraylib
+        self.misses = 0
+        if path:
+            self.open(path)
+
+    @property
+    def path(self):
+        """ path of the on-disk store, None if values are only in memory
+        """
+        return self._path
+
+    def open(self, path):
+        """ use the on-disk store at path, created if needed
+
+        :param path: path of the sqlite file
+        :type path: str
+        """
+        self.close()
+        self._path = path
+        self._connect()
+
+    def close(self):
+        """ stop using the on-disk store, values in memory are kept
+        """
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+        self._path = None
+
+    def clear(self):
+        """ drop every value kept in memory
+        """
+        self._memory.clear()
+
+    def _connect(self):
+        """ open the connection of the current process
+        """
+        connection = sqlite3.connect(self._path, timeout=60)
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.execute("CREATE TABLE IF NOT EXISTS xraylib "
+                           "(function TEXT, arguments TEXT, value REAL, "
+                           "PRIMARY KEY (function, arguments))")
+        connection.commit()
+        self._connection = connection
+        self._pid = os.getpid()
+
+    def _store(self):
+        """ connection to the on-disk store, None if there is no store
+        """
+        if self._path is None:
+            return None
+        if self._pid != os.getpid():
+            # forked process: the inherited connection must not be used
+            self._connect()
+        return self._connection
+
+    def _remember(self, key, value):
+        """ keep a value in memory and drop the least recently used
+        """
+        self._memory[key] = value
+        while len(self._memory) > self._maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, name, *args):
+        """ value of the xraylib function name for args
+
+        :param name: name of the xraylib function
+        :type name: str
+        """
+        return self.get_many(name, [args])[0]
+
+    def get_many(self, name, args_list, default=None):
+        """ values of the xraylib function name for each args of args_list,
+        missing values are all written on disk in one transaction.
+
+        :param name: name of the xraylib function
+        :type name: str
+        :param args_list: list of tuple of arguments
+        :param default: value of the arguments rejected by xraylib, which are
+                        not kept (None to raise the error of xraylib)
+        :rtype: numpy.ndarray
+        """
+        keys = [(name, tuple(_normalize(arg) for arg in args))
+                for args in args_list]
+        result = np.zeros(len(keys))
+        missing = []
+        for index, key in enumerate(keys):
+            try:
+                value = self._memory.pop(key)
+            except KeyError:
+                missing.append(index)
+                continue
+            self._memory[key] = value
+            result[index] = value
+        self.hits += len(keys) - len(missing)
+        if len(missing) == 0:
+            return result
+        store = self._store()
+        new_rows = []
+        function = getattr(xraylib, name)
+        for index in missing:
+            key = keys[index]
+            row = None
+            if store is not None:
+                row = store.execute("SELECT value FROM xraylib WHERE "
+                                    "function=? AND arguments=?",
+                                    (name, repr(key[1]))).fetchone()
+            if row is None:
+                try:
+                    value = function(*key[1])
+                except ValueError:
+                    if default is None:
+                        raise
+                    result[index] = default
+                    continue
+                new_rows.append((name, repr(key[1]), value))
+                self.misses += 1
+            else:
+                value = row[0]
+                self.hits += 1
+            self._remember(key, value)
+            result[index] = value
+        if store is not None and len(new_rows):
+            store.executemany("INSERT OR IGNORE INTO xraylib VALUES (?, ?, ?)",
+                              new_rows)
+            store.commit()
+        return result
+
+
+#: cache used by simulators
+CACHE = XraylibCache(path=os.environ.get(STORE_ENV))
+
+
+def CS_Total_CP(material, energy):
+    """ cached xraylib.CS_Total_CP
+    """
+    return CACHE.get("CS_Total_CP", material, energy)
+
+
+def CS_FluorLine_Kissel_Cascade(atomic_number, line, energy):
+    """ cached xraylib.CS_FluorLine_Kissel_Cascade
+    """
+    return CACHE.get("CS_FluorLine_Kissel_Cascade", atomic_number, line,
+                     energy)
+
+
+def LineEnergy(atomic_number, line):
+    """ cached xraylib.LineEnergy
+    """
+    return CACHE.get("LineEnergy", atomic_number, line)
+
+
+def CS_Total(atomic_number, energy):
+    """ cached xraylib.CS_Total
+    """
+    return CACHE.get("CS_Total", atomic_number, energy)
+
+
+def ElementDensity(atomic_number):
+    """ cached xraylib.ElementDensity
+    """
+    return CACHE.get("ElementDensity", atomic_number)
+
+
+def line_energies(atomic_number, lines):
+    """ energies of several lines of one element in keV, 0 for the lines the
+    element does not have
+
+    :param lines: list of xraylib line
+    :rtype: numpy.ndarray
+    """
+    return CACHE.get_many("LineEnergy",
+                          [(atomic_number, line) for line in lines], 0.)
+
+
+def cs_total_many(atomic_number, energies):
+    """ total cross section of one element for several energies in keV, 0
+    out of the xraylib tables
+
+    :rtype: numpy.ndarray
+    """
+    return CACHE.get_many("CS_Total",
+                          [(atomic_number, energy) for energy in energies], 0.)
+
+
+def cs_total_cp_many(material, energies):
+    """ total cross section of one material for several energies in keV, 0
+    out of the xraylib tables
+
+    :rtype: numpy.ndarray
+    """
+    return CACHE.get_many("CS_Total_CP",
+                          [(material, energy) for energy in energies], 0.)
@@ -8,7 +8,7 @@ Implementation of class for describing model entity like stack...
 .. moduleauthor:: Gael PICOT <gael.picot@free.fr>
 """
 from abc import ABCMeta, abstractmethod
-import re
+from collections import OrderedDict
 import copy
 import quantities as pq
 import xraylib
@@ -86,6 +86,21 @@ class PhysicalComputer(object):
         """
         pass
 
+    def compute_f_list(self, materials):
+        """ compute structure factor of each material
+        """
+        return [self.compute_f(material) for material in materials]
+
+    def compute_f_many(self, stoich_matrix, element_index):
+        """ compute structure factor of many materials
+
+        :param stoich_matrix: number of atom of each element (column) in each
+                              material (row)
+        :param element_index: symbol of each column
+        """
+        return [self.compute_f(tools.normalized_string(element_index, row))
+                for row in stoich_matrix]
+
 
 class NoneComputer(PhysicalComputer):
     """ don't compute anythings.
@@ -105,34 +120,86 @@ class XraylibPhysicalComputer(PhysicalComputer):
     """ tool to calculate the structure factor and the index of refraction
     using xraylib.
     """
+    #: last atomic factor tables by energy, shared by every computer
+    _f_tables = OrderedDict()
+    #: maximum number of tables kept
+    max_f_tables = 16
+    #: last atomic number with atomic factors in xraylib
+    max_atomic_number = 98
+
+    @property
+    def f_table(self):
+        """ f0+f'-if'' at the current energy of each element by atomic
+        number (nan where xraylib has no value)
+        """
+        in_energy_eV = self._in_energy_eV
+        tables = XraylibPhysicalComputer._f_tables
+        try:
+            table = tables.pop(in_energy_eV)
+        except KeyError:
+            table = np.full(self.max_atomic_number + 1, np.nan,
+                            dtype=np.complex128)
+            for atomic_number in range(1, self.max_atomic_number + 1):
+                # static structure factor can be calculated as an
+                # Atomic_Factors(element,energy,q,DW)
+                # where q is scattering vector: q = 0. for forward scattering
+                # DW is a Debye-Waller factor: DW = 1.
+                try:
+                    f0, f_re, f_im = xraylib.Atomic_Factors(
+                        atomic_number, in_energy_eV/1000., 0., 1.)
+                except ValueError:
+                    continue
+                table[atomic_number] = f0 + f_re - 1.0j*f_im
+            table.flags.writeable = False
+        tables[in_energy_eV] = table
+        while len(tables) > self.max_f_tables:
+            tables.popitem(last=False)
+        return table
+
+    def atomic_f(self, element_index):
+        """ atomic structure factor of each element
+
+        :param element_index: atomic number or symbol of each element
+        :rtype: numpy.ndarray
+        """
+        atomic_numbers = np.array([xraylib.SymbolToAtomicNumber(element)
+                                   if isinstance(element, str) else element
+                                   for element in element_index], dtype=int)
+        atomic_f = self.f_table[atomic_numbers]
+        if np.any(np.isnan(atomic_f)):
+            raise ValueError("no atomic factor for Z=" +
+                             str(atomic_numbers[np.isnan(atomic_f)]) +
+                             " at " + str(self._in_energy_eV) + " eV")
+        return atomic_f
+
     def compute_f(self, material):
         """ compute structure factor using xraylib
 
         :param material: material name
         :type material: str
         """
-        f_xraylib = []
-        in_energy_eV = self._in_energy_eV
-        list_of_elements = tools.extract_elements(material)
-        list_of_stoichios = tools.formula_to_stoichios_norm(material)
-        mat_f_re = 0
-        mat_f_im = 0
-        for el_idx, el in enumerate(list_of_elements):
-            # static structure factor can be calculated as an
-            # Atomic_Factors(element,energy,q,DW)
-            # where q is scattering vector: q = 0. for forward scattering
-            # DW is a Debye-Waller factor: DW = 1.
-            mat_f_re = (mat_f_re+list_of_stoichios[el_idx] *
-                        np.sum(xraylib.
-                               Atomic_Factors(xraylib.
-                                              SymbolToAtomicNumber(el),
-                                              in_energy_eV/1000., 0., 1.)
-                               [0:2]))
-            mat_f_im = (mat_f_im + list_of_stoichios[el_idx] * xraylib.
-                        Atomic_Factors(xraylib.SymbolToAtomicNumber(el),
-                                       in_energy_eV/1000., 0., 1.)[2])
-        f_xraylib = np.append(f_xraylib, mat_f_re-1.0j*mat_f_im)
-        return f_xraylib[0]
+        formula = tools.FORMULAS.get(material)
+        return np.dot(formula.stoichios_norm,
+                      self.atomic_f(formula.atomic_numbers))
+
+    def compute_f_many(self, stoich_matrix, element_index):
+        """ compute structure factor of many materials
+
+        :param stoich_matrix: number of atom of each element (column) in each
+                              material (row), normalized by row
+        :param element_index: atomic number or symbol of each column
+        :rtype: numpy.ndarray
+        """
+        stoich_matrix = np.asarray(stoich_matrix, dtype=np.float64)
+        stoich_matrix = (stoich_matrix /
+                         np.sum(stoich_matrix, axis=-1)[..., np.newaxis])
+        return np.dot(stoich_matrix, self.atomic_f(element_index))
+
+    def compute_f_list(self, materials):
+        """ compute structure factor of each material
+        """
+        matrix, elements = tools.FORMULAS.stoichio_matrix(materials)
+        return list(self.compute_f_many(matrix, elements))
 
     def compute_n(self, material):
         """ compute index of refraction using xraylib
@@ -239,9 +306,8 @@ class LayerData(paf.data.CompositeData):
 
         :return: default value of all stochio with mass density
         """
-        stochio_find = re.findall("_[0-9.]*", self["material"].value)
-        stochio = [float(pv[1:]) for pv in stochio_find]
-        return stochio
+        formula = tools.StochioFormula(self["material"].value)
+        return formula.values.tolist()
 
     @property
     def density_translator(self):
@@ -292,8 +358,8 @@ class ProfileComputer(paf.data.CompositeData):
         :param x: vector of value for slicing
         :type x: numpy.ndarray
         """
-        concs = [0] + self._func(x).tolist()
-        point = np.array([self._stochio * conc for conc in concs])
+        concs = np.concatenate(([0.], self._func(x)))
+        point = concs[:, np.newaxis] * self.stochio[np.newaxis, :]
         r_m_1 = point[:-1]
         r_p_1 = point[1:]
         res = (r_m_1 + r_p_1)/2.
@@ -345,6 +411,8 @@ class ProfileConc(paf.data.CompositeData):
         self._elements_dict = None
         self._listifier = []
         self._els = []
+        #: column of the elements of each computer in stoichio matrix
+        self._columns = None
 
     def __call__(self, x):
         """ compute profil
@@ -352,31 +420,53 @@ class ProfileConc(paf.data.CompositeData):
         :param nb_sub: number of subdivising
         :type nb_sub: int
         """
-        concs = [computer(x) for computer in self["computers"]]
-        total_stoichio = []
-        for el in self._listifier:
-            sto = 0
-            for x, y in el:
-                sto += concs[x][:, y]
-            total_stoichio.append(sto)
-        total_stoichio = np.array(total_stoichio).T
-        total_stoichio = [stoichio/np.sum(stoichio)
-                          for stoichio in total_stoichio]
+        return self.materials(self.stoichio_matrix(x)[0])
+
+    @property
+    def atomic_numbers(self):
+        """ atomic number of each column of stoichio matrix
+        """
+        return [xraylib.SymbolToAtomicNumber(str(el)) for el in self._els]
+
+    def stoichio_matrix(self, x):
+        """ normalized stoichio of each element (column) in each sublayer
+        (row)
+
+        :param x: vector of value for slicing
+        :return: matrix (sublayers, elements) and symbol of elements
+        """
+        if self._columns is None:
+            self.create_listifier()
+        if len(self._els) == 0:
+            # no computer, no sublayer
+            return np.zeros((0, 0)), []
+        matrix = np.zeros((len(x), len(self._els)))
+        for computer, columns in zip(self["computers"], self._columns):
+            matrix[:, columns] += computer(x)
+        matrix /= np.sum(matrix, axis=1)[:, np.newaxis]
+        return matrix, list(self._els)
+
+    def materials(self, stoich_matrix):
+        """ normalized formula of each sublayer, elements, stoichiometries,
+        mass fractions and molar masses are registered in tools.FORMULAS
+        from the matrix so formulas are never parsed.
+
+        :param stoich_matrix: stoichio matrix of the sublayers
+        :rtype: list
+        """
+        atomic_numbers = self.atomic_numbers
         result = []
-        for layer in total_stoichio:
-            line = ""
-            for idx, sto in enumerate(layer):
-                res = "{:f}".format(sto)
-                if sto <= 0.000001:
-                    res = '0.000001'
-                line += self._els[idx] + res
-            result.append(line)
+        for row in stoich_matrix:
+            material = tools.normalized_string(self._els, row)
+            tools.FORMULAS.register(material, atomic_numbers, row)
+            result.append(material)
         return result
 
     def add_computer(self, computer):
         """ add a new profile computer
         """
         self['computers'].append(computer)
+        self._columns = None
 
     def remove_computer(self, index):
         """ remove coputer at  selected index
@@ -385,11 +475,13 @@ class ProfileConc(paf.data.CompositeData):
         :type index: int
         """
         del self['computers'][index]
+        self._columns = None
 
     def change_computer(self, index, value):
         """ change computer at index
         """
         self["computers"][index] = value
+        self._columns = None
 
     def create_listifier(self):
         """ create structure to know how create final structure
@@ -408,6 +500,9 @@ class ProfileConc(paf.data.CompositeData):
                 else:
                     self._els.append(el)
                     self._listifier.append([(idx1, idx2)])
+        self._columns = [np.array([self._els.index(el) for el in element_list],
+                                  dtype=int)
+                         for element_list in element_lists]
         return self._listifier
 
 
@@ -479,6 +574,8 @@ class LayerProfileData(LayerData):
             if isinstance(value, paf.data.Data):
                 value = value.value
             self._x = value
+            # depths of the sublayers follow the slicing
+            self.cmp_d()
         elif key == "d":
             if isinstance(value, paf.data.Data):
                 value = value.value
@@ -589,20 +686,17 @@ class LayerProfileData(LayerData):
         """ return dictionnary with for each element in key give numpy array
         of concentration in each sublayers
         """
-        materials = self["materials"](self._x)
-        materials_dict = {key: [tools.formula_to_stoichios(formula)[idx]
-                                for formula in materials]
-                          for idx, key in
-                          enumerate(tools.extract_elements(materials[0]))}
-        for key, mat in materials_dict.items():
-            materials_dict[key] = np.array(mat)
-        return materials_dict
+        matrix, elements = self["materials"].stoichio_matrix(self._x)
+        return {key: matrix[:, idx] for idx, key in enumerate(elements)}
 
     def to_stack(self):
         """ return stack representing current layer
         """
-        materials = self["materials"](self._x)
+        matrix, elements = self["materials"].stoichio_matrix(self._x)
+        materials = self["materials"].materials(matrix)
         densities = self["densities"](self._x)
+        if self.phy_cmp is not None:
+            f_list = self._phy_cmp.compute_f_many(matrix, elements)
         res = []
         for idx, mat in enumerate(materials):
             name = self["name"].value
@@ -618,7 +712,7 @@ class LayerProfileData(LayerData):
                                   numerical_density=densities[idx],
                                   d=self._d[idx], sigmar=sigmar)
             if self.phy_cmp is not None:
-                new_layer['f'] = self._phy_cmp.compute_f(new_layer['material'])
+                new_layer['f'] = f_list[idx]
             res.append(new_layer)
         return res
 
@@ -635,24 +729,49 @@ class LayerProfileData(LayerData):
 
     def to_param(self):
         """ return a dictionnary with key "material" and "mass_density" or
-        "numeric_density" (depend on type fo profile density)
+        "numeric_density" (depend on type fo profile density), the stoichio
+        matrix of the sublayers and its elements.
         """
-        materials = self["materials"](self._x)
-        if self["densities"]["type"].value == "num":
-            num_densities = self["densities"](self._x)
-            mass_densities = [tools.calc_mass_density(num_density,
-                                                      materials[idx])
-                              for idx, num_density in enumerate(num_densities)]
-            mass_densities = np.array(mass_densities)
-        else:
-            mass_densities = self["densities"](self._x)
-            num_densities = [tools.calc_num_density(num_density,
-                                                    materials[idx])
-                             for idx, num_density in enumerate(num_densities)]
-            num_densities = np.array(num_densities)
+        matrix, elements = self["materials"].stoichio_matrix(self._x)
+        materials = self["materials"].materials(matrix)
+        num_densities, mass_densities = self.densities(matrix)
         return {"d": self._d, "materials": materials,
                 "num_densities": num_densities,
-                "mass_densities": mass_densities}
+                "mass_densities": mass_densities,
+                "stoichios": matrix, "elements": elements}
+
+    def densities(self, stoich_matrix):
+        """ numerical and mass density of each sublayer
+
+        :param stoich_matrix: stoichio matrix of the sublayers
+        :return: numerical densities and mass densities
+        """
+        mass_factors = (tools.molar_masses(self["materials"].atomic_numbers,
+                                           stoich_matrix) *
+                        1e24 / tools.Avogadro_const)
+        densities = np.asarray(self["densities"](self._x), dtype=np.float64)
+        if self["densities"]["type"].value == "num":
+            return densities, densities * mass_factors
+        return densities / mass_factors, densities
+
+    def to_parameters(self, parameters, end, start):
+        """ write the sublayers in parameter arrays of a simulator, from end
+        to start (included) as parameters begin with the substrate. No
+        layer data is created.
+
+        :param parameters: parameters of a simulator
+        :type parameters: dict
+        :param end: index of the last sublayer in parameters
+        :param start: index of the first sublayer in parameters
+        """
+        matrix, _ = self["materials"].stoichio_matrix(self._x)
+        num_densities, mass_densities = self.densities(matrix)
+        sublayers = slice(end, start + 1)
+        parameters["material"][sublayers] = \
+            self["materials"].materials(matrix[::-1])
+        parameters["d"][sublayers] = self._d[::-1]
+        parameters["numerical_density"][sublayers] = num_densities[::-1]
+        parameters["mass_density"][sublayers] = mass_densities[::-1]
 
 
 class SourceData(paf.data.CompositeData):
@@ -709,7 +828,7 @@ class DetectorData(paf.data.CompositeData):
 
 class XRRDetectorData(DetectorData):
     def __init__(self, res=0.0001, respoints=5, Ibkg=0., restype=2,
-                 resintrange=2, taylor_n=1.):
+                 resintrange=2, taylor_n=1., quadrature="uniform"):
         """ initialization
 
         :param res: angular resolution in degrees
@@ -718,28 +837,34 @@ class XRRDetectorData(DetectorData):
         :type respoints: integer
         :param Ibkg: background signal intensity
         :type Ibkg: real
-        :param restype: resolution convolution type
+        :param restype: resolution convolution type (0: none, 1: fast, 2:
+                        resolution vector, 3: varying, 4: fast with FFT)
         :type restype: integer
         :param resintrange: range for resolution in convolution
         :type resintrange: integer
         :param taylor_n: degree of Taylor expansion
         :type taylor_n: integer
+        :param quadrature: resolution vector quadrature ("uniform" or
+                           "gauss_hermite")
+        :type quadrature: str
         """
         dic = {'res': {"value": res, "unit": pq.deg}, 'respoints': respoints,
                'Ibkg': Ibkg, 'restype': restype, 'resintrange': resintrange,
-               'taylor_n': taylor_n}
+               'taylor_n': taylor_n, 'quadrature': quadrature}
         paf.data.CompositeData.__init__(self, dic, abstract="XRRDetector")
         self.showing_info = [("restype", 'Resolution convolution type'),
                              ("res", "Instrumental resolution"),
                              ("resintrange", "Number of standard deviations to integrate the resolution function"), 
                              ("respoints", "Number of points to include in the resolution calculation"), 
                              ("taylor_n", "Degree of the Taylor expansion used for the correlation function"), 
+                             ("quadrature", "Quadrature of the resolution points (uniform or gauss_hermite)"),
                              ("Ibkg", "Background intensity")]
 
 class XRFDetectorData(DetectorData):
     def __init__(self, res=0.0005, dist=0., det_angle_array=90., resintrange=2,
                  respoints=5, restype=2, taylor_n=1., width_parallel_s=0.5,
-                 width_parallel_l=0.5, pinhole_height=0.5):
+                 width_parallel_l=0.5, pinhole_height=0.5,
+                 quadrature="uniform"):
         """ initialization
 
         :param dist: distance from sample to XRF detector window in cm
@@ -752,6 +877,9 @@ class XRFDetectorData(DetectorData):
         :type width_parallel_l: real
         :param pinhole_height: colimator lenth
         :type pinhole_height: real
+        :param quadrature: resolution vector quadrature ("uniform" or
+                           "gauss_hermite")
+        :type quadrature: str
         """
         dic = {'res': {"value": res, "unit": pq.deg}, 'respoints': respoints,
                'restype': restype, 'taylor_n': taylor_n,
@@ -760,7 +888,7 @@ class XRFDetectorData(DetectorData):
                'width_parallel_l': {"value": width_parallel_l, "unit": pq.cm},
                'pinhole_height': {"value": pinhole_height, "unit": pq.cm},
                'det_angle_array': det_angle_array, 'resintrange': resintrange,
-               "void": True}
+               "void": True, 'quadrature': quadrature}
         paf.data.CompositeData.__init__(self, dic, abstract="XRFDetector")
 
 
@@ -790,6 +918,31 @@ class SubStack(paf.data.CompositeData):
         paf.data.CompositeData.__init__(self, value=dic, abstract="stack")
 
 
+class ExpandedLayersData(paf.data.ListData):
+    """ read only list of the expanded layers of a stack, the same list is
+    returned by every read until the stack is invalidated.
+    """
+    def __init__(self, layers=()):
+        """ initialization
+
+        :param layers: expanded layers
+        :type layers: tuple
+        """
+        paf.data.ListData.__init__(self, list(layers))
+
+    def _read_only(self, *args):
+        """ expanded layers can't be modified
+        """
+        raise TypeError("expanded layers are read only, edit the layers of "
+                        "the stack")
+
+    __setitem__ = _read_only
+    __delitem__ = _read_only
+    insert = _read_only
+    append = _read_only
+    clear = _read_only
+
+
 class StackData(paf.data.CompositeData):
     """ Class for modeling a sample.
     """
@@ -812,6 +965,14 @@ class StackData(paf.data.CompositeData):
         dic = {"repetition": []}
         self._physical_computer_type = physical_computer_type
         self._physical_computer = None
+        #: expanded layers, None until the next read
+        self._expanded = None
+        #: read only list of the expanded layers
+        self._layers_data = None
+        self._layers_version = 0
+        self._blocks = []
+        #: profile layer and its sublayers by id of the layer
+        self._profile_stacks = {}
         paf.data.CompositeData.__init__(self, value=dic, abstract="stack")
         if ambient is not None:
             self._value["ambient"] = ambient
@@ -823,32 +984,109 @@ class StackData(paf.data.CompositeData):
         """ new getitem for adding repetition in layers
         """
         if key == "layers":
-            layers = self._value["layers"].real_value
-            starts = []
-            in_sub = []
-            stops = []
-            for sub in self["repetition"]:
-                starts.append(sub["start"].value)
-                stops.append(sub["stop"].value)
-                in_sub += range(sub["start"].value, sub["stop"].value)
-            result = []
-            for index, layer in enumerate(layers):
-                if index in starts:
-                    index_in_rep = starts.index(index)
-                    repetition = (self["repetition"][index_in_rep]
-                                  ["repetition"].value)
-                    sub = layers[starts[index_in_rep]:stops[index_in_rep]]
-                    result += sub * repetition
-                elif index in in_sub:
-                    pass
-                elif isinstance(layer, LayerProfileData):
-                    layer["materials"].create_listifier()
-                    result += layer.to_stack()
-                else:
-                    result.append(layer)
-            return MAKE_DATA(result)
+            if self._layers_data is None:
+                self._layers_data = ExpandedLayersData(self.expanded_layers)
+            return self._layers_data
         return paf.data.CompositeData.__getitem__(self, key)
 
+    def __setitem__(self, key, value):
+        """ modify an element, expanded layers are computed again
+        """
+        paf.data.CompositeData.__setitem__(self, key, value)
+        self.invalidate_layers()
+
+    @property
+    def layers_version(self):
+        """ version of the expanded layers, incremented each time they are
+        invalidated
+        """
+        return self._layers_version
+
+    @property
+    def expanded_layers(self):
+        """ layers with repetitions and profiles expanded. The same tuple is
+        returned until invalidate_layers is called.
+
+        :rtype: tuple
+        """
+        if self._expanded is None:
+            self._expanded = tuple(self._expand())
+        return self._expanded
+
+    def _expand(self):
+        """ expand repetitions and profiles, the sublayers of a profile are
+        only computed if they are not kept from the previous expansion
+        """
+        layers = self._value["layers"].real_value
+        starts = []
+        in_sub = []
+        stops = []
+        for sub in self["repetition"]:
+            starts.append(sub["start"].value)
+            stops.append(sub["stop"].value)
+            in_sub += range(sub["start"].value, sub["stop"].value)
+        result = []
+        profile_stacks = {}
+        blocks = []
+        for index, layer in enumerate(layers):
+            if index in starts:
+                index_in_rep = starts.index(index)
+                repetition = (self["repetition"][index_in_rep]
+                              ["repetition"].value)
+                sub = layers[starts[index_in_rep]:stops[index_in_rep]]
+                blocks.append((len(result), len(sub), repetition))
+                result += sub * repetition
+            elif index in in_sub:
+                pass
+            elif isinstance(layer, LayerProfileData):
+                cached = self._profile_stacks.get(id(layer))
+                if cached is None:
+                    layer["materials"].create_listifier()
+                    # layer is kept to keep its id
+                    cached = (layer, layer.to_stack())
+                profile_stacks[id(layer)] = cached
+                result += cached[1]
+            else:
+                result.append(layer)
+        self._profile_stacks = profile_stacks
+        self._blocks = blocks
+        return result
+
+    @property
+    def periodic_blocks(self):
+        """ repeated substacks in expanded layers: list of tuple (index of
+        first layer, number of layers of a period, repetition)
+        """
+        self.expanded_layers
+        return list(self._blocks)
+
+    def invalidate_layers(self, layer=None):
+        """ expand again the layers at the next read. Must be called after
+        editing the layers or a profile without the setters of the stack.
+
+        :param layer: edited profile, its sublayers are computed again (every
+                      profile if None)
+        :type layer: LayerProfileData
+        """
+        self._reset_expansion()
+        if layer is None:
+            self._profile_stacks = {}
+        else:
+            self._profile_stacks.pop(id(layer), None)
+
+    def _reset_expansion(self):
+        """ expand again the layers at the next read, sublayers of profiles
+        are kept
+        """
+        self._expanded = None
+        self._layers_data = None
+        self._layers_version += 1
+
+    def finish_copy(self):
+        """ the copy expands its own layers
+        """
+        self.invalidate_layers()
+
     def del_substack(self, index):
         """ del repetition for the index
         """
@@ -857,6 +1095,7 @@ class StackData(paf.data.CompositeData):
         for current_index, range_ in enumerate(rep_range):
             if index in range_:
                 del self["repetition"][current_index]
+        self._reset_expansion()
 
     def create_substack(self, start, stop, repetition):
         """ transform layer start to stop in a sublayer
@@ -866,11 +1105,13 @@ class StackData(paf.data.CompositeData):
             self.del_substack(index)
         if repetition != 1:
             self["repetition"].append(SubStack(start, stop, repetition))
+        self._reset_expansion()
 
     def set_from_xml(self, xml_element):
         paf.data.CompositeData.set_from_xml(self, xml_element)
         if isinstance(self["repetition"], paf.data.SimpleData):
             self["repetition"] = []
+        self.invalidate_layers()
 
     def apply_rep(self, index):
         """ apply repetition starting at index
@@ -905,6 +1146,7 @@ class StackData(paf.data.CompositeData):
                 rep["start"] = rep["start"].value + diff
                 rep["stop"] = rep["stop"].value + diff
         self._value["layers"] = MAKE_DATA(result)
+        self.invalidate_layers()
 
     @property
     def density_translator(self):
@@ -925,6 +1167,7 @@ class StackData(paf.data.CompositeData):
         self._physical_computer_type = value
         if self._physical_computer is not None:
             self._physical_computer = self._physical_computer_type()
+            self.invalidate_layers()
 
     @property
     def physical_computer(self):
@@ -948,10 +1191,18 @@ class StackData(paf.data.CompositeData):
         """ setter for wavelength property
         """
         phy_comp = self.physical_computer
+        try:
+            old_energy = phy_comp.energy
+        except AttributeError:
+            old_energy = None
         phy_comp.wavelength = wavelength
+        if phy_comp.energy != old_energy:
+            self.invalidate_layers()
         for layer in self._value["layers"]:
             if isinstance(layer, LayerProfileData):
-                layer.phy_cmp = phy_comp
+                if layer.phy_cmp is not phy_comp:
+                    layer.phy_cmp = phy_comp
+                    self.invalidate_layers(layer)
             else:
                 f = phy_comp.compute_f(layer['material'])
                 layer['f'] = f
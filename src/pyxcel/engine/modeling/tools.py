@@ -7,6 +7,8 @@ Implementation of tools function and class.
 
 .. moduleauthor:: Gael PICOT <gael.picot@free.fr>
 """
+from collections import OrderedDict
+import re
 import xraylib
 import numpy as np
 import periodictable
@@ -17,33 +19,379 @@ Avogadro_const = 6.02214129e23  # [mol=1]
 el_q = 1.602176462E-19  # C
 h_J = 6.62606876E-34  # s
 speed_of_light = 2.99792458E+10  # cm/s
+electron_radius = 2.8179403267e-5  # A
 
 lambda_to_energy = (h_J/el_q)*speed_of_light  # for E to lambda conversion
 
 
-def normalize(chem_formula):
-    """ return normalized chemical formula
+def normalized_string(elements, stoichios):
+    """ chemical formula of elements with normalized stoichios
     """
-    stoichios = formula_to_stoichios_norm(chem_formula)
     result = ""
-    for idx, element in enumerate(extract_elements(chem_formula)):
-        res = "{:f}".format(stoichios[idx])
-        if stoichios[idx] <= 0.000001:
-                res = '0.000001'
+    for element, stoichio in zip(elements, stoichios):
+        res = "{:f}".format(stoichio)
+        if stoichio <= 0.000001:
+            res = '0.000001'
         result += element + res
     return result
 
 
+#: symbol, atomic weight in xraylib and mass in periodictable by atomic number
+_ELEMENTS = {}
+
+
+def element_tables(atomic_numbers):
+    """ symbol, atomic weight (xraylib) and mass (periodictable) of each
+    element
+
+    :param atomic_numbers: atomic number of each element
+    :return: list of symbol, numpy.ndarray of weight and of mass
+    """
+    for atomic_number in atomic_numbers:
+        atomic_number = int(atomic_number)
+        if atomic_number not in _ELEMENTS:
+            _ELEMENTS[atomic_number] = (
+                xraylib.AtomicNumberToSymbol(atomic_number),
+                xraylib.AtomicWeight(atomic_number),
+                periodictable.elements[atomic_number].mass)
+    tables = [_ELEMENTS[int(atomic_number)] for atomic_number in atomic_numbers]
+    return ([symbol for symbol, _, _ in tables],
+            np.array([weight for _, weight, _ in tables], dtype=np.float64),
+            np.array([mass for _, _, mass in tables], dtype=np.float64))
+
+
+def molar_masses(atomic_numbers, stoich_matrix):
+    """ molar mass of the normalized formula of each row of stoich_matrix, as
+    periodictable computes it from the normalized chemical formula
+
+    :param atomic_numbers: atomic number of each column
+    :param stoich_matrix: number of atom of each element on the last axis
+    :rtype: numpy.ndarray
+    """
+    stoich_matrix = np.asarray(stoich_matrix, dtype=np.float64)
+    fractions = stoich_matrix / np.sum(stoich_matrix, axis=-1,
+                                       keepdims=True)
+    # fractions as written in the normalized formula
+    fractions = np.where(fractions <= 0.000001, 0.000001,
+                         np.round(fractions, 6))
+    return np.dot(fractions, element_tables(atomic_numbers)[2])
+
+
+class Formula(object):
+    """ chemical formula parsed once with xraylib, its molar mass is the one
+    of its normalized formula in periodictable
+    """
+    def __init__(self, chemical_formula=None):
+        """ initialization
+
+        :param chemical_formula: formula without stochio marker, None for a
+                                 formula set by set_stoichios
+        :type chemical_formula: str
+        """
+        if chemical_formula is not None:
+            parsed = xraylib.CompoundParser(chemical_formula)
+            self.set_stoichios(parsed['Elements'], parsed['nAtoms'])
+
+    @classmethod
+    def from_stoichios(cls, atomic_numbers, stoichios):
+        """ formula of a number of atom of each element, without parsing
+
+        :param atomic_numbers: atomic number of each element
+        :param stoichios: number of atom of each element
+        :rtype: Formula
+        """
+        formula = cls()
+        formula.set_stoichios(atomic_numbers, stoichios)
+        return formula
+
+    def set_stoichios(self, atomic_numbers, stoichios):
+        """ compute every array of the formula from its number of atom
+
+        :param atomic_numbers: atomic number of each element
+        :param stoichios: number of atom of each element
+        """
+        #: atomic number of each element
+        self.atomic_numbers = np.array(atomic_numbers, dtype=int)
+        symbols, atomic_weights, _ = element_tables(self.atomic_numbers)
+        #: symbol of each element
+        self.elements = np.array(symbols)
+        #: number of atom of each element
+        self.stoichios = np.array(stoichios, dtype=np.float64)
+        #: fraction of atom of each element
+        self.stoichios_norm = self.stoichios / np.sum(self.stoichios)
+        weights = self.stoichios * atomic_weights
+        #: mass fraction of each element
+        self.mass_fractions = weights / np.sum(weights)
+        #: formula with fractions of atom
+        self.normalized = normalized_string(self.elements,
+                                            self.stoichios_norm)
+        #: molar mass of the normalized formula
+        self.molar_mass = molar_masses(self.atomic_numbers, self.stoichios)
+        for array in (self.atomic_numbers, self.elements, self.mass_fractions,
+                      self.stoichios, self.stoichios_norm):
+            # arrays are shared by every user of the formula
+            array.flags.writeable = False
+
+    @property
+    def mass_factor(self):
+        """ mass density for a numerical density of 1
+        """
+        return self.molar_mass*1e24/Avogadro_const
+
+
+class FormulaService(object):
+    """ least recently used cache of parsed chemical formulas
+    """
+    def __init__(self, maxsize=4096):
+        """ initialization
+
+        :param maxsize: maximum number of formulas kept
+        :type maxsize: int
+        """
+        self._maxsize = maxsize
+        self._formulas = OrderedDict()
+        #: number of formula found in the cache
+        self.hits = 0
+        #: number of formula parsed
+        self.misses = 0
+
+    def clear(self):
+        """ drop every formula
+        """
+        self._formulas.clear()
+
+    def get(self, chemical_formula):
+        """ parsed formula, stochio markers are ignored
+
+        :rtype: Formula
+        """
+        key = clear_marker(chemical_formula)
+        try:
+            formula = self._formulas.pop(key)
+        except KeyError:
+            self.misses += 1
+            formula = Formula(key)
+        else:
+            self.hits += 1
+        self._remember(key, formula)
+        return formula
+
+    def register(self, chemical_formula, atomic_numbers, stoichios):
+        """ formula known by its number of atom, it is not parsed
+
+        :param chemical_formula: name of the formula
+        :param atomic_numbers: atomic number of each element
+        :param stoichios: number of atom of each element
+        :rtype: Formula
+        """
+        key = clear_marker(chemical_formula)
+        try:
+            formula = self._formulas.pop(key)
+        except KeyError:
+            formula = Formula.from_stoichios(atomic_numbers, stoichios)
+        self._remember(key, formula)
+        return formula
+
+    def _remember(self, key, formula):
+        """ keep formula as the most recently used one
+        """
+        self._formulas[key] = formula
+        while len(self._formulas) > self._maxsize:
+            self._formulas.popitem(last=False)
+
+    def molar_masses(self, chemical_formulas):
+        """ molar mass of the normalized formula of each formula
+
+        :rtype: numpy.ndarray
+        """
+        return np.array([self.get(formula).molar_mass
+                         for formula in chemical_formulas])
+
+    def mass_factors(self, chemical_formulas):
+        """ mass density for a numerical density of 1 of each formula
+
+        :rtype: numpy.ndarray
+        """
+        return self.molar_masses(chemical_formulas)*1e24/Avogadro_const
+
+    def stoichio_matrix(self, chemical_formulas, elements=None,
+                        normalized=False):
+        """ number of atom of each element in each formula
+
+        :param elements: symbol of the columns, elements of the formulas in
+                         order of appearance if None
+        :param normalized: True for fractions of atom
+        :return: matrix (formulas, elements) and symbol of elements
+        """
+        formulas = [self.get(formula) for formula in chemical_formulas]
+        if elements is None:
+            elements = []
+            for formula in formulas:
+                elements.extend(element for element in formula.elements
+                                if element not in elements)
+        column = dict((element, index) for index, element in
+                      enumerate(elements))
+        matrix = np.zeros((len(formulas), len(elements)))
+        for row, formula in enumerate(formulas):
+            stoichios = (formula.stoichios_norm if normalized else
+                         formula.stoichios)
+            for element, stoichio in zip(formula.elements, stoichios):
+                if element in column:
+                    matrix[row, column[element]] = stoichio
+        return matrix, list(elements)
+
+
+#: formulas used by models and simulators
+FORMULAS = FormulaService()
+
+
+class StochioFormula(object):
+    """ chemical formula with stochio markers ("_" before a fitted
+    coefficient), parsed once. Number of atom of each element are products
+    of coefficients, so fitted coefficients are applied with arrays.
+    """
+    _token = re.compile(r"([A-Z][a-z]?)|(\()|(\))|(_?)(\d*\.?\d*)")
+
+    def __init__(self, marked_formula):
+        """ initialization
+
+        :param marked_formula: formula with stochio markers
+        :type marked_formula: str
+        """
+        #: formula with stochio markers
+        self.marked_formula = marked_formula
+        coefficients = []
+        fitted = []
+        pieces = []
+        # (atomic number, index of its coefficients) in each open group
+        groups = [[]]
+        last = None
+        position = 0
+        start = 0
+        while position < len(marked_formula):
+            match = self._token.match(marked_formula, position)
+            if match.end() == position:
+                raise ValueError("invalid chemical formula " + marked_formula)
+            position = match.end()
+            symbol, opening, closing, marker, number = match.groups()
+            if symbol:
+                atomic_number = xraylib.SymbolToAtomicNumber(symbol)
+                if atomic_number == 0:
+                    raise ValueError("unknown element " + symbol)
+                last = [(atomic_number, [])]
+                groups[-1].extend(last)
+            elif opening:
+                groups.append([])
+                last = None
+            elif closing and len(groups) > 1:
+                last = groups.pop()
+                groups[-1].extend(last)
+            elif last is not None and not closing:
+                if marker:
+                    fitted.append(len(coefficients))
+                    pieces.append(marked_formula[start:match.start()])
+                    start = match.end()
+                coefficients.append(float(number) if number else 1.)
+                for _, indexes in last:
+                    indexes.append(len(coefficients) - 1)
+                last = None
+            else:
+                raise ValueError("invalid chemical formula " + marked_formula)
+        if len(groups) > 1:
+            raise ValueError("invalid chemical formula " + marked_formula)
+        pieces.append(marked_formula[start:])
+        occurrences = groups[0]
+
+        #: atomic number of each element
+        self.atomic_numbers = np.unique([atomic_number for atomic_number, _
+                                         in occurrences])
+        #: default value of each fitted coefficient
+        self.values = np.array([coefficients[index] for index in fitted],
+                               dtype=np.float64)
+        # coefficients followed by 1 for occurrences without coefficient
+        self._coefficients = np.append(np.array(coefficients,
+                                                dtype=np.float64), 1.)
+        self._fitted = np.array(fitted, dtype=int)
+        self._pieces = pieces
+        depth = max([len(indexes) for _, indexes in occurrences] + [1])
+        # coefficients multiplied for each occurrence of an element
+        self._paths = np.full((len(occurrences), depth), len(coefficients),
+                              dtype=int)
+        # element of each occurrence
+        self._columns = np.zeros((len(occurrences),
+                                  len(self.atomic_numbers)))
+        for row, (atomic_number, indexes) in enumerate(occurrences):
+            self._paths[row, :len(indexes)] = indexes
+            column = np.searchsorted(self.atomic_numbers, atomic_number)
+            self._columns[row, column] = 1.
+
+    @property
+    def elements(self):
+        """ symbol of each element
+        """
+        return [xraylib.AtomicNumberToSymbol(int(Z))
+                for Z in self.atomic_numbers]
+
+    def stoichios(self, values=None):
+        """ number of atom of each element
+
+        :param values: value of each fitted coefficient on the last axis,
+                       default values if None
+        :rtype: numpy.ndarray
+        """
+        if values is None:
+            values = self.values
+        values = np.asarray(values, dtype=np.float64)
+        coefficients = np.empty(values.shape[:-1] +
+                                self._coefficients.shape)
+        coefficients[...] = self._coefficients
+        coefficients[..., self._fitted] = values
+        return np.dot(np.prod(coefficients[..., self._paths], axis=-1),
+                      self._columns)
+
+    def formula(self, values=None, marked=()):
+        """ chemical formula for display and saving
+
+        :param values: value of each fitted coefficient, default values if
+                       None
+        :param marked: index of fitted coefficients keeping their marker
+        :rtype: str
+        """
+        if values is None:
+            values = self.values
+        result = self._pieces[0]
+        for index, piece in enumerate(self._pieces[1:]):
+            if index in marked:
+                result += "_"
+            result += str(values[index]) + piece
+        return result
+
+    def material(self, values=None):
+        """ chemical formula of fitted coefficients, its elements,
+        stoichiometries, mass fractions and molar mass are registered in
+        FORMULAS from the arrays.
+
+        :rtype: str
+        """
+        if values is None:
+            values = self.values
+        material = self.formula(values)
+        FORMULAS.register(material, self.atomic_numbers,
+                          self.stoichios(values))
+        return material
+
+
+def normalize(chem_formula):
+    """ return normalized chemical formula
+    """
+    return FORMULAS.get(chem_formula).normalized
+
+
 def calc_num_density(mass_dens, chem_formula):
     """ transforms from mass density to atomic (number) density
     get natural abundance molecular mass from periodictable
     """
-    chem_formula = normalize(clear_marker(chem_formula))
-    try:
-        molar_mass = periodictable.formula(chem_formula).mass
-    except KeyError:
-        # bug of periodic table library
-        return calc_num_density(mass_dens, chem_formula)
+    molar_mass = FORMULAS.get(chem_formula).molar_mass
     num_dens = mass_dens*1e-24*Avogadro_const/molar_mass
     return num_dens  # [g/cm3]
 
@@ -52,12 +400,7 @@ def calc_mass_density(atomic_dens, chem_formula):
     """ transforms from atomic (number) density to mass density
     get natural abundance molecular mass from periodictable
     """
-    chem_formula = normalize(clear_marker(chem_formula))
-    try:
-        molar_mass = periodictable.formula(chem_formula).mass
-    except KeyError:
-        # bug of periodic table library
-        return calc_mass_density(atomic_dens, chem_formula)
+    molar_mass = FORMULAS.get(chem_formula).molar_mass
     mass_dens = atomic_dens*molar_mass*1e24/Avogadro_const
     return mass_dens  # [g/cm3]
 
@@ -65,23 +408,13 @@ def calc_mass_density(atomic_dens, chem_formula):
 def formula_to_stoichios(chemical_formula):
     """ uses xraylib and its CompoundParser
     """
-    chemical_formula = clear_marker(chemical_formula)
-    my_elements = xraylib.CompoundParser(chemical_formula)
-#     print my_elements
-    element = zip(my_elements['Elements'], my_elements['massFractions'])
-    zz = sum([m/xraylib.AtomicWeight(Z) for Z, m in element])
-    stoichios = [my_elements['nAtomsAll'] * m / xraylib.AtomicWeight(Z)/zz
-                 for Z, m in element]
-    return np.array(stoichios)
+    return np.array(FORMULAS.get(chemical_formula).stoichios)
+
 
 def extract_elements(chemical_formula):
     """ uses xraylib and its CompoundParser
     """
-    chemical_formula = clear_marker(chemical_formula)
-    my_elements = xraylib.CompoundParser(chemical_formula)
-    elements_list = [xraylib.AtomicNumberToSymbol(e)
-                     for e in my_elements['Elements']]
-    return np.array(elements_list)
+    return np.array(FORMULAS.get(chemical_formula).elements)
 
 
 def in_energy_to_wavelength(in_energy_eV):
@@ -113,15 +446,10 @@ def clear_marker(material):
 def formula_to_stoichios_norm(chemical_formula):
     """ return normalized stoichio from a chemical formula
     """
-    stoichios = formula_to_stoichios(chemical_formula)
-    # normalization
-    stoichios = stoichios/np.sum(stoichios)
-    return stoichios
+    return np.array(FORMULAS.get(chemical_formula).stoichios_norm)
 
 
 def extract_weight_fractions(chemical_formula):
     """ uses xraylib and its CompoundParser
     """
-    chemical_formula = clear_marker(chemical_formula)
-    my_elements = xraylib.CompoundParser(chemical_formula)
-    return np.array(my_elements['massFractions'])
+    return np.array(FORMULAS.get(chemical_formula).mass_fractions)
@@ -7,6 +7,7 @@ Contain tools for calculating figure of merite.
 
 .. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
 """
+from abc import ABCMeta, abstractmethod
 import numpy as np
 import paf.data
 
@@ -107,10 +108,31 @@ class DataSet(paf.data.CompositeData):
         return new
 
 
+def chi2_residuals(sim, data, norm):
+    """ residuals (sim-data)/sqrt(sim) times norm and their derivatives
+    """
+    return ((sim-data)*norm/np.sqrt(sim),
+            (sim+data)*norm/(2*sim*np.sqrt(sim)))
+
+
+def difference_residuals(sim, data, norm):
+    """ residuals (sim-data) times norm and their derivatives
+    """
+    return (sim-data)*norm, norm
+
+
+def log_residuals(sim, data, norm):
+    """ residuals (log10(sim)-log10(data)) times norm and their derivatives
+    """
+    return ((np.log10(sim)-np.log10(data))*norm,
+            norm/(sim*np.log(10.)))
+
+
 # FOM class
 class FOM(object):
     """ generic figure of merit
     """
+    __metaclass__ = ABCMeta
 
     def __init__(self, p=1):
         """ initialization
@@ -123,6 +145,26 @@ class FOM(object):
         """
         simulation[np.isinf(simulation)] = 0
 
+    @abstractmethod
+    def residuals(self, simulation, data):
+        """ residuals whose sum of squares is the FOM (or its least square
+        counterpart for absolute differences) and their derivatives with
+        respect to the simulation
+
+        :param simulation: simulation (points)
+        :return: residuals (points) and derivatives (points)
+        """
+        pass
+
+    def batch(self, simulations, data):
+        """ calculate the FOM for each row of simulations, every FOM reduces
+        on the last axis so a (population, points) array is accepted as is
+
+        :param simulations: simulations (population, points)
+        :return: FOM of each individual (population,)
+        """
+        return self(simulations, data)
+
     @property
     def inf_error(self):
         """ access to list of element making FOM result equals to infinity
@@ -165,8 +207,13 @@ class log(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
-        return 1.0/((N-self._p)*1.)*np.sum(np.sum(np.abs(np.log10(data.y) -
-                                                         np.log10(sim))))
+        return 1.0/((N-self._p)*1.)*np.sum(np.abs(np.log10(data.y) -
+                                                  np.log10(sim)), axis=-1)
+
+    def residuals(self, sim, data):
+        """ logarithmic difference (squared instead of absolute)
+        """
+        return log_residuals(sim, data.y, 1./np.sqrt(len(data.y)-self._p))
 
 
 class log2n(FOM):
@@ -188,7 +235,14 @@ class log2n(FOM):
         N = len(data.y)
         return 1.0/((N-self._p)*1.)*np.sum((np.log10(data.y) -
                                             np.log10(sim))**2 /
-                                           np.log10(data.y)**2)
+                                           np.log10(data.y)**2, axis=-1)
+
+    def residuals(self, sim, data):
+        """ normalized logarithmic difference
+        """
+        return log_residuals(sim, data.y,
+                             1./(np.sqrt(len(data.y)-self._p) *
+                                 np.log10(data.y)))
 
 
 class chi2n(FOM):
@@ -208,7 +262,14 @@ class chi2n(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
-        return 1.0/((N-self._p)*1.)*np.sum((data.y - sim)**2/data.y**2)
+        return 1.0/((N-self._p)*1.)*np.sum((data.y - sim)**2/data.y**2,
+                                           axis=-1)
+
+    def residuals(self, sim, data):
+        """ relative difference
+        """
+        return difference_residuals(
+            sim, data.y, 1./(np.sqrt(len(data.y)-self._p)*data.y))
 # double
 
 
@@ -229,7 +290,14 @@ class chi2bars(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
-        return 1.0/((N-self._p)*1.)*np.sum((data.y - sim)**2/data.error**2)
+        return 1.0/((N-self._p)*1.)*np.sum((data.y - sim)**2/data.error**2,
+                                           axis=-1)
+
+    def residuals(self, sim, data):
+        """ difference normalized by error bars
+        """
+        return difference_residuals(
+            sim, data.y, 1./(np.sqrt(len(data.y)-self._p)*data.error))
 
 
 class chi2d(FOM):
@@ -246,11 +314,23 @@ class chi2d(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
+        # null points of each simulation are excluded
         sim_z = sim != 0
-        new_sim = sim[sim_z]
-        new_data = data.y[sim_z]
-        return (1.0/(((N-self._p)*1.)*np.max(new_data)) *
-                np.sum((new_data - new_sim)**2/new_sim))
+        new_sim = np.where(sim_z, sim, 1.)
+        new_data = np.where(sim_z, data.y, -np.inf)
+        return (1.0/(((N-self._p)*1.)*np.max(new_data, axis=-1)) *
+                np.sum(np.where(sim_z, (data.y - new_sim)**2/new_sim, 0.),
+                       axis=-1))
+
+    def residuals(self, sim, data):
+        """ difference normalized by the square root of the simulation, null
+        points are excluded
+        """
+        N = len(data.y)
+        sim_z = sim != 0
+        new_sim = np.where(sim_z, sim, 1.)
+        norm = 1./np.sqrt((N-self._p)*np.max(data.y[sim_z]))
+        return chi2_residuals(new_sim, data.y, norm*sim_z)
 
 
 class log2d(FOM):
@@ -267,21 +347,28 @@ class log2d(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
-        min_sim = np.min(sim)
+        min_sim = np.min(sim, axis=-1)[..., np.newaxis]
         min_data = np.min(data.y)
-        new_sim = sim
-        new_data = data.y
-        if min_data < 1 or min_sim < 1:
-            if min_data < min_sim:
-                min_ = min_data
-            else:
-                min_ = min_sim
-            new_sim = sim/min_*2
-            new_data = data.y/min_*2
-        new_sim = np.log10(new_sim)
-        new_data = np.log10(new_data)
-        return (1.0/(((N-self._p)*1.)*np.max(new_data)) *
-                np.sum((new_data - new_sim)**2/new_sim))
+        # rescale when data or simulation go under 1
+        min_ = np.minimum(min_data, min_sim)
+        scale = np.where((min_data < 1) | (min_sim < 1), 2./min_, 1.)
+        new_sim = np.log10(sim*scale)
+        new_data = np.log10(data.y*scale)
+        return (1.0/(((N-self._p)*1.)*np.max(new_data, axis=-1)) *
+                np.sum((new_data - new_sim)**2/new_sim, axis=-1))
+
+    def residuals(self, sim, data):
+        """ chi 2 residuals of the rescaled logarithms, the scale is constant
+        for the derivatives
+        """
+        N = len(data.y)
+        min_ = min(np.min(data.y), np.min(sim))
+        scale = 2./min_ if min_ < 1 else 1.
+        new_sim = np.log10(sim*scale)
+        new_data = np.log10(data.y*scale)
+        norm = 1./np.sqrt((N-self._p)*np.max(new_data))
+        residual, slope = chi2_residuals(new_sim, new_data, norm)
+        return residual, slope/(sim*np.log(10.))
 
 
 class theta4(FOM):
@@ -295,7 +382,16 @@ class theta4(FOM):
         new_sim = sim * data.x**4
         new_data = data.y * data.x**4
         return (1.0/(((N-self._p)*1.)*np.max(new_data)) *
-                np.sum((new_data - new_sim)**2/new_sim))
+                np.sum((new_data - new_sim)**2/new_sim, axis=-1))
+
+    def residuals(self, sim, data):
+        """ chi 2 residuals of the simulation times theta**4
+        """
+        N = len(data.y)
+        new_data = data.y * data.x**4
+        norm = 1./np.sqrt((N-self._p)*np.max(new_data))
+        residual, slope = chi2_residuals(sim * data.x**4, new_data, norm)
+        return residual, slope*data.x**4
 
 
 # b like fom function
@@ -315,7 +411,13 @@ class b_logarithmic(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
-        return 1/((N-self._p)*1.)*np.sum((np.log10(data.y)-np.log10(sim))**2)
+        return 1/((N-self._p)*1.)*np.sum((np.log10(data.y)-np.log10(sim))**2,
+                                         axis=-1)
+
+    def residuals(self, sim, data):
+        """ logarithmic difference
+        """
+        return log_residuals(sim, data.y, 1./np.sqrt(len(data.y)-self._p))
 
 
 class b_normalized_logarithmic(FOM):
@@ -333,7 +435,14 @@ class b_normalized_logarithmic(FOM):
         FOM.__call__(self, sim, data)
         N = len(data.y)
         return 1/((N-self._p)*1.)*np.sum(((np.log10(data.y)-np.log10(sim)) /
-                                          np.log10(data.y))**2)
+                                          np.log10(data.y))**2, axis=-1)
+
+    def residuals(self, sim, data):
+        """ normalized logarithmic difference
+        """
+        return log_residuals(sim, data.y,
+                             1./(np.sqrt(len(data.y)-self._p) *
+                                 np.log10(data.y)))
 
 
 class b_normalized(FOM):
@@ -350,7 +459,13 @@ class b_normalized(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
-        return 1/((N-self._p)*1.)*np.sum(((data.y-sim) / data.y)**2)
+        return 1/((N-self._p)*1.)*np.sum(((data.y-sim) / data.y)**2, axis=-1)
+
+    def residuals(self, sim, data):
+        """ relative difference
+        """
+        return difference_residuals(
+            sim, data.y, 1./(np.sqrt(len(data.y)-self._p)*data.y))
 
 
 class b_standart(FOM):
@@ -367,7 +482,13 @@ class b_standart(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
-        return 1/((N-self._p)*1.)*np.sum((data.y-sim)**2 / data.y)
+        return 1/((N-self._p)*1.)*np.sum((data.y-sim)**2 / data.y, axis=-1)
+
+    def residuals(self, sim, data):
+        """ difference normalized by the square root of data
+        """
+        return difference_residuals(
+            sim, data.y, 1./np.sqrt((len(data.y)-self._p)*data.y))
 
 
 class b_log_module(FOM):
@@ -384,5 +505,10 @@ class b_log_module(FOM):
         """
         FOM.__call__(self, sim, data)
         N = len(data.y)
-        return 1/((N-self._p)*1.)*np.sum(np.abs(np.log10(data.y)-np.log10(sim))
-                                         )
+        return 1/((N-self._p)*1.)*np.sum(np.abs(np.log10(data.y)-np.log10(sim)),
+                                         axis=-1)
+
+    def residuals(self, sim, data):
+        """ logarithmic difference (squared instead of absolute)
+        """
+        return log_residuals(sim, data.y, 1./np.sqrt(len(data.y)-self._p))
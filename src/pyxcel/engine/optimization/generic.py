@@ -7,19 +7,20 @@ Contain the Filter to do combined optimization data using a simulator.
 
 .. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
 """
-import re
-import copy
 import numpy as np
 import pyxcel.engine.centralizer
 import paf.filter_base
 import paf.data
 import paf.port as port
 import pyxcel.engine.optimization.fom
-import pyxcel.engine.modeling.tools as tools
+from pyxcel.engine.optimization.param_tab import ParaTab
+from pyxcel.engine.optimization.model import create_model
+from pyxcel.engine.optimization.model import initialize_simulators
+from pyxcel.engine.optimization.model import link_instrument
+from pyxcel.engine.optimization.model import unlink_instrument
 from pyxcel.engine.pipeline import EvolutionReport
 from pyxcel.view.cute import QObject, pyqtSignal
 from pyxcel.controller import type_inst
-from pyxcel.engine.modeling.entity import StackData
 import cmd
 from cmd import Cmd
 MAKE_DATA = paf.data.make_data
@@ -68,407 +69,6 @@ class ExperimentalDataFilter(paf.filter_base.Filter):
         self.fill_port("main", instrument)
 
 
-class ParaTab(object):
-    """ represent a parameter tab
-    """
-    def __init__(self):
-        """ initialization
-        """
-        self._source_elements = ["I0"]
-        self._detector_elements = ["dist", "pinhole_height",
-                                   "width_parallel_l", "width_parallel_s",
-                                   "res", "Ibkg"]
-        #: boundary off each parameter formated for scipy
-        self._bounds = []
-        #: list of parameter to fit
-        self._params = []
-        #: contain the groupe list
-        self._groups = []
-        #: stirng value formated for GenX.
-        self._string_value = ""
-        #: actual value of parameter
-        self._x = []
-        #: error bars of the parameter
-        self._error = []
-        #: list of name of each layer for the stack model
-        self._stack_name_list = None
-        #: regular expression for finding stochio
-        self._regex_stochio = re.compile("_\d*\.?\d*")
-
-    def _apply_column(self, index, value):
-        """ apply a value vector to a column
-        """
-        lines = self._string_value.split("\n")
-        new_string_value = lines[0]
-        tab_lines = lines[1:]
-        dic_group = {}
-        group_list = self.groups
-        diff_idx = 0
-        for idx, tab_line in enumerate(tab_lines):
-            if len(tab_line) < 5:
-                continue
-            new_tabline = tab_line.split()
-            idx_value = idx - diff_idx
-            if new_tabline[-1] != "None":
-                if new_tabline[-1] in group_list:
-                    group_list.remove(new_tabline[-1])
-                    dic_group[new_tabline[-1]] = idx_value
-                else:
-                    diff_idx += 1
-                    idx_value = dic_group[new_tabline[-1]]
-            new_tabline[index] = str(value[idx_value])
-            if eval(new_tabline[2]):
-                new_string_value += '\n' + '\t'.join(new_tabline)
-            else:
-                diff_idx += 1
-                new_string_value += '\n' + '\t'.join(tab_line)
-        self._string_value = new_string_value
-
-    @property
-    def layer_rank(self):
-        """ accessing to layer rank
-        """
-        return self._layer_rank
-
-    @property
-    def bounds(self):
-        """ accessing to bounds
-        """
-        return self._bounds
-
-    @property
-    def params(self):
-        """ accessing to fitted parameter list
-        """
-        return self._params
-
-    @property
-    def x_label(self):
-        """ return the params with all member of groups replace by first member
-        named by group name
-        """
-        x_label = copy.copy(self.params)
-        group_list = []
-        diff_idx = 0
-        for idx, groupe in enumerate(self.groups):
-            if groupe != "None":
-                if groupe in group_list:
-                    del x_label[idx-diff_idx]
-                    diff_idx += 1
-                else:
-                    x_label[idx-diff_idx] = groupe
-        return x_label
-
-    @property
-    def x(self):
-        """ accesssing to x vector
-        """
-        return self._x
-
-    @x.setter
-    def x(self, value):
-        """ setter for x value
-        """
-        self._x = list(value)
-        self._apply_column(1, value)
-
-    @property
-    def error(self):
-        """ accessing to error bar
-        """
-        return self._error
-
-    @error.setter
-    def error(self, value):
-        """ setter for error value
-        """
-        self._error = list(value)
-        self._apply_column(5, value)
-
-    @property
-    def groups(self):
-        """ return list of groups *only one by name*
-        """
-        list_groups = list(set(self._groups))
-        list_groups.remove("None")
-        return list_groups
-
-    @property
-    def string_value(self):
-        """ acces to the string value
-        """
-        return self._string_value
-
-    @string_value.setter
-    def string_value(self, value):
-        """ load from a string value
-
-        :param value: string value
-        :type value: str
-        """
-        self._string_value = value
-#         print("value " + value)             ###
-        tab = value.split("\n")[1:-1]
-#         for t in tab:                       ###
-#             print("tab " + t)               ###
-        self._bounds = []
-        self._params = []
-        self._x = []
-        self._error = []
-        self._groups = []
-        group_list = []
-        for tab_line in tab:                
-#             print("tab_line " + tab_line)   ###
-            line = tab_line.split()
-#             for l in line:                  ###
-#                 print("line " + l)          ###
-            if eval(line[2]):
-                self._params.append(line[0])
-                self._groups.append(line[-1])
-                if line[-1] != "None":
-                    if line[-1] in group_list:
-                        continue
-                    else:
-                        group_list.append(line[-1])
-                self._bounds.append((float(line[3]), float(line[4])))
-                self._x.append(float(line[1]))
-                try:
-                    self._error.append(float(line[5]))
-                except ValueError:
-                    self._error.append(0.)
-
-    def load_from_file(self, file_name):
-        """ load parameter tab from file
-
-        :param file_name: name of the file
-        :type file_name: str
-        """
-        with open(file_name, "r") as f:
-            tab_string = f.read()
-            self.string_value = tab_string
-
-    def apply_to_genx_dict(self, genx_dict, x=None):
-        """ apply to a dictionary of genx element
-        """
-        if x is None:
-            x = self.x
-        for idx, param in enumerate(self.params):
-            str_statement = param + '(' + str(x[idx]) + ')'
-            exec(str_statement, genx_dict)
-        self.x = x
-
-    def get_data_to_modify(self, pyxcel_dict, data_name, key):
-        """ get the data to modify
-        """
-        to_edit = None
-        if key in self._source_elements:
-            to_edit = pyxcel_dict[data_name]['source']
-        elif key in self._detector_elements:
-            to_edit = pyxcel_dict[data_name]['detector']
-        else:
-            list_stack = []
-            for temporary_element_name in pyxcel_dict.keys():
-                temporary_element = (pyxcel_dict[temporary_element_name])
-                if isinstance(temporary_element, StackData):
-                    if temporary_element_name[-4:] != "save":
-                        list_stack.append(temporary_element)
-            stack = list_stack[0]
-            if stack['ambient']["name"].value == data_name:
-                to_edit = stack['ambient']
-            elif stack['substrate']["name"].value == data_name:
-                to_edit = stack['substrate']
-            else:
-                stack = stack['layers']
-                for layer in stack:
-                    if layer['name'].value == data_name:
-                        to_edit = layer
-
-        return to_edit
-
-    @staticmethod
-    def get_var_name(line):
-        """ get variable name from line
-        """
-        key_name_up = line[0].split(".")[1][3:]
-        key_name = key_name_up[0].lower() + key_name_up[1:]
-        maj_list = ["I0", "Ibkg"]
-        if key_name_up in maj_list:
-            key_name = key_name_up
-        return key_name
-
-    def apply_stochio(self, pyxcel_dict, line):
-        """ apply stochio to mpyxceldict
-        """
-        data_name = line[0].split(".")[0][8:]
-        index = int(line[0].split(".")[1][10:])
-        to_edit = self.get_data_to_modify(pyxcel_dict, data_name, "material")
-        mat = to_edit['material'].value
-        actual = 0
-        value = line[1]
-        for idx, _ in enumerate(self._regex_stochio.findall(mat)):
-            if idx == index:
-                # value is rounded to 3 digits
-                mat = self._regex_stochio.sub(str(round(float(value),2)), mat, 1)
-                break
-            else:
-                res = self._regex_stochio.search(mat)
-                actual += res.end()
-                mat = mat[res.end():]
-        to_edit['material'] = to_edit['material'].value[:actual] + mat
-
-    def apply_to_dict(self, pyxcel_dict, x=None):
-        """ apply to a dictionary of element
-        """
-        if x is not None:
-            self.x = x
-        tab_string = self.string_value
-        tab_lines = tab_string.split("\n")[1:]
-        tab_lines.sort(reverse=True) # circumvent multiple stoichiometric coefficients fitting on the same material
-        for tab_line in tab_lines:
-            line = tab_line.split()
-            try:
-                data_name, var_name = line[0].split(".")
-            except IndexError:
-                return
-            if data_name[:7] == "stochio":
-                self.apply_stochio(pyxcel_dict, line)
-                continue
-            elif var_name[:11] == "setProfile_":
-                self.apply_to_profile(pyxcel_dict, line)
-                continue
-            key_name = self.get_var_name(line)
-            to_edit = self.get_data_to_modify(pyxcel_dict, data_name, key_name)
-            if key_name == "numerical_density":
-                oth_dens = tools.calc_mass_density(float(line[1]),
-                                                   to_edit["material"])
-                to_edit["mass_density"] = oth_dens
-            if key_name == "mass_density":
-                oth_dens = tools.calc_num_density(float(line[1]),
-                                                  to_edit["material"])
-                to_edit["numerical_density"] = oth_dens
-            to_edit[key_name] = float(line[1])
-
-    def apply_to_profile(self, pyxcel_dict, line):
-        """ apply a line to profile
-        """
-        data_name, var_name = line[0].split(".")
-        var_name = var_name[11:]
-        stack = None
-        profile = None
-        for name in pyxcel_dict.keys():
-            element = pyxcel_dict[name]
-            if isinstance(element, StackData):
-                if name[-4:] != "save":
-                    stack = element
-                    break
-        for lay in stack.real_value["layers"]:
-            if lay["name"].value == data_name:
-                profile = lay["materials"]
-                layer = lay
-                break
-        if var_name == "d":
-            layer.d = float(line[1])
-        elif var_name == "sigmar":
-            if "parameters" in pyxcel_dict.keys():
-                parameters = pyxcel_dict["parameters"]
-                index = list(parameters["name"]).index(data_name + "_start")
-                parameters["sigmar"][index] = float(line[1])
-            else:
-                layer["sigmar"] = float(line[1])
-        else:
-            try:
-                idx = int(var_name[:var_name.index("_")])
-                var_name = var_name[var_name.index("_")+1:]
-                profile["computers"][idx]["kwargs"][var_name] = float(line[1])
-            except ValueError:
-                var_name = var_name[var_name.index("_")+1:]
-                layer["densities"][var_name] = float(line[1])
-
-    def recalculate_profile(self, pyxcel_dict, profile_name):
-        """ recalculate profile
-        """
-        stack = None
-        profile = None
-        for name in pyxcel_dict.keys():
-            element = pyxcel_dict[name]
-            if isinstance(element, StackData):
-                if name[-4:] != "save":
-                    stack = element
-                    break
-        for lay in stack.real_value["layers"]:
-            if lay["name"].value == profile_name:
-                profile = lay
-        parameters = pyxcel_dict["parameters"]
-        if self._stack_name_list is None:
-            self._stack_name_list = list(parameters['name'])
-        start = self._stack_name_list.index(profile_name + "_start")
-        end = self._stack_name_list.index(profile_name + "_end")
-        new_param = profile.to_param()
-        parameters["material"][end:start+1] = new_param["materials"][::-1]
-        parameters["d"][end:start+1] = new_param["d"][::-1]
-        num_dens = parameters["numerical_density"]
-        num_dens[end:start+1] = new_param["num_densities"][::-1]
-        mass_dens = parameters["mass_density"]
-        mass_dens[end:start+1] = new_param["mass_densities"][::-1]
-
-    def apply_to_other(self, pyxcel_dict, line):
-        """ apply instrument or stochio line to pyxcel dict
-        """
-        key = self.get_var_name(line)
-        data_name = line[0].split(".")[0]
-        # to_edit = 0.  # {key: 0.}
-        if key in self._source_elements:
-            to_edit = pyxcel_dict[data_name]['source']
-        elif key in self._detector_elements:
-            to_edit = pyxcel_dict[data_name]['detector']
-        else:
-            to_edit = pyxcel_dict[data_name]
-        to_edit[key] = float(line[1])
-
-    def apply_to_param(self, pyxcel_dict, x=None):
-        """ apply tab on model parameter
-        """
-        recalculate_profile = []
-        parameters = pyxcel_dict["parameters"]
-        if x is not None:
-            self.x = x
-        if self._stack_name_list is None:
-            self._stack_name_list = list(parameters['name'])
-        tab_string = self.string_value
-        tab_lines = tab_string.split("\n")[1:]
-        for tab_line in tab_lines:
-            line = tab_line.split()
-            try:
-                data_name, var_name = line[0].split(".") ### plante car line [0]==instru+intitulécolonne+param, si pas de header colonne, intitulé == xxx.yyy (nombre) => 2 points dans string
-            except IndexError:
-                return
-            if self._stack_name_list.count(data_name) > 0:
-                actual_index = 0
-                for _ in range(self._stack_name_list.count(data_name)):
-                    index = (self._stack_name_list[actual_index:]
-                             .index(data_name) + actual_index)
-                    actual_index = index
-                    key_name = self.get_var_name(line)
-                    if key_name == "numerical_density":
-                        mat = parameters["material"][index]
-                        oth_dens = tools.calc_mass_density(float(line[1]), mat)
-                        parameters["mass_density"][index] = oth_dens
-                    if key_name == "mass_density":
-                        mat = parameters["material"][index]
-                        oth_dens = tools.calc_num_density(float(line[1]), mat)
-                        parameters["numerical_density"][index] = oth_dens
-                    parameters[key_name][index] = float(line[1])
-            elif var_name[:11] == "setProfile_":
-                self.apply_to_profile(pyxcel_dict, line)
-                recalculate_profile.append(data_name)
-            else:
-                self.apply_to_other(pyxcel_dict, line)
-        if len(recalculate_profile) > 0:
-            recalculate_profile = list(set(recalculate_profile))
-            for profile in recalculate_profile:
-                self.recalculate_profile(pyxcel_dict, profile)
-
-
 class ReportNotifier(QObject):
     """ notifier object
     """
@@ -597,174 +197,6 @@ class Clone(paf.filter_base.Filter):
             self.fill_port(port_name, new_data)
 
 
-class CustomModel(object):
-    """ a model using custom simulator...
-    """
-    def __init__(self):
-        """ initialization
-        """
-        self._script_dict = {}
-        self._fom = None
-        self._instruments = []
-        self._sample = None
-
-    @property
-    def sample(self):
-        """ return a sample
-        """
-        return self._sample
-
-    @property
-    def instruments(self):
-        """ return list of instrument
-        """
-        return self._instruments
-
-    @property
-    def fom(self):
-        """ access to fom function
-        """
-        return self._fom
-
-    @fom.setter
-    def fom(self, value):
-        """ modify fom
-        """
-        self._fom = value
-
-    @property
-    def script_dict(self):
-        """ property to access to the script module dictionary
-        """
-        return self._script_dict
-
-    def add_stochio(self, stochio):
-        """ add stoichiometric parameter
-        """
-        for key in list(stochio.keys()):
-            #print key
-            cmmd = key + " = {}\n"
-            for idex, item in enumerate(stochio[key][:]):
-                cmmd += key + "['stochio_" + str(idex) + "'] = "
-                cmmd += str(item) + "\n"
-            cmmd += key + "['mass_dens'] = " + str(stochio[key][-1:][0])
-            cmmd += "\n"
-            exec(cmmd,  self.script_dict)
-            
-
-    def add_sample(self, samples):
-        """ add some sample
-        """
-        self._sample = samples[0]
-        for sample in samples:
-            for key in sample.keys():
-                self.script_dict[key] = sample[key]
-
-    def add_instrument(self, instruments):
-        """ add some instrument
-        """
-        for key in instruments.keys():
-            self.script_dict[key] = instruments[key]
-            self._instruments.append(instruments[key])
-
-    def add_simulator_script(self, simulators):
-        """ create script simulator from a list of Simulator object.
-
-        :param simulators: list of simulator
-        """
-        self.script_dict["simulators"] = simulators
-
-        def simulate(simulators):
-            result = np.array([], dtype=np.float64)
-            for simulator in simulators: # proper simulation
-                result = np.concatenate((result, simulator.simulate()))
-            return result
-
-        self.script_dict["simulate"] = simulate
-        self.compiled = True
-        s = 'def Sim():\n\treturn simulate(simulators)\n'
-        exec(s, self.script_dict)
-
-    def simulate(self):
-        """ execute simulator
-        """
-        return self.script_dict["Sim"]()
-
-
-class LinkData(paf.data.CompositeData):
-    """ create a new setitem function
-    """
-    def __init__(self, origine=None, parts=None):
-        """ initialization
-        """
-        #: list of excluded parameter
-        self._excluded_par = ["I0"]
-        paf.data.CompositeData.__init__(self)
-        if origine is not None:
-            self._value = origine.real_value
-            self._data_type = dict
-            self._showing_info = origine.showing_info
-            self._abstract_data_type = origine.abstract_type
-            self._parts = parts
-            self._origine = origine
-
-    @property
-    def excluded_par(self):
-        """ get list of exclude parameter
-        """
-        return self._excluded_par
-
-    @excluded_par.setter
-    def excluded_par(self, value):
-        """ setter for excluded parameter
-        """
-        self._excluded_par = value
-
-    def to_origine(self):
-        """ tranform Link data to original data with new value
-        """
-        self._origine.real_value = self._value
-        return self._origine
-
-    def new_setter(self, key, value):
-        """ new setter
-        """
-        for part in self._parts:
-            paf.data.CompositeData.__setitem__(part, key, value)
-
-    def __setitem__(self, key, value):
-        """ new __setitem__ for link instrument
-        """
-        if key in self._excluded_par:
-            paf.data.CompositeData.__setitem__(self, key, value)
-        else:
-            self.new_setter(key, value)
-
-
-def link_instrument(instruments):
-    """ create a link between instruments
-
-    :param instruments: a list of pyxcel instrument
-    """
-
-    detectors = [inst["detector"] for inst in instruments]
-    sources = [inst["source"] for inst in instruments]
-    for instrument in instruments:
-        instrument["detector"] = LinkData(instrument["detector"], detectors)
-        instrument["source"] = LinkData(instrument["source"], sources)
-
-
-def unlink_instrument(instruments):
-    """ create a link between instruments
-
-    :param instruments: a list of pyxcel instrument
-    """
-
-    for instrument in instruments:
-        instrument["detector"] = instrument["detector"].to_origine()
-        instrument["source"] = instrument["source"].to_origine()
-
-
 class AbstractOptimisationFilter(paf.filter_base.Filter):
     """ combine optimization filter uzing SciPy differnetial Evolution
     """
@@ -803,6 +235,8 @@ class AbstractOptimisationFilter(paf.filter_base.Filter):
                                     MAKE_DATA([]))
         self.add_expected_parameter("links", MAKE_DATA([]), [])
         self.add_expected_parameter("refresh_speed", MAKE_DATA(1), 1)
+        self.add_expected_parameter("adaptive_tolerance", MAKE_DATA(0.), 0.)
+        self.add_expected_parameter("kinematic_factor", MAKE_DATA(0.), 0.)
 
         #: report notifier
         self._report_notifier = ReportNotifier()
@@ -826,6 +260,18 @@ class AbstractOptimisationFilter(paf.filter_base.Filter):
         """
         return self._report_notifier
 
+    @property
+    def para_tab(self):
+        """ accessing to the table of parameter
+        """
+        return self._para_tab
+
+    @property
+    def data_set(self):
+        """ accessing to the concatenated experimental data set
+        """
+        return self._data_set
+
     @property
     def fit_stochio(self):
         """ return True if simulator must recalculate stochio dependent
@@ -842,6 +288,30 @@ class AbstractOptimisationFilter(paf.filter_base.Filter):
         """
         return self._fit_inst
 
+    @property
+    def adaptive_tolerance(self):
+        """ relative tolerance of adaptive angular sampling (0 to calculate
+        every angle)
+        """
+        return self["adaptive_tolerance"].value
+
+    @property
+    def kinematic_factor(self):
+        """ multiple of the critical angle above which XRR is kinematic (0 to
+        calculate every angle with the Parratt recursion)
+        """
+        return self["kinematic_factor"].value
+
+    @property
+    def kinematic_error(self):
+        """ highest estimated relative error of the kinematic approximation in
+        the last simulation of each XRR simulator
+        """
+        errors = [simulator.hybrid.max_error
+                  for simulator in self["simulators"]
+                  if getattr(simulator, "hybrid", None) is not None]
+        return max(errors + [0.])
+
     @property
     def pop_size(self):
         """ get the population size
@@ -872,6 +342,22 @@ class AbstractOptimisationFilter(paf.filter_base.Filter):
         new_value = np.concatenate((np.array(x), np.array([fom])))
         self._selected_error_set[index] = new_value
 
+    def best_simulation(self, candidates, foms):
+        """ simulation of the candidate with the lowest fom for candidates
+        evaluated out of the model of the filter
+
+        :param candidates: candidates (population, nb_x)
+        :param foms: combined fom of each candidate (population,)
+        :return: index of the best candidate and its simulation (None if the
+                 simulation fails)
+        """
+        best = int(np.argmin(foms))
+        self._para_tab.apply_to_param(self._mod.script_dict, candidates[best])
+        try:
+            return best, self._mod.simulate()
+        except UnboundLocalError:
+            return best, None
+
     def create_corr_matrix(self):
         ligne_list = self._selected_error_set[:, -1] != 0.
         x_list = self._selected_error_set[ligne_list, :-1].T
@@ -916,18 +402,13 @@ class AbstractOptimisationFilter(paf.filter_base.Filter):
                                len(self._para_tab.bounds))
 
         # create model
-        self._mod = CustomModel()
         samples = self.get_data("samples")
-        self._mod.add_sample(samples.value)
         self._insts = self.get_data("instruments")
-        self._mod.add_instrument({inst["name"].value: inst
-                                  for inst in self._insts})
         self._sims = self["simulators"]
-        self._mod.add_simulator_script(self._sims)
-
-        # add stochio
+        stochio = None
         if self.fit_stochio:
-            self._mod.add_stochio(self.get_data("stack_data").stochio)
+            stochio = self.get_data("stack_data").stochio
+        self._mod = create_model(samples, self._insts, self._sims, stochio)
 
         # link instrument
         links = self["links"].value
@@ -953,24 +434,8 @@ class AbstractOptimisationFilter(paf.filter_base.Filter):
         self["FOM"].theta_array = theta_arrays
 
         # parameter for simulators
-        for index, simulator in enumerate(self._sims):
-            simulator["parameter"] = self["parameters"][index]
-            simulator["theta_array"] = theta_arrays[index]
-            simulator["stack"] = samples[index].value['sample']
-            simulator["instrument"] = self._insts[index]
-            simulator.initialization(self)
-        self._mod.script_dict["parameters"] = self._sims[0].model_parameters
-        for simulator in self._sims.real_value[1:]:
-            mp = simulator.model_parameters
-            new_mp = self._mod.script_dict["parameters"]
-            mp['d'] = new_mp['d']
-            mp['sigmar'] = new_mp['sigmar']
-            mp['numerical_density'] = new_mp['numerical_density']
-            mp['mass_density'] = new_mp['mass_density']
-            # print("pyxcel/engine/optimization/generic.py/AbstractOptimizationFilter.run()")
-            for idx, each in enumerate(new_mp['material']): # edit simulator.model_parameters["material"] to remove "_"'s
-                new_mp['material'][idx] = each.replace("_","")
-            mp['material'] = new_mp['material'] 
+        initialize_simulators(self._mod, self._sims, self["parameters"],
+                              theta_arrays, samples, self._insts, self)
 
         # parameter and optimization
         self._data_set = pyxcel.engine.optimization.fom.DataSet()
@@ -986,7 +451,12 @@ class AbstractOptimisationFilter(paf.filter_base.Filter):
         self._best_history = np.zeros((self["max_gen"].value+1,
                                        len(self._para_tab.bounds)+1))
 
-        self.optimize()
+        # resolve the tab once for all evaluations
+        self._para_tab.compile(self._mod.script_dict, self.fit_stochio)
+        try:
+            self.optimize()
+        finally:
+            self._para_tab.release()
 
         # unlink instrument
         for link in links:
@@ -0,0 +1,220 @@
+# -*- coding: utf8 -*-
+"""
+Contain the Filter to refine a combined optimization with SciPy least squares
+(trust region reflective or Levenberg-Marquardt) from the current values of
+the parameter tab. Residuals come from the figures of merit and derivatives
+of layer parameters from the simulators, other parameters are derived by
+finite differences.
+
+    :platform: Unix, Windows
+    :synopsis: least square refinement filter.
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+from scipy.optimize import least_squares
+import numpy as np
+import paf.data
+from pyxcel.engine.optimization.scipy_d_e_combined import Problem
+from pyxcel.engine.pipeline import EvolutionReport
+from pyxcel.engine.optimization.generic import AbstractOptimisationFilter
+MAKE_DATA = paf.data.make_data
+
+
+class RefinementStopped(Exception):
+    """ raised in residuals to leave the solver when the filter is stopped
+    """
+    pass
+
+
+class OptimisationFilter(AbstractOptimisationFilter):
+    """ combine refinement filter using SciPy least squares
+    """
+    def __init__(self):
+        """ initialization
+        """
+        AbstractOptimisationFilter.__init__(self)
+        self["FOM"] = Problem()
+
+        # add special parameter, bounds are ignored by "lm"
+        self.add_expected_parameter("method", MAKE_DATA("trf"), "trf")
+
+        #: fom count
+        self._fom_count = 0
+        self._old_fom = -1
+        self._old_foms = []
+        #: number of jacobian evaluation
+        self._jacobian_count = 0
+        #: jacobian of the residuals at the last evaluated point
+        self._jacobian = None
+        #: sum of squared residuals at the last evaluated point
+        self._cost = 0.
+
+    def create_fom(self, pyxcel_fom):
+        """ creating the fom of the best point tracking, the solver uses
+        residuals
+        """
+        def new_fom(x):
+            """ return the fom of x
+            """
+            self._x = x
+            self._para_tab.apply_to_param(self._mod.script_dict, x)
+            # no simulation if the model can not be simulated
+            self._simu = None
+            try:
+                self._simu = self._mod.simulate()
+                return pyxcel_fom(self._simu, self._data_set)
+            except UnboundLocalError:
+                return 1e20
+        return new_fom
+
+    def residuals(self, x):
+        """ residuals of the figures of merit for x
+        """
+        if self._stop:
+            raise RefinementStopped()
+        self._fom(np.array(x))
+        if self._simu is None:
+            # same cost as the figure of merit of a failed simulation
+            nb_points = self["FOM"].born[-1][1]
+            residual = np.full(nb_points, 1e10 / np.sqrt(nb_points))
+        else:
+            residual, _ = self["FOM"].residuals(np.array(self._simu),
+                                                self._data_set)
+        self._cost = np.sum(residual**2)
+        return residual
+
+    def jacobian(self, x):
+        """ jacobian of the residuals for x (points, nb_x)
+        """
+        if self._stop:
+            raise RefinementStopped()
+        x = np.array(x, dtype=np.float64)
+        plan = self._para_tab.plan
+        self._para_tab.apply_to_param(self._mod.script_dict, x)
+        if self._fit_stochio:
+            # materials of the current stochiometry
+            self._mod.simulate()
+        directions = plan.directions()
+        flat = []
+        columns = []
+        for index, direction in enumerate(directions):
+            for key, layer, factor in direction or []:
+                flat.append((key, layer))
+                columns.append((index, factor))
+        if flat:
+            simu, derivatives = self._mod.simulate_jacobian(flat)
+        else:
+            simu = self._mod.simulate()
+            derivatives = []
+        jacobian = np.zeros((len(simu), len(x)))
+        for (index, factor), derivative in zip(columns, derivatives):
+            jacobian[:, index] += factor * derivative
+
+        # finite differences for the others, inside bounds
+        for index, direction in enumerate(directions):
+            if direction is not None:
+                continue
+            low, high = self._para_tab.bounds[index]
+            step = np.sqrt(np.finfo(np.float64).eps) * max(abs(x[index]), 1.)
+            if x[index] + step > high:
+                step = -step
+            moved = x.copy()
+            moved[index] += step
+            self._para_tab.apply_to_param(self._mod.script_dict, moved)
+            jacobian[:, index] = (self._mod.simulate() - simu) / step
+        self._para_tab.apply_to_param(self._mod.script_dict, x)
+        _, slope = self["FOM"].residuals(np.array(simu), self._data_set)
+        self._jacobian = slope[:, np.newaxis] * jacobian
+        self._jacobian_count += 1
+        if self._jacobian_count % self._refresh_speed == 0:
+            self.send_report()
+        return self._jacobian
+
+    def covariance(self):
+        """ covariance of fitted parameter from the last jacobian, None
+        before the first one
+        """
+        if self._jacobian is None:
+            return None
+        nb_res, nb_x = self._jacobian.shape
+        hessian = np.dot(self._jacobian.T, self._jacobian)
+        return (np.linalg.pinv(hessian) * self._cost /
+                max(nb_res - nb_x, 1))
+
+    def create_corr_matrix(self):
+        """ correlation matrix of the fitted parameter
+        """
+        covariance = self.covariance()
+        if covariance is None:
+            return AbstractOptimisationFilter.create_corr_matrix(self)
+        error = np.sqrt(np.abs(np.diag(covariance)))
+        error = np.where(error > 0, error, 1.)
+        return covariance / np.outer(error, error)
+
+    def calculate_error_bar(self):
+        """ calculate error bar for each parameter
+        """
+        covariance = self.covariance()
+        if covariance is None:
+            return AbstractOptimisationFilter.calculate_error_bar(self)
+        self._para_tab.error = np.sqrt(np.abs(np.diag(covariance))).tolist()
+
+    def report(self, fom, foms):
+        """ record the best point, reports are sent after jacobians
+        """
+        self._fom_count += 1
+        if (self._old_fom > fom) or (self._old_fom == -1):
+            self._old_fom = fom
+            self._old_foms = foms
+            self._x_best = self._x
+            self._simu_best = self._simu
+        if fom < self.worst_error_fom:
+            self.set_worst_error(self._x, fom)
+
+    def send_report(self):
+        """ creating and sending report for fit evolution
+        """
+        num_iter = self._jacobian_count // self._refresh_speed - 1
+        if num_iter < self["max_gen"].value+1:
+            self._best_history[num_iter, :-1] = self._x_best
+            self._best_history[num_iter, -1] = self._old_fom
+        report = EvolutionReport()
+        report["FOM"] = self._old_fom
+        report["FOMS"] = self._old_foms
+        report["corr"] = self.create_corr_matrix()
+        report["corr_header"] = self._para_tab.x_label
+        self._para_tab.x = self._x_best
+        self.calculate_error_bar()
+        report["param"] = self._para_tab.string_value
+        self._para_tab.apply_to_param(self._mod.script_dict, self._x_best)
+        simu = self._mod.simulate()
+        report["kinematic_error"] = self.kinematic_error
+        for index, data_name in enumerate(self["data_names"].value):
+            born = self["FOM"].born[index]
+            report["simulations"][data_name] = MAKE_DATA(simu[born[0]:
+                                                              born[1]])
+        self._report_notifier.signal.emit(report)
+
+    def optimize(self):
+        """ optimize
+        """
+        self._old_fom = -1
+        self._jacobian = None
+        self._jacobian_count = 0
+        # one report every refresh_speed iterations
+        self._refresh_speed = max(self["refresh_speed"].value, 1)
+        method = self["method"].value
+        lower, upper = np.array(self._para_tab.bounds, dtype=np.float64).T
+        x0 = np.clip(np.array(self._para_tab.x, dtype=np.float64), lower,
+                     upper)
+        options = {}
+        if method != "lm":
+            options["bounds"] = (lower, upper)
+        try:
+            result = least_squares(self.residuals, x0, jac=self.jacobian,
+                                   method=method, x_scale="jac",
+                                   max_nfev=max(self["max_gen"].value, 1),
+                                   **options)
+            self._result = result.x
+        except RefinementStopped:
+            self._result = self._x_best
@@ -20,6 +20,8 @@ from pyxcel.engine.optimization.generator_inspyred import param_generator
 from pyxcel.engine.pipeline import EvolutionReport
 from pyxcel.engine.optimization.generic import AbstractOptimisationFilter
 from pyxcel.engine.optimization.scipy_d_e_combined import Problem
+from pyxcel.engine.optimization.parallel import ModelDescription
+from pyxcel.engine.optimization.parallel import PoolEvaluator
 MAKE_DATA = paf.data.make_data
 
 
@@ -66,8 +68,11 @@ class OptimisationFilter(AbstractOptimisationFilter):
         """
         AbstractOptimisationFilter.__init__(self)
         self.add_expected_parameter("algo", MAKE_DATA(""), "NSGA2")
+        self.add_expected_parameter("workers", MAKE_DATA(1), 1)
         self["FOM"] = ParetoProblem()
 
+        #: pool of worker process (if workers is not 1)
+        self._pool = None
         #: fom count
         self._fom_count = 0
         self._best_foms = None
@@ -90,6 +95,22 @@ class OptimisationFilter(AbstractOptimisationFilter):
             return fom
         return new_scipy_fom
 
+    def pool_evaluator(self, candidates, args):
+        """ inspyred evaluator using the pool of worker process
+        """
+        arc = args["_ec"].archive
+        _, foms = self._pool.evaluate(candidates, lambda: self._stop)
+        if foms is None:
+            nb_fom = len(self["fom_func"])
+            return [inspyred.ec.emo.Pareto([1e20] * nb_fom)
+                    for _ in candidates]
+        fitness = []
+        for index in range(len(candidates)):
+            foms_ = list(foms[:, index])
+            fitness.append(inspyred.ec.emo.Pareto(foms_, maximize=True))
+            self["FOM"].callback(foms_, arc)
+        return fitness
+
     def select_in_arc(self, arc):
         """ select one solution in pareto optimum
         """
@@ -171,6 +192,7 @@ class OptimisationFilter(AbstractOptimisationFilter):
             self._para_tab.x = self._x_best
             report["param"] = self._para_tab.string_value
             report["corr_header"] = self._para_tab.x_label
+            report["kinematic_error"] = self.kinematic_error
             for index, data_name in enumerate(self["data_names"].value):
                 simulation = simulations[index]
                 report["simulations"][data_name] = MAKE_DATA(simulation)
@@ -200,9 +222,13 @@ class OptimisationFilter(AbstractOptimisationFilter):
     def optimize(self):
         """ optimize
         """
-        self._fom = inspyred.ec.evaluators.evaluator(self.
-                                                     create_fom(self["FOM"].
-                                                                fom))
+        if self["workers"].value != 1:
+            self._fom = self.pool_evaluator
+            self._pool = PoolEvaluator(ModelDescription(self),
+                                       self["workers"].value)
+        else:
+            pyxcel_fom = self.create_fom(self["FOM"].fom)
+            self._fom = inspyred.ec.evaluators.evaluator(pyxcel_fom)
         pop_size = self.pop_size
         max_evaluations = self["max_gen"].value * pop_size
         optimizer, kwarg = self.get_optimizer(self["algo"].value)
@@ -210,11 +236,16 @@ class OptimisationFilter(AbstractOptimisationFilter):
         max_ = [b for _, b in self._para_tab.bounds]
         generator = param_generator(self._para_tab.x)
         generator = inspyred.ec.generators.diversify(generator)
-        optimizer.evolve(generator=generator, evaluator=self._fom,
-                         pop_size=pop_size,
-                         bounder=inspyred.ec.Bounder(min_, max_),
-                         maximize=False, max_evaluations=max_evaluations,
-                         **kwarg)
+        try:
+            optimizer.evolve(generator=generator, evaluator=self._fom,
+                             pop_size=pop_size,
+                             bounder=inspyred.ec.Bounder(min_, max_),
+                             maximize=False, max_evaluations=max_evaluations,
+                             **kwarg)
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
 
         best = self.select_in_arc(optimizer.archive)
         self._x_best = best.candidate
@@ -0,0 +1,268 @@
+# -*- coding: utf8 -*-
+"""
+Contain the model of a combined optimization: its simulators and the script
+dictionary their parameters are read from.
+
+    :platform: Unix, Windows
+    :synopsis: model of a combined optimization
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+import numpy as np
+import paf.data
+import pyxcel.engine.simulator.xrf_no_genx as xrf
+from pyxcel.engine.simulator.optical_cache import OpticalFieldCache
+from pyxcel.engine.simulator.adaptive import AdaptiveSampler
+
+
+class CustomModel(object):
+    """ a model using custom simulator...
+    """
+    def __init__(self):
+        """ initialization
+        """
+        self._script_dict = {}
+        self._fom = None
+        self._instruments = []
+        self._sample = None
+
+    @property
+    def sample(self):
+        """ return a sample
+        """
+        return self._sample
+
+    @property
+    def instruments(self):
+        """ return list of instrument
+        """
+        return self._instruments
+
+    @property
+    def fom(self):
+        """ access to fom function
+        """
+        return self._fom
+
+    @fom.setter
+    def fom(self, value):
+        """ modify fom
+        """
+        self._fom = value
+
+    @property
+    def script_dict(self):
+        """ property to access to the script module dictionary
+        """
+        return self._script_dict
+
+    def add_stochio(self, stochio):
+        """ add stoichiometric parameter
+        """
+        for key in list(stochio.keys()):
+            #print key
+            cmmd = key + " = {}\n"
+            for idex, item in enumerate(stochio[key][:]):
+                cmmd += key + "['stochio_" + str(idex) + "'] = "
+                cmmd += str(item) + "\n"
+            cmmd += key + "['mass_dens'] = " + str(stochio[key][-1:][0])
+            cmmd += "\n"
+            exec(cmmd,  self.script_dict)
+            # fitted coefficients read by the simulators
+            self.script_dict[key]["values"] = np.array(stochio[key],
+                                                       dtype=np.float64)
+            
+
+    def add_sample(self, samples):
+        """ add some sample
+        """
+        self._sample = samples[0]
+        for sample in samples:
+            for key in sample.keys():
+                self.script_dict[key] = sample[key]
+
+    def add_instrument(self, instruments):
+        """ add some instrument
+        """
+        for key in instruments.keys():
+            self.script_dict[key] = instruments[key]
+            self._instruments.append(instruments[key])
+
+    def add_simulator_script(self, simulators):
+        """ create script simulator from a list of Simulator object.
+
+        :param simulators: list of simulator
+        """
+        self.script_dict["simulators"] = simulators
+
+        def simulate(simulators):
+            result = np.array([], dtype=np.float64)
+            for simulator in simulators: # proper simulation
+                result = np.concatenate((result, simulator.simulate()))
+            return result
+
+        self.script_dict["simulate"] = simulate
+        self.compiled = True
+        s = 'def Sim():\n\treturn simulate(simulators)\n'
+        exec(s, self.script_dict)
+
+    def simulate(self):
+        """ execute simulator
+        """
+        return self.script_dict["Sim"]()
+
+    def simulate_batch(self, population):
+        """ execute simulators for a population of layer parameters.
+
+        :param population: dictionary of (population, layers) array
+        :return: simulations (population, total number of points)
+        """
+        return np.concatenate([simulator.simulate_batch(population)
+                               for simulator in self.script_dict["simulators"]],
+                              axis=1)
+
+    def simulate_jacobian(self, directions):
+        """ execute simulators with the derivatives of their simulations.
+
+        :param directions: list of (key, layer index) or (key, None) for
+                           instrument parameters (see simulators)
+        :return: simulation (total number of points) and jacobian
+                 (len(directions), total number of points)
+        """
+        results = [simulator.simulate_jacobian(directions)
+                   for simulator in self.script_dict["simulators"]]
+        return (np.concatenate([simulation for simulation, _ in results]),
+                np.concatenate([jacobian for _, jacobian in results], axis=1))
+
+
+class LinkData(paf.data.CompositeData):
+    """ create a new setitem function
+    """
+    def __init__(self, origine=None, parts=None):
+        """ initialization
+        """
+        #: list of excluded parameter
+        self._excluded_par = ["I0"]
+        paf.data.CompositeData.__init__(self)
+        if origine is not None:
+            self._value = origine.real_value
+            self._data_type = dict
+            self._showing_info = origine.showing_info
+            self._abstract_data_type = origine.abstract_type
+            self._parts = parts
+            self._origine = origine
+
+    @property
+    def excluded_par(self):
+        """ get list of exclude parameter
+        """
+        return self._excluded_par
+
+    @excluded_par.setter
+    def excluded_par(self, value):
+        """ setter for excluded parameter
+        """
+        self._excluded_par = value
+
+    def to_origine(self):
+        """ tranform Link data to original data with new value
+        """
+        self._origine.real_value = self._value
+        return self._origine
+
+    def new_setter(self, key, value):
+        """ new setter
+        """
+        for part in self._parts:
+            paf.data.CompositeData.__setitem__(part, key, value)
+
+    def __setitem__(self, key, value):
+        """ new __setitem__ for link instrument
+        """
+        if key in self._excluded_par:
+            paf.data.CompositeData.__setitem__(self, key, value)
+        else:
+            self.new_setter(key, value)
+
+
+def create_model(samples, instruments, simulators, stochio=None):
+    """ create the model of a fit.
+
+    :param samples: list of sample
+    :param instruments: list of instrument
+    :param simulators: list of simulator (initialized later)
+    :param stochio: stoichiometric parameter if fitted
+    :rtype: CustomModel
+    """
+    mod = CustomModel()
+    mod.add_sample(samples.value)
+    mod.add_instrument({inst["name"].value: inst for inst in instruments})
+    mod.add_simulator_script(simulators)
+    if stochio is not None:
+        mod.add_stochio(stochio)
+    return mod
+
+
+def initialize_simulators(mod, simulators, parameters, theta_arrays, samples,
+                          instruments, filter_):
+    """ initialize simulators of a model, every simulators share the layer
+    parameters of the first one and the optical solutions of a candidate,
+    XRF simulators of the same angles share the field.
+
+    :param mod: model containing simulators
+    :type mod: CustomModel
+    :param filter_: filter using simulators
+    """
+    for index, simulator in enumerate(simulators):
+        simulator["parameter"] = parameters[index]
+        simulator["theta_array"] = theta_arrays[index]
+        simulator["stack"] = samples[index].value['sample']
+        simulator["instrument"] = instruments[index]
+        simulator.initialization(filter_)
+    mod.script_dict["parameters"] = simulators[0].model_parameters
+    for simulator in simulators.real_value[1:]:
+        mp = simulator.model_parameters
+        new_mp = mod.script_dict["parameters"]
+        mp['d'] = new_mp['d']
+        mp['sigmar'] = new_mp['sigmar']
+        mp['numerical_density'] = new_mp['numerical_density']
+        mp['mass_density'] = new_mp['mass_density']
+        for idx, each in enumerate(new_mp['material']): # edit simulator.model_parameters["material"] to remove "_"'s
+            new_mp['material'][idx] = each.replace("_","")
+        mp['material'] = new_mp['material'] 
+    # lines measured together are calculated with the same field
+    xrf.share_elfield(simulators)
+    # the optical solutions of a candidate are shared by all simulators
+    optical_cache = OpticalFieldCache()
+    for simulator in simulators:
+        simulator.optical_cache = optical_cache
+    # adaptive angular sampling if a tolerance is set
+    tolerance = getattr(filter_, "adaptive_tolerance", 0.)
+    for simulator in simulators:
+        simulator.adaptive_sampler = None
+        if tolerance > 0:
+            simulator.adaptive_sampler = AdaptiveSampler(tolerance)
+
+
+def link_instrument(instruments):
+    """ create a link between instruments
+
+    :param instruments: a list of pyxcel instrument
+    """
+
+    detectors = [inst["detector"] for inst in instruments]
+    sources = [inst["source"] for inst in instruments]
+    for instrument in instruments:
+        instrument["detector"] = LinkData(instrument["detector"], detectors)
+        instrument["source"] = LinkData(instrument["source"], sources)
+
+
+def unlink_instrument(instruments):
+    """ create a link between instruments
+
+    :param instruments: a list of pyxcel instrument
+    """
+
+    for instrument in instruments:
+        instrument["detector"] = instrument["detector"].to_origine()
+        instrument["source"] = instrument["source"].to_origine()
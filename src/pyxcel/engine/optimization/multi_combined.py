@@ -16,6 +16,8 @@ from pyxcel.engine.optimization.scipy_d_e_combined import Problem
 from pyxcel.engine.pipeline import EvolutionReport
 from pyxcel.engine.optimization.generic import AbstractOptimisationFilter
 from pyxcel.engine.optimization.generator_inspyred import param_generator
+from pyxcel.engine.optimization.parallel import ModelDescription
+from pyxcel.engine.optimization.parallel import PoolEvaluator
 MAKE_DATA = paf.data.make_data
 
 
@@ -28,7 +30,10 @@ class OptimisationFilter(AbstractOptimisationFilter):
         AbstractOptimisationFilter.__init__(self)
         self["FOM"] = Problem()
         self.add_expected_parameter("algo", MAKE_DATA(""), "DEA")
+        self.add_expected_parameter("workers", MAKE_DATA(1), 1)
 
+        #: pool of worker process (if workers is not 1)
+        self._pool = None
         #: fom count
         self._fom_count = 0
         self._old_fom = -1
@@ -51,8 +56,27 @@ class OptimisationFilter(AbstractOptimisationFilter):
             except UnboundLocalError:
                 fom = 1e20
             return fom
+        if self["workers"].value != 1:
+            return self.pool_evaluator
         return inspyred.ec.evaluators.evaluator(new_scipy_fom)
 
+    def pool_evaluator(self, candidates, args):
+        """ inspyred evaluator using the pool of worker process
+        """
+        combined, foms = self._pool.evaluate(candidates, lambda: self._stop)
+        if foms is None:
+            return list(combined)
+        # the simulation is only kept for the best candidate
+        best, best_simu = self.best_simulation(candidates, combined)
+        for index, x in enumerate(candidates):
+            self._x = x
+            self._simu = best_simu if index == best else None
+            fom = combined[index]
+            self["FOM"].callback(fom, list(foms[:, index]))
+            if fom < self.worst_error_fom:
+                self.set_worst_error(x, fom)
+        return list(combined)
+
     def report(self, fom, foms):
         """ creating and sending report for fit evolution
         """
@@ -63,7 +87,7 @@ class OptimisationFilter(AbstractOptimisationFilter):
             self._x_best = self._x
             self._simu_best = self._simu
         if self._fom_count % self._refresh_speed == 0:
-            num_iter = self._fom_count / self._refresh_speed - 1
+            num_iter = self._fom_count // self._refresh_speed - 1
             self._best_history[num_iter, :-1] = self._x_best
             self._best_history[num_iter, -1] = self._old_fom
             report = EvolutionReport()
@@ -76,6 +100,7 @@ class OptimisationFilter(AbstractOptimisationFilter):
             report["corr_header"] = self._para_tab.x_label
             self._para_tab.apply_to_param(self._mod.script_dict, self._x_best)
             simu = self._mod.simulate()
+            report["kinematic_error"] = self.kinematic_error
             simulations = [simu[self["FOM"].born[i][0]:self["FOM"].born[i][1]]
                            for i, _ in enumerate(foms)]
             for index, data_name in enumerate(self["data_names"].value):
@@ -127,10 +152,18 @@ class OptimisationFilter(AbstractOptimisationFilter):
         max_ = [b for _, b in self._para_tab.bounds]
         generator = param_generator(self._para_tab.x)
         generator = inspyred.ec.generators.diversify(generator)
-        optimizer.evolve(generator=generator,
-                         evaluator=self._fom,
-                         pop_size=pop_size,
-                         bounder=inspyred.ec.Bounder(min_, max_),
-                         maximize=False, max_evaluations=max_evaluations,
-                         **kwarg)
+        if self["workers"].value != 1:
+            self._pool = PoolEvaluator(ModelDescription(self),
+                                       self["workers"].value)
+        try:
+            optimizer.evolve(generator=generator,
+                             evaluator=self._fom,
+                             pop_size=pop_size,
+                             bounder=inspyred.ec.Bounder(min_, max_),
+                             maximize=False, max_evaluations=max_evaluations,
+                             **kwarg)
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
         self._result = self._x_best
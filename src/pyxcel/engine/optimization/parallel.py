@@ -0,0 +1,248 @@
+# -*- coding: utf8 -*-
+"""
+Contain tools to evaluate candidates of a combined optimization in worker
+processes. Each worker rebuild the model once from a plain description, only
+candidates and figures of merit are exchanged after.
+
+    :platform: Unix, Windows
+    :synopsis: parallel evaluation of candidates.
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+import multiprocessing
+import pickle
+import numpy as np
+import paf.data
+import pyxcel.engine.optimization.fom
+from pyxcel.engine.optimization.param_tab import ParaTab
+from pyxcel.engine.optimization.model import create_model
+from pyxcel.engine.optimization.model import initialize_simulators
+MAKE_DATA = paf.data.make_data
+
+#: model of the current worker process
+_WORKER = None
+
+
+class ModelDescription(object):
+    """ plain description of the model of an optimisation filter, enough to
+    rebuild it in another process. It must be created once the parameter tab,
+    the FOM and the data set of the filter are ready.
+    """
+    def __init__(self, opti_filter):
+        """ initialization
+
+        :param opti_filter: filter to describe
+        :type opti_filter: AbstractOptimisationFilter
+        """
+        problem = opti_filter["FOM"]
+        stochio = None
+        if opti_filter.fit_stochio:
+            stochio = opti_filter.get_data("stack_data").stochio
+        data_set = opti_filter.data_set
+        state = {"tab": opti_filter.para_tab.string_value,
+                 "fit_stochio": opti_filter.fit_stochio,
+                 "fit_inst": opti_filter.fit_inst,
+                 "adaptive_tolerance": opti_filter.adaptive_tolerance,
+                 "kinematic_factor": opti_filter.kinematic_factor,
+                 "samples": opti_filter.get_data("samples"),
+                 "instruments": opti_filter.get_data("instruments"),
+                 "simulators": [simulator.__class__
+                                for simulator in opti_filter["simulators"]],
+                 "parameters": opti_filter["parameters"],
+                 "stochio": stochio,
+                 "theta_arrays": problem.theta_array,
+                 "problem": problem.__class__,
+                 "fom_func": opti_filter["fom_func"].value,
+                 "fom_factors": problem.fom_factors,
+                 "data_set": (data_set.x, data_set.y, data_set.error)}
+        # linked instruments stay linked as they are pickled together
+        self._state = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+    def load(self):
+        """ return a new copy of the described state
+
+        :rtype: dict
+        """
+        return pickle.loads(self._state)
+
+
+class ModelWorker(object):
+    """ model rebuilt from a description, used as filter by its simulators
+    """
+    def __init__(self, description):
+        """ initialization
+
+        :param description: description of the model
+        :type description: ModelDescription
+        """
+        state = description.load()
+        self._fit_stochio = state["fit_stochio"]
+        self._fit_inst = state["fit_inst"]
+        self._adaptive_tolerance = state["adaptive_tolerance"]
+        self._kinematic_factor = state["kinematic_factor"]
+        self._main = MAKE_DATA(state["tab"])
+
+        # model
+        samples = state["samples"]
+        instruments = state["instruments"]
+        simulators = MAKE_DATA([simulator()
+                                for simulator in state["simulators"]])
+        self._mod = create_model(samples, instruments, simulators,
+                                 state["stochio"])
+        initialize_simulators(self._mod, simulators, state["parameters"],
+                              state["theta_arrays"], samples, instruments,
+                              self)
+        self._para_tab = ParaTab()
+        self._para_tab.string_value = state["tab"]
+        self._para_tab.compile(self._mod.script_dict, self._fit_stochio)
+
+        # figure of merit
+        self._problem = state["problem"]()
+        self._problem.fom_func = state["fom_func"]
+        self._problem.set_p(len(self._para_tab.bounds))
+        self._problem.fom_factors = state["fom_factors"]
+        self._problem.theta_array = state["theta_arrays"]
+        self._data_set = pyxcel.engine.optimization.fom.DataSet()
+        (self._data_set.x, self._data_set.y,
+         self._data_set.error) = state["data_set"]
+
+    def __getitem__(self, key):
+        """ the worker has no filter parameter
+        """
+        raise KeyError(key)
+
+    @property
+    def model(self):
+        """ property for accessing to the model
+        """
+        return self._mod
+
+    @property
+    def fit_stochio(self):
+        """ True if simulator must recalculate stochio dependent parameter
+        """
+        return self._fit_stochio
+
+    @property
+    def fit_inst(self):
+        """ True if instrument is fitted
+        """
+        return self._fit_inst
+
+    @property
+    def adaptive_tolerance(self):
+        """ relative tolerance of adaptive angular sampling
+        """
+        return self._adaptive_tolerance
+
+    @property
+    def kinematic_factor(self):
+        """ multiple of the critical angle above which XRR is kinematic
+        """
+        return self._kinematic_factor
+
+    def get_data(self, port_name):
+        """ only the parameter tab is read by simulators
+        """
+        return self._main
+
+    def evaluate(self, candidates):
+        """ calculate the figures of merit of candidates
+
+        :param candidates: candidates (population, nb_x)
+        :return: combined fom (population,) and fom array (nb_fom, population)
+        """
+        candidates = np.asarray(candidates, dtype=np.float64)
+        plan = self._para_tab.plan
+        try:
+            if plan.batchable:
+                simus = self._mod.simulate_batch(plan.batch(candidates))
+            else:
+                simus = []
+                for x in candidates:
+                    plan.apply(x)
+                    simus.append(self._mod.simulate())
+                simus = np.array(simus)
+        except UnboundLocalError:
+            nb_fom = len(self._problem.fom_func)
+            return (np.ones(len(candidates)) * 1e20,
+                    np.ones((nb_fom, len(candidates))) * 1e20)
+        combined, foms = self._problem.fom_batch(simus, self._data_set)
+        return combined, np.array(foms)
+
+
+def _init_worker(description):
+    """ build the model of the worker process
+    """
+    global _WORKER
+    _WORKER = ModelWorker(description)
+
+
+def _evaluate(candidates):
+    """ evaluate candidates in the worker process
+    """
+    return _WORKER.evaluate(candidates)
+
+
+def nb_process(workers):
+    """ number of process to use, all cpu if workers is lower than 1
+    """
+    if workers < 1:
+        return multiprocessing.cpu_count()
+    return workers
+
+
+class PoolEvaluator(object):
+    """ persistent pool of worker process evaluating candidates
+    """
+    def __init__(self, description, workers):
+        """ initialization
+
+        :param description: description of the model
+        :type description: ModelDescription
+        :param workers: number of process (all cpu if lower than 1)
+        :type workers: int
+        """
+        self._processes = nb_process(workers)
+        self._pool = multiprocessing.Pool(self._processes, _init_worker,
+                                          (description,))
+
+    def evaluate(self, candidates, stopped=None):
+        """ calculate the figures of merit of candidates, split on workers.
+
+        :param candidates: candidates (population, nb_x)
+        :param stopped: function returning True if the evaluation must be
+                        abandoned, every combined fom is then 1e20 and the fom
+                        array is None
+        :return: combined fom (population,) and fom array (nb_fom, population)
+        """
+        candidates = np.asarray(candidates, dtype=np.float64)
+        if self._pool is None:
+            return np.ones(len(candidates)) * 1e20, None
+        chunks = [chunk for chunk in
+                  np.array_split(candidates, self._processes) if len(chunk)]
+        async_result = self._pool.map_async(_evaluate, chunks)
+        while not async_result.ready():
+            async_result.wait(0.1)
+            if stopped is not None and stopped():
+                self.terminate()
+                return np.ones(len(candidates)) * 1e20, None
+        results = async_result.get()
+        return (np.concatenate([combined for combined, _ in results]),
+                np.concatenate([foms for _, foms in results], axis=1))
+
+    def close(self):
+        """ close the pool after the end of the fit
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        """ stop immediately every worker
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
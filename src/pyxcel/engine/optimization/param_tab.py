@@ -0,0 +1,719 @@
+# -*- coding: utf8 -*-
+"""
+Contain the parameter tab of a combined optimization and its compiled plan.
+
+    :platform: Unix, Windows
+    :synopsis: parameter tab
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+import copy
+import numpy as np
+import pyxcel.engine.modeling.tools as tools
+from pyxcel.engine.modeling.entity import StackData
+
+
+class ParaTab(object):
+    """ represent a parameter tab
+    """
+    def __init__(self):
+        """ initialization
+        """
+        self._source_elements = ["I0"]
+        self._detector_elements = ["dist", "pinhole_height",
+                                   "width_parallel_l", "width_parallel_s",
+                                   "res", "Ibkg"]
+        #: boundary off each parameter formated for scipy
+        self._bounds = []
+        #: list of parameter to fit
+        self._params = []
+        #: contain the groupe list
+        self._groups = []
+        #: stirng value formated for GenX.
+        self._string_value = ""
+        #: actual value of parameter
+        self._x = []
+        #: error bars of the parameter
+        self._error = []
+        #: list of name of each layer for the stack model
+        self._stack_name_list = None
+        #: compiled plan used by apply_to_param during a fit
+        self._plan = None
+        #: last vector applied by the plan, not yet written in string value
+        self._pending_x = None
+
+    def _sync_string(self):
+        """ write the last vector applied by the plan in the string value
+        """
+        if self._pending_x is not None:
+            value = self._pending_x
+            self._pending_x = None
+            self._x = list(value)
+            self._apply_column(1, value)
+
+    def _apply_column(self, index, value):
+        """ apply a value vector to a column
+        """
+        lines = self._string_value.split("\n")
+        new_string_value = lines[0]
+        tab_lines = lines[1:]
+        dic_group = {}
+        group_list = self.groups
+        diff_idx = 0
+        for idx, tab_line in enumerate(tab_lines):
+            if len(tab_line) < 5:
+                continue
+            new_tabline = tab_line.split()
+            idx_value = idx - diff_idx
+            if new_tabline[-1] != "None":
+                if new_tabline[-1] in group_list:
+                    group_list.remove(new_tabline[-1])
+                    dic_group[new_tabline[-1]] = idx_value
+                else:
+                    diff_idx += 1
+                    idx_value = dic_group[new_tabline[-1]]
+            new_tabline[index] = str(value[idx_value])
+            if eval(new_tabline[2]):
+                new_string_value += '\n' + '\t'.join(new_tabline)
+            else:
+                diff_idx += 1
+                new_string_value += '\n' + '\t'.join(tab_line)
+        self._string_value = new_string_value
+
+    @property
+    def layer_rank(self):
+        """ accessing to layer rank
+        """
+        return self._layer_rank
+
+    @property
+    def bounds(self):
+        """ accessing to bounds
+        """
+        return self._bounds
+
+    @property
+    def params(self):
+        """ accessing to fitted parameter list
+        """
+        return self._params
+
+    @property
+    def x_label(self):
+        """ return the params with all member of groups replace by first member
+        named by group name
+        """
+        x_label = copy.copy(self.params)
+        group_list = []
+        diff_idx = 0
+        for idx, groupe in enumerate(self.groups):
+            if groupe != "None":
+                if groupe in group_list:
+                    del x_label[idx-diff_idx]
+                    diff_idx += 1
+                else:
+                    x_label[idx-diff_idx] = groupe
+        return x_label
+
+    @property
+    def x(self):
+        """ accesssing to x vector
+        """
+        self._sync_string()
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        """ setter for x value
+        """
+        self._pending_x = None
+        self._x = list(value)
+        self._apply_column(1, value)
+
+    @property
+    def error(self):
+        """ accessing to error bar
+        """
+        return self._error
+
+    @error.setter
+    def error(self, value):
+        """ setter for error value
+        """
+        self._sync_string()
+        self._error = list(value)
+        self._apply_column(5, value)
+
+    @property
+    def groups(self):
+        """ return list of groups *only one by name*
+        """
+        list_groups = list(set(self._groups))
+        list_groups.remove("None")
+        return list_groups
+
+    @property
+    def plan(self):
+        """ accessing to the compiled plan (None if not compiled)
+        """
+        return self._plan
+
+    @property
+    def string_value(self):
+        """ acces to the string value
+        """
+        self._sync_string()
+        return self._string_value
+
+    @string_value.setter
+    def string_value(self, value):
+        """ load from a string value
+
+        :param value: string value
+        :type value: str
+        """
+        self._string_value = value
+        self._plan = None
+        self._pending_x = None
+#         print("value " + value)             ###
+        tab = value.split("\n")[1:-1]
+#         for t in tab:                       ###
+#             print("tab " + t)               ###
+        self._bounds = []
+        self._params = []
+        self._x = []
+        self._error = []
+        self._groups = []
+        group_list = []
+        for tab_line in tab:                
+#             print("tab_line " + tab_line)   ###
+            line = tab_line.split()
+#             for l in line:                  ###
+#                 print("line " + l)          ###
+            if eval(line[2]):
+                self._params.append(line[0])
+                self._groups.append(line[-1])
+                if line[-1] != "None":
+                    if line[-1] in group_list:
+                        continue
+                    else:
+                        group_list.append(line[-1])
+                self._bounds.append((float(line[3]), float(line[4])))
+                self._x.append(float(line[1]))
+                try:
+                    self._error.append(float(line[5]))
+                except ValueError:
+                    self._error.append(0.)
+
+    def load_from_file(self, file_name):
+        """ load parameter tab from file
+
+        :param file_name: name of the file
+        :type file_name: str
+        """
+        with open(file_name, "r") as f:
+            tab_string = f.read()
+            self.string_value = tab_string
+
+    def apply_to_genx_dict(self, genx_dict, x=None):
+        """ apply to a dictionary of genx element
+        """
+        if x is None:
+            x = self.x
+        for idx, param in enumerate(self.params):
+            str_statement = param + '(' + str(x[idx]) + ')'
+            exec(str_statement, genx_dict)
+        self.x = x
+
+    def get_data_to_modify(self, pyxcel_dict, data_name, key):
+        """ get the data to modify
+        """
+        to_edit = None
+        if key in self._source_elements:
+            to_edit = pyxcel_dict[data_name]['source']
+        elif key in self._detector_elements:
+            to_edit = pyxcel_dict[data_name]['detector']
+        else:
+            list_stack = []
+            for temporary_element_name in pyxcel_dict.keys():
+                temporary_element = (pyxcel_dict[temporary_element_name])
+                if isinstance(temporary_element, StackData):
+                    if temporary_element_name[-4:] != "save":
+                        list_stack.append(temporary_element)
+            stack = list_stack[0]
+            if stack['ambient']["name"].value == data_name:
+                to_edit = stack['ambient']
+            elif stack['substrate']["name"].value == data_name:
+                to_edit = stack['substrate']
+            else:
+                stack = stack['layers']
+                for layer in stack:
+                    if layer['name'].value == data_name:
+                        to_edit = layer
+
+        return to_edit
+
+    @staticmethod
+    def get_var_name(line):
+        """ get variable name from line
+        """
+        key_name_up = line[0].split(".")[1][3:]
+        key_name = key_name_up[0].lower() + key_name_up[1:]
+        maj_list = ["I0", "Ibkg"]
+        if key_name_up in maj_list:
+            key_name = key_name_up
+        return key_name
+
+    def apply_stochio(self, pyxcel_dict, line):
+        """ apply stochio to mpyxceldict
+        """
+        data_name = line[0].split(".")[0][8:]
+        index = int(line[0].split(".")[1][10:])
+        to_edit = self.get_data_to_modify(pyxcel_dict, data_name, "material")
+        formula = tools.StochioFormula(to_edit['material'].value)
+        values = formula.values.copy()
+        # value is rounded to 2 digits, other coefficients keep their marker
+        values[index] = round(float(line[1]), 2)
+        marked = [idx for idx in range(len(values)) if idx != index]
+        to_edit['material'] = formula.formula(values, marked)
+
+    def apply_to_dict(self, pyxcel_dict, x=None):
+        """ apply to a dictionary of element
+        """
+        if x is not None:
+            self.x = x
+        tab_string = self.string_value
+        tab_lines = tab_string.split("\n")[1:]
+        tab_lines.sort(reverse=True) # circumvent multiple stoichiometric coefficients fitting on the same material
+        for tab_line in tab_lines:
+            line = tab_line.split()
+            try:
+                data_name, var_name = line[0].split(".")
+            except IndexError:
+                return
+            if data_name[:7] == "stochio":
+                self.apply_stochio(pyxcel_dict, line)
+                continue
+            elif var_name[:11] == "setProfile_":
+                self.apply_to_profile(pyxcel_dict, line)
+                continue
+            key_name = self.get_var_name(line)
+            to_edit = self.get_data_to_modify(pyxcel_dict, data_name, key_name)
+            if key_name == "numerical_density":
+                oth_dens = tools.calc_mass_density(float(line[1]),
+                                                   to_edit["material"])
+                to_edit["mass_density"] = oth_dens
+            if key_name == "mass_density":
+                oth_dens = tools.calc_num_density(float(line[1]),
+                                                  to_edit["material"])
+                to_edit["numerical_density"] = oth_dens
+            to_edit[key_name] = float(line[1])
+
+    def apply_to_profile(self, pyxcel_dict, line):
+        """ apply a line to profile
+        """
+        self.profile_setter(pyxcel_dict, line[0])(float(line[1]))
+
+    @staticmethod
+    def find_stack(pyxcel_dict):
+        """ return the stack of pyxcel_dict
+        """
+        for name in pyxcel_dict.keys():
+            element = pyxcel_dict[name]
+            if isinstance(element, StackData):
+                if name[-4:] != "save":
+                    return element
+        return None
+
+    @classmethod
+    def find_profile(cls, pyxcel_dict, profile_name):
+        """ return the layer profile named profile_name in the stack of
+        pyxcel_dict
+        """
+        stack = cls.find_stack(pyxcel_dict)
+        profile = None
+        for lay in stack.real_value["layers"]:
+            if lay["name"].value == profile_name:
+                profile = lay
+                break
+        return profile
+
+    def profile_setter(self, pyxcel_dict, name):
+        """ create setter of a profile line, the layer is found once
+
+        :param name: name of the line
+        :type name: str
+        """
+        data_name, var_name = name.split(".")
+        var_name = var_name[11:]
+        layer = self.find_profile(pyxcel_dict, data_name)
+        if var_name == "d":
+            def setter(value):
+                """ set depth of the profile
+                """
+                layer.d = value
+        elif var_name == "sigmar":
+            if "parameters" in pyxcel_dict.keys():
+                sigmar = pyxcel_dict["parameters"]["sigmar"]
+                index = list(pyxcel_dict["parameters"]["name"]).index(
+                    data_name + "_start")
+            else:
+                sigmar = layer
+                index = "sigmar"
+
+            def setter(value):
+                """ set roughness of the profile
+                """
+                sigmar[index] = value
+        else:
+            try:
+                idx = int(var_name[:var_name.index("_")])
+                to_edit = layer["materials"]["computers"][idx]["kwargs"]
+            except ValueError:
+                to_edit = layer["densities"]
+            var_name = var_name[var_name.index("_")+1:]
+
+            def setter(value):
+                """ set argument of profile function
+                """
+                to_edit[var_name] = value
+        return setter
+
+    def recalculate_profile(self, pyxcel_dict, profile_name):
+        """ recalculate profile
+        """
+        self.profile_recalculator(pyxcel_dict, profile_name)()
+
+    def profile_recalculator(self, pyxcel_dict, profile_name):
+        """ create function writing the sublayers of a profile in the
+        parameters, the layer and its sublayers are found once
+        """
+        stack = self.find_stack(pyxcel_dict)
+        profile = self.find_profile(pyxcel_dict, profile_name)
+        parameters = pyxcel_dict["parameters"]
+        if self._stack_name_list is None:
+            self._stack_name_list = list(parameters['name'])
+        start = self._stack_name_list.index(profile_name + "_start")
+        end = self._stack_name_list.index(profile_name + "_end")
+
+        def recalculator():
+            """ write the sublayers of the profile in the parameters
+            """
+            profile.to_parameters(parameters, end, start)
+            stack.invalidate_layers(profile)
+        return recalculator
+
+    def apply_to_other(self, pyxcel_dict, line):
+        """ apply instrument or stochio line to pyxcel dict
+        """
+        key = self.get_var_name(line)
+        data_name = line[0].split(".")[0]
+        # to_edit = 0.  # {key: 0.}
+        if key in self._source_elements:
+            to_edit = pyxcel_dict[data_name]['source']
+        elif key in self._detector_elements:
+            to_edit = pyxcel_dict[data_name]['detector']
+        else:
+            to_edit = pyxcel_dict[data_name]
+        self.item_setter(to_edit, key)(float(line[1]))
+
+    @staticmethod
+    def item_setter(to_edit, key):
+        """ setter of key in to_edit, fitted coefficients of a stochio are
+        written in its array of values
+        """
+        values = None
+        if key[:7] == "stochio" and isinstance(to_edit, dict):
+            values = to_edit.get("values")
+
+        def setter(value):
+            """ set value
+            """
+            if values is None:
+                to_edit[key] = value
+            else:
+                values[int(key[7:])] = value
+        return setter
+
+    def compile(self, pyxcel_dict, dynamic_material=False):
+        """ compile the tab for pyxcel_dict, apply_to_param then only scatter
+        x in the model parameter without reading the string value.
+
+        :param pyxcel_dict: dictionary of the model (with "parameters")
+        :param dynamic_material: True if materials can change during the fit
+        :type dynamic_material: bool
+        :return: the compiled plan
+        :rtype: ParamPlan
+        """
+        self._plan = ParamPlan(self, pyxcel_dict, dynamic_material)
+        return self._plan
+
+    def release(self):
+        """ forget the compiled plan and update the string value
+        """
+        self._sync_string()
+        self._plan = None
+
+    def apply_to_param(self, pyxcel_dict, x=None):
+        """ apply tab on model parameter
+        """
+        if self._plan is not None:
+            if x is None:
+                x = self.x
+            self._plan.apply(x)
+            self._pending_x = np.array(x, dtype=np.float64)
+            return
+        recalculate_profile = []
+        parameters = pyxcel_dict["parameters"]
+        if x is not None:
+            self.x = x
+        if self._stack_name_list is None:
+            self._stack_name_list = list(parameters['name'])
+        tab_string = self.string_value
+        tab_lines = tab_string.split("\n")[1:]
+        for tab_line in tab_lines:
+            line = tab_line.split()
+            try:
+                data_name, var_name = line[0].split(".") ### plante car line [0]==instru+intitulécolonne+param, si pas de header colonne, intitulé == xxx.yyy (nombre) => 2 points dans string
+            except IndexError:
+                return
+            if self._stack_name_list.count(data_name) > 0:
+                actual_index = 0
+                for _ in range(self._stack_name_list.count(data_name)):
+                    index = (self._stack_name_list[actual_index:]
+                             .index(data_name) + actual_index)
+                    actual_index = index
+                    key_name = self.get_var_name(line)
+                    if key_name == "numerical_density":
+                        mat = parameters["material"][index]
+                        oth_dens = tools.calc_mass_density(float(line[1]), mat)
+                        parameters["mass_density"][index] = oth_dens
+                    if key_name == "mass_density":
+                        mat = parameters["material"][index]
+                        oth_dens = tools.calc_num_density(float(line[1]), mat)
+                        parameters["numerical_density"][index] = oth_dens
+                    parameters[key_name][index] = float(line[1])
+            elif var_name[:11] == "setProfile_":
+                self.apply_to_profile(pyxcel_dict, line)
+                recalculate_profile.append(data_name)
+            else:
+                self.apply_to_other(pyxcel_dict, line)
+        if len(recalculate_profile) > 0:
+            recalculate_profile = list(set(recalculate_profile))
+            for profile in recalculate_profile:
+                self.recalculate_profile(pyxcel_dict, profile)
+
+
+class ParamPlan(object):
+    """ parameter tab compiled for one model: each line of the tab is resolved
+    once to index arrays in the parameters dictionary so applying a vector is
+    only a few numpy scatters.
+    """
+    #: layer parameters a population can be stacked on
+    batch_keys = ("d", "sigmar", "numerical_density", "mass_density")
+
+    def __init__(self, para_tab, pyxcel_dict, dynamic_material=False):
+        """ initialization
+
+        :param para_tab: tab to compile
+        :type para_tab: ParaTab
+        :param pyxcel_dict: dictionary of the model (with "parameters")
+        :param dynamic_material: True if materials can change during the fit
+        :type dynamic_material: bool
+        """
+        self._para_tab = para_tab
+        self._pyxcel_dict = pyxcel_dict
+        self._parameters = pyxcel_dict["parameters"]
+        self._dynamic_material = dynamic_material
+        name_list = list(self._parameters['name'])
+        lines = self.resolve_lines(para_tab.string_value)
+        nb_x = len(para_tab.bounds)
+
+        # not fitted line are read after x in the extended vector
+        fixed = [value for _, x_idx, value in lines if x_idx == -1]
+        #: value of not fitted line
+        self._fixed = np.array(fixed, dtype=np.float64)
+        scatters = {}
+        couplings = {}
+        #: (setter, index in x) for instrument and stochio lines
+        self._others = []
+        #: (setter, index in x) for profile lines
+        self._profile_lines = []
+        #: name of profile to recalculate
+        self._profiles = []
+        nb_fixed = 0
+        for name, x_idx, _ in lines:
+            if x_idx == -1:
+                x_idx = nb_x + nb_fixed
+                nb_fixed += 1
+            data_name, var_name = name.split(".")
+            if data_name in name_list:
+                key_name = para_tab.get_var_name([name])
+                index = [idx for idx, lay_name in enumerate(name_list)
+                         if lay_name == data_name]
+                if key_name in ("numerical_density", "mass_density"):
+                    couplings.setdefault(key_name, ([], []))
+                    couplings[key_name][0].extend(index)
+                    couplings[key_name][1].extend([x_idx] * len(index))
+                scatters.setdefault(key_name, ([], []))
+                scatters[key_name][0].extend(index)
+                scatters[key_name][1].extend([x_idx] * len(index))
+            elif var_name[:11] == "setProfile_":
+                self._profile_lines.append((para_tab.profile_setter(
+                    pyxcel_dict, name), x_idx))
+                if data_name not in self._profiles:
+                    self._profiles.append(data_name)
+            else:
+                self._others.append((self._create_setter(name), x_idx))
+
+        #: (key, parameter indexes, x indexes)
+        self._scatters = [(key, np.array(p_idx, dtype=int),
+                           np.array(x_idx, dtype=int))
+                          for key, (p_idx, x_idx) in scatters.items()]
+        #: (key, parameter indexes, x indexes) for density coupling
+        self._couplings = [(key, np.array(p_idx, dtype=int),
+                            np.array(x_idx, dtype=int))
+                           for key, (p_idx, x_idx) in couplings.items()]
+        #: writer of the sublayers of each profile
+        self._recalculators = [para_tab.profile_recalculator(pyxcel_dict,
+                                                             name)
+                               for name in self._profiles]
+        #: material used for each density factor
+        self._materials = {}
+        #: mass density for a numerical density of 1 in each layer
+        self._factor = np.ones(len(name_list))
+        self._update_factors()
+
+    @staticmethod
+    def resolve_lines(tab_string):
+        """ list (name, index in x, value) of each line of the tab. Group
+        members share the index of the first member, not fitted line have -1
+        as index.
+
+        :param tab_string: string value of a tab
+        :type tab_string: str
+        :rtype: list
+        """
+        lines = []
+        groups = {}
+        nb_x = 0
+        for tab_line in tab_string.split("\n")[1:]:
+            line = tab_line.split()
+            if len(line) == 0:
+                break
+            if eval(line[2]):
+                if line[-1] != "None" and line[-1] in groups:
+                    x_idx = groups[line[-1]]
+                else:
+                    x_idx = nb_x
+                    nb_x += 1
+                    if line[-1] != "None":
+                        groups[line[-1]] = x_idx
+            else:
+                x_idx = -1
+            lines.append((line[0], x_idx, float(line[1])))
+        return lines
+
+    def _create_setter(self, name):
+        """ create setter for an instrument or stochio line
+        """
+        key = ParaTab.get_var_name([name])
+        data_name = name.split(".")[0]
+        para_tab = self._para_tab
+        if key in para_tab._source_elements:
+            to_edit = self._pyxcel_dict[data_name]['source']
+        elif key in para_tab._detector_elements:
+            to_edit = self._pyxcel_dict[data_name]['detector']
+        else:
+            to_edit = self._pyxcel_dict[data_name]
+        return ParaTab.item_setter(to_edit, key)
+
+    def _update_factors(self):
+        """ compute density factor of coupled layer if material changed
+        """
+        materials = self._parameters["material"]
+        for _, p_idx, _ in self._couplings:
+            for index in p_idx:
+                material = materials[index]
+                if self._materials.get(index) != material:
+                    self._materials[index] = material
+                    self._factor[index] = tools.calc_mass_density(1.,
+                                                                  material)
+
+    @property
+    def batchable(self):
+        """ True if only layer parameters in batch_keys are fitted, so a
+        population can be evaluated with batch.
+        """
+        return (not self._others and not self._profile_lines and
+                all(key in self.batch_keys for key, _, _ in self._scatters))
+
+    def directions(self):
+        """ layer parameters moved by each fitted value, as directions of
+        simulate_jacobian with their factor
+
+        :return: list of (key, layer index, factor) for each value of x, None
+                 for values also applied to other parameters
+        :rtype: list
+        """
+        nb_x = len(self._para_tab.bounds)
+        directions = [[] for _ in range(nb_x)]
+        others = set(x_idx for _, x_idx in self._others + self._profile_lines)
+        for key, p_idx, x_idx in self._scatters:
+            for layer, index in zip(p_idx, x_idx):
+                if index >= nb_x:
+                    continue
+                if key == "mass_density":
+                    directions[index].append(("numerical_density", layer,
+                                              1./self._factor[layer]))
+                elif key in self.batch_keys:
+                    directions[index].append((key, layer, 1.))
+                else:
+                    others.add(index)
+        return [None if index in others else direction
+                for index, direction in enumerate(directions)]
+
+    def _scatter(self, parameters, x):
+        """ write extended x (or population of x on last axis) in parameters
+        """
+        for key, p_idx, x_idx in self._scatters:
+            parameters[key][..., p_idx] = x[..., x_idx]
+        if self._dynamic_material:
+            self._update_factors()
+        for key, p_idx, x_idx in self._couplings:
+            if key == "numerical_density":
+                parameters["mass_density"][..., p_idx] = (x[..., x_idx] *
+                                                          self._factor[p_idx])
+            else:
+                parameters["numerical_density"][..., p_idx] = (
+                    x[..., x_idx] / self._factor[p_idx])
+
+    def batch(self, xs):
+        """ stacked layer parameters of a population, the model is not
+        modified.
+
+        :param xs: population of x vector (population, nb_x)
+        :return: dictionary of (population, layers) array for batch_keys
+        :rtype: dict
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        nb_ind = xs.shape[0]
+        xs = np.concatenate((xs, np.tile(self._fixed, (nb_ind, 1))), axis=1)
+        population = {key: np.tile(self._parameters[key], (nb_ind, 1))
+                      for key in self.batch_keys}
+        self._scatter(population, xs)
+        return population
+
+    def apply(self, x):
+        """ apply a x vector on model parameter
+
+        :param x: vector of fitted value
+        """
+        x = np.concatenate((np.asarray(x, dtype=np.float64), self._fixed))
+        self._scatter(self._parameters, x)
+        for setter, x_idx in self._others:
+            setter(float(x[x_idx]))
+        for setter, x_idx in self._profile_lines:
+            setter(float(x[x_idx]))
+        for recalculator in self._recalculators:
+            recalculator()
@@ -14,6 +14,8 @@ import paf.data
 import pyxcel.engine.optimization.fom
 from pyxcel.engine.pipeline import EvolutionReport
 from pyxcel.engine.optimization.generic import AbstractOptimisationFilter
+from pyxcel.engine.optimization.parallel import ModelDescription
+from pyxcel.engine.optimization.parallel import PoolEvaluator
 MAKE_DATA = paf.data.make_data
 
 
@@ -121,8 +123,8 @@ class Problem(paf.data.CompositeData):
             combined_fom += (fom * self._factors[index])
         return combined_fom
 
-    def fom(self, simulation, datas):
-        """ calculate combined figure of merit
+    def _split_datas(self, datas):
+        """ split datas in one dataset for each fom at first call
         """
         if not self._p_setted:
             self.set_p(1)
@@ -135,6 +137,11 @@ class Problem(paf.data.CompositeData):
                 dataset.y = dataset.y[self._born[i][0]:self._born[i][1]]
                 dataset.error = dataset.error[self._born[i][0]:
                                               self._born[i][1]]
+
+    def fom(self, simulation, datas):
+        """ calculate combined figure of merit
+        """
+        self._split_datas(datas)
         simulations = [simulation[self._born[i][0]:self._born[i][1]]
                        for i, _ in enumerate(self._fom_function)]
         for sim in simulations:
@@ -146,6 +153,43 @@ class Problem(paf.data.CompositeData):
             self._callback(fom, foms)
         return fom
 
+    def fom_batch(self, simulations, datas):
+        """ calculate combined figure of merit for each row of simulations.
+        The callback is not called: only the caller knows the individual
+        behind each row.
+
+        :param simulations: simulations (population, total points)
+        :return: combined fom (population,) and list of fom (population,)
+        """
+        self._split_datas(datas)
+        foms = []
+        for i, fom in enumerate(self._fom_function):
+            simulation = simulations[:, self._born[i][0]:self._born[i][1]]
+            simulation[np.isinf(simulation)] = 0
+            foms.append(fom.batch(simulation, self._datas[i]))
+        return self.combine(foms), foms
+
+    def residuals(self, simulation, datas):
+        """ residuals of each figure of merit weighted by the square root of
+        its factor, their sum of squares is the combined figure of merit of
+        least square FOM
+
+        :param simulation: simulation (total points)
+        :return: residuals and their derivatives with respect to the
+                 simulation (total points)
+        """
+        self._split_datas(datas)
+        residuals = []
+        slopes = []
+        for i, fom in enumerate(self._fom_function):
+            simulation_i = simulation[self._born[i][0]:self._born[i][1]]
+            simulation_i[np.isinf(simulation_i)] = 0
+            residual, slope = fom.residuals(simulation_i, self._datas[i])
+            weight = np.sqrt(self._factors[i])
+            residuals.append(residual * weight)
+            slopes.append(slope * weight)
+        return np.concatenate(residuals), np.concatenate(slopes)
+
     def to_xml(self, xml_doc, xml_parrent, name):
         if "foms" not in self._value.keys():
             self._value["foms"] = MAKE_DATA(self._fom_function)
@@ -167,7 +211,11 @@ class OptimisationFilter(AbstractOptimisationFilter):
 
         # add special parameter
         self.add_expected_parameter("polish", MAKE_DATA(False), False)
+        self.add_expected_parameter("vectorized", MAKE_DATA(False), False)
+        self.add_expected_parameter("workers", MAKE_DATA(1), 1)
 
+        #: pool of worker process (if workers is not 1)
+        self._pool = None
         #: fom count
         self._fom_count = 0
         self._old_foms = []
@@ -202,9 +250,66 @@ class OptimisationFilter(AbstractOptimisationFilter):
                 fom = 1e20
             return fom
         if self["polish"].value:
-            return new_scipy_fom
+            scipy_fom = new_scipy_fom
         else:
-            return new_scipy_fom_error
+            scipy_fom = new_scipy_fom_error
+        if self["vectorized"].value or self["workers"].value != 1:
+            return self.create_vectorized_fom(scipy_fom)
+        return scipy_fom
+
+    def simulate_population(self, xs):
+        """ simulate each individual of a population
+
+        :param xs: population (population, nb_x)
+        :return: simulations (population, total points)
+        """
+        plan = self._para_tab.plan
+        if plan is not None and plan.batchable:
+            return self._mod.simulate_batch(plan.batch(xs))
+        simus = []
+        for x in xs:
+            self._para_tab.apply_to_param(self._mod.script_dict, x)
+            simus.append(self._mod.simulate())
+        return np.array(simus)
+
+    def create_vectorized_fom(self, scipy_fom):
+        """ creating fom evaluating a whole population for scipy vectorized
+        mode, a single x is evaluated by scipy_fom
+        """
+        problem = self["FOM"]
+
+        def new_scipy_fom_vectorized(xs):
+            """ return the fom of each individual of xs (nb_x, population)
+            """
+            if np.ndim(xs) == 1:
+                return scipy_fom(xs)
+            xs = np.transpose(xs)
+            simus = None
+            if self._pool is not None:
+                combined, foms = self._pool.evaluate(xs, lambda: self._stop)
+                if foms is None:
+                    return combined
+                # the simulation is only kept for the best individual
+                best, best_simu = self.best_simulation(xs, combined)
+            else:
+                try:
+                    simus = self.simulate_population(xs)
+                except UnboundLocalError:
+                    return np.ones(len(xs)) * 1e20
+                combined, foms = problem.fom_batch(simus, self._data_set)
+            for index, x in enumerate(xs):
+                self._x = x
+                if simus is not None:
+                    self._simu = simus[index]
+                else:
+                    self._simu = best_simu if index == best else None
+                fom = combined[index]
+                if problem.callback is not None:
+                    problem.callback(fom, [fom_[index] for fom_ in foms])
+                if not self["polish"].value and fom < self.worst_error_fom:
+                    self.set_worst_error(x, fom)
+            return combined
+        return new_scipy_fom_vectorized
 
     def report(self, fom, foms):
         """ creating and sending report for fit evolution
@@ -216,7 +321,7 @@ class OptimisationFilter(AbstractOptimisationFilter):
             self._x_best = self._x
             self._simu_best = self._simu
         if self._fom_count % self._refresh_speed == 0:
-            num_iter = self._fom_count / self._refresh_speed - 1
+            num_iter = self._fom_count // self._refresh_speed - 1
             if num_iter < self["max_gen"].value+1:
                 self._best_history[num_iter, :-1] = self._x_best
                 self._best_history[num_iter, -1] = self._old_fom
@@ -230,6 +335,7 @@ class OptimisationFilter(AbstractOptimisationFilter):
             report["param"] = self._para_tab.string_value
             self._para_tab.apply_to_param(self._mod.script_dict, self._x_best)
             simu = self._mod.simulate()
+            report["kinematic_error"] = self.kinematic_error
             simulations = [simu[self["FOM"].born[i][0]:self["FOM"].born[i][1]]
                            for i, _ in enumerate(foms)]
             for index, data_name in enumerate(self["data_names"].value):
@@ -252,13 +358,26 @@ class OptimisationFilter(AbstractOptimisationFilter):
         pop_size = self["pop_size"].value
         maxiter = self["max_gen"].value
         polish = self["polish"].value
+        options = {}
+        if self["vectorized"].value or self["workers"].value != 1:
+            # needs scipy >= 1.9, a generation is evaluated at once
+            options = {"vectorized": True, "updating": "deferred"}
+        if self["workers"].value != 1:
+            self._pool = PoolEvaluator(ModelDescription(self),
+                                       self["workers"].value)
         self._fom(self._para_tab.x)
-        result = differential_evolution(self._fom,
-                                                       self._para_tab.bounds,
-                                                       popsize=pop_size,
-                                                       maxiter=maxiter,
-                                                       polish=polish,
-                                                       atol=0.,
-                                                       tol=0.,
-                                                       callback=self.callback)
+        try:
+            result = differential_evolution(self._fom,
+                                            self._para_tab.bounds,
+                                            popsize=pop_size,
+                                            maxiter=maxiter,
+                                            polish=polish,
+                                            atol=0.,
+                                            tol=0.,
+                                            callback=self.callback,
+                                            **options)
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
         self._result = result.x
@@ -34,13 +34,15 @@ registered_operations = {"scipy combiner":
                          "inspyred combiner":
                          operation.combined.create_combine_inspyred,
                          "inspyred NSGA2 combiner":
-                         operation.combined.create_combine_inspyred_mo
+                         operation.combined.create_combine_inspyred_mo,
+                         "least squares refiner":
+                         operation.combined.create_combine_least_squares
                          }
 
 data_treatment = {"select_window": operation.data_treatement.select_windows}
 
 default_order = ["simulation XSW", "inspyred combiner", "scipy combiner",
-                 "inspyred NSGA2 combiner"]
+                 "inspyred NSGA2 combiner", "least squares refiner"]
 
 FOM_DICT = {"d_log2": fom.log2d, "g_chi2bars": fom.chi2bars,
             "d_theta_4": fom.theta4, "b_logarithmic": fom.b_logarithmic,
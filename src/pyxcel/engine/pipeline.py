@@ -118,7 +118,7 @@ class EvolutionReport(paf.data.CompositeData):
     def __init__(self):
         value = {"source": "", "FOM": 0., "param": "", "corr": np.array([[]]),
                  "simulations": TemporaryData(), "FOMS": [],
-                 "corr_header": []}
+                 "corr_header": [], "kinematic_error": 0.}
         paf.data.CompositeData.__init__(self, value, "evolution_report")
 
 
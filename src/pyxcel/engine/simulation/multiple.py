@@ -11,7 +11,8 @@ import numpy as np
 import paf.filter_base
 import paf.port as port
 import paf.data
-from pyxcel.engine.optimization.generic import ParaTab, CustomModel
+from pyxcel.engine.optimization.param_tab import ParaTab
+from pyxcel.engine.optimization.model import CustomModel
 MAKE_DATA = paf.data.make_data
 
 
@@ -9,6 +9,7 @@ The simulator for XSW only.
 """
 import numpy as np
 from pyxcel.engine.simulator.xrr_no_genx import resolve_parameter
+from pyxcel.engine.simulator.xrr_no_genx import refractive_index
 from pyxcel.engine.gixrf import el_field_no_genx
 import paf.filter_base as filters
 import paf.data as data
@@ -59,8 +60,7 @@ class GenXSWFSimFilter(filters.Filter):
         parameters = resolve_parameter(self.get_data("main"))
         dens = np.array(parameters['numerical_density'], dtype=np.float64)
         f_array = np.array(parameters['f'], dtype=np.complex64)
-        re = 2.8179403267e-5  # classical electron radius in Angstrom
-        n_array = 1 - dens * re * wavelength**2/2/np.pi*f_array
+        n_array = refractive_index(wavelength, dens, f_array)[0]
         d_array = np.array(parameters['d'], dtype=np.float64)
         sigma_array = np.array(parameters['sigmar'], dtype=np.float64)
         start_theta = self["start_theta"].value
@@ -0,0 +1,195 @@
+# -*- coding: utf8 -*-
+"""
+Adaptive angular sampling of optical solutions. The solution is calculated on
+a coarse grid of the asked angles, its step is a fraction of the period of the
+fringes of the whole stack. Each interval is bisected while the value in its
+middle is not predicted by linear interpolation within the tolerance, other
+angles are interpolated.
+
+    :platform: Unix, Windows
+    :synopsis: adaptive angular sampling.
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+import copy
+import numpy as np
+import pyxcel.engine.gixrf.el_field_no_genx as el_field
+
+
+class AdaptiveSampler(object):
+    """ calculate a function of the angles on the angles where linear
+    interpolation is not accurate enough
+    """
+    def __init__(self, tolerance=1e-3, fringe_points=8, max_levels=10):
+        """ initialization
+
+        :param tolerance: maximum relative error of interpolated values
+        :type tolerance: float
+        :param fringe_points: number of angles of the coarse grid in the
+                              shortest fringe of the stack
+        :type fringe_points: int
+        :param max_levels: number of bisections, every angle of intervals
+                           still not accurate is then calculated in one pass
+        :type max_levels: int
+        """
+        self.tolerance = tolerance
+        self.fringe_points = fringe_points
+        self.max_levels = max_levels
+        #: number of angles asked
+        self.requested = 0
+        #: number of angles calculated
+        self.evaluated = 0
+
+    def coarse(self, angles, thickness, wavelength):
+        """ indices of the coarse grid in sorted angles
+
+        :param angles: sorted angles in degree
+        :param thickness: total thickness of the stack in Angstrom
+        :param wavelength: wavelength in Angstrom
+        :rtype: numpy.ndarray
+        """
+        if thickness <= 0:
+            return np.unique([0, angles.size-1])
+        # period of fringes in degree: lambda/(2 D cos(theta)) in radian
+        step = wavelength/2./thickness*180./np.pi/self.fringe_points
+        cells = np.floor((angles-angles[0])/step)
+        index = np.flatnonzero(np.diff(cells)) + 1
+        return np.unique(np.concatenate(([0], index, [angles.size-1])))
+
+    def sample(self, theta, function, thickness, wavelength, log=False):
+        """ values of function on theta
+
+        :param theta: angles in degree
+        :param function: function of angles returning an array whose last
+                         axis is the angle
+        :param thickness: total thickness of the stack in Angstrom
+        :param wavelength: wavelength in Angstrom
+        :param log: True for positive values interpolated in logarithm with
+                    pointwise relative error, False for values compared with
+                    the maximum of each row
+        :rtype: numpy.ndarray
+        """
+        theta = np.asarray(theta)
+        angles, inverse = np.unique(theta, return_inverse=True)
+        self.requested += theta.size
+        known = self.coarse(angles, thickness, wavelength)
+        if 2*known.size > angles.size:
+            # fringes as short as the grid: calculate every angle in one pass
+            self.evaluated += theta.size
+            return function(theta)
+        first = function(angles[known])
+        self.evaluated += known.size
+        # one row per angle: angles are gathered as contiguous rows
+        values = np.zeros(angles.shape + (first[..., 0].size,),
+                          dtype=first.dtype)
+        values[known] = first.reshape(-1, known.size).T
+
+        def calculate(index):
+            """ calculate function on angles at index
+            """
+            values[index] = function(angles[index]).reshape(-1, index.size).T
+            self.evaluated += index.size
+        #: maximum of each column on calculated angles
+        peak = np.abs(values[known]).max(axis=0)
+        left, right = known[:-1], known[1:]
+        for level in range(self.max_levels+1):
+            keep = right - left > 1
+            left, right = left[keep], right[keep]
+            if not left.size:
+                break
+            if level == self.max_levels:
+                inside = np.concatenate([np.arange(start+1, stop) for
+                                         start, stop in zip(left, right)])
+                calculate(inside)
+                known = np.union1d(known, inside)
+                break
+            middle = (left+right)//2
+            calculate(middle)
+            known = np.union1d(known, middle)
+            peak = np.maximum(peak, np.abs(values[middle]).max(axis=0))
+            estimate = self._interpolate(values, angles, left, right, middle,
+                                         log)
+            error = self._error(values[middle], estimate, peak, log)
+            bad = error > self.tolerance
+            if log:
+                # a minimum can be sharper than the midpoint shows
+                minima = self._minima(values, known)
+                bad |= np.in1d(left, minima) | np.in1d(right, minima)
+            left, right = (np.concatenate((left[bad], middle[bad])),
+                           np.concatenate((middle[bad], right[bad])))
+        missing = np.setdiff1d(np.arange(angles.size), known)
+        if missing.size:
+            position = np.searchsorted(known, missing)
+            values[missing] = self._interpolate(
+                values, angles, known[position-1], known[position], missing,
+                log)
+        return values[inverse].T.reshape(first.shape[:-1] + theta.shape)
+
+    @staticmethod
+    def _minima(values, known):
+        """ known indices where a column has a local minimum
+        """
+        rows = values[known]
+        inside = np.any((rows[1:-1] < rows[:-2]) & (rows[1:-1] < rows[2:]),
+                        axis=1)
+        return known[1:-1][inside]
+
+    @staticmethod
+    def _interpolate(values, angles, left, right, index, log):
+        """ linear interpolation at index between left and right
+        """
+        fraction = ((angles[index]-angles[left]) /
+                    (angles[right]-angles[left]))[:, np.newaxis]
+        if log:
+            tiny = np.finfo(np.float64).tiny
+            return np.exp(np.log(np.maximum(values[left], tiny)) *
+                          (1-fraction) +
+                          np.log(np.maximum(values[right], tiny)) * fraction)
+        return values[left]*(1-fraction) + values[right]*fraction
+
+    @staticmethod
+    def _error(exact, estimate, peak, log):
+        """ error of estimate for each interval
+        """
+        if log:
+            scale = np.abs(exact)
+        else:
+            scale = peak[np.newaxis]
+        error = np.abs(estimate-exact)/np.where(scale > 0, scale, 1.)
+        return error.max(axis=1)
+
+    def reflectivity_function(self, refl_func):
+        """ refl_func (signature of refl_batch) adaptively sampled
+
+        :rtype: function
+        """
+        def reflectivity(theta, wavelength, n, d, sigma):
+            """ sampled refl_func
+            """
+            thickness = np.max(np.sum(np.atleast_2d(d)[:, 1:-1], axis=1))
+            return self.sample(theta, lambda angles: refl_func(
+                angles, wavelength, n, d, sigma), thickness, wavelength,
+                               log=True)
+        return reflectivity
+
+    def field(self, theta, wavelength, n_array, d_array, sigma_array,
+              blocks=None):
+        """ electric field (see el_field.ElField) adaptively sampled
+
+        :rtype: el_field.ElField
+        """
+        fields = []
+
+        def solve(angles):
+            """ angular arrays of the field on angles
+            """
+            fields.append(el_field.ElField(angles, wavelength, n_array,
+                                           d_array, sigma_array, blocks))
+            return np.array([getattr(fields[-1], name)
+                             for name in el_field.ElField.ANGULAR])
+        values = self.sample(theta, solve, np.sum(d_array[1:-1]), wavelength)
+        field = copy.copy(fields[0])
+        for name, value in zip(el_field.ElField.ANGULAR, values):
+            setattr(field, name, value)
+        field._inputs = None
+        return field
@@ -8,8 +8,10 @@ Filter for doing simulation with a simulator.
 .. moduleauthor:: Gael PICOT <gael.picot@free.fr>
 """
 from abc import ABCMeta, abstractmethod
+import numpy as np
 import paf.data
 import re
+import pyxcel.engine.modeling.tools as tools
 MAKE_DATA = paf.data.make_data
 
 
@@ -29,11 +31,18 @@ class Simulator(paf.data.CompositeData):
         self._fom_const = 0
         self._last_fom = 0.
         self._max_fom_const = 0
-        self._regex_stochio = None
+        #: numeric model of each material with fitted stochio
+        self._stochio_formulas = {}
         self._parmeters = None
         self._profile_name = []
         self._all_prof = None
         self._sample = None
+        #: optical solutions shared with other simulators of the model
+        self._optical_cache = None
+        #: periodic blocks (start, period, repetition) of parameter arrays
+        self._blocks = []
+        #: adaptive angular sampling of optical solutions
+        self._adaptive_sampler = None
 
     @property
     def stop(self):
@@ -47,6 +56,32 @@ class Simulator(paf.data.CompositeData):
         """
         self._stop = value
 
+    @property
+    def optical_cache(self):
+        """ optical solutions shared with other simulators, None if not
+        shared
+        """
+        return self._optical_cache
+
+    @optical_cache.setter
+    def optical_cache(self, value):
+        """ setter for optical cache
+        """
+        self._optical_cache = value
+
+    @property
+    def adaptive_sampler(self):
+        """ adaptive angular sampling of optical solutions, None if every
+        angle is calculated
+        """
+        return self._adaptive_sampler
+
+    @adaptive_sampler.setter
+    def adaptive_sampler(self, value):
+        """ setter for adaptive sampler
+        """
+        self._adaptive_sampler = value
+
     @abstractmethod
     def initialization(self, filter_):
         """ method call in start of simulation and at the first run of fitting.
@@ -72,7 +107,6 @@ class Simulator(paf.data.CompositeData):
                 self._layer_stochio = list([x[8:] for x in find_layers]) 
                 # self._layer_stochio = list(set([x[8:] for x in find_layers])) # strips "stochio_" from list strings
                 self.simulate = self.simulate_stochio
-                self._regex_stochio = re.compile("_\d*\.?\d*")
                 stack_data = self._sample
 
                 # create list of materials
@@ -81,6 +115,9 @@ class Simulator(paf.data.CompositeData):
                            for lay in stack_data["layers"]}
                 self._mat = {item[0]: item[1] for item in all_mat.items()
                              if item[0] in stochio_name} # check for "_" in the _mat dictionary
+                self._stochio_formulas = {
+                    name: tools.StochioFormula(mat)
+                    for name, mat in self._mat.items()}
 
 #                 for key, value in self._mat.iteritems(): # does nothing
 #                     self._mat[key].replace("_","")
@@ -102,6 +139,22 @@ class Simulator(paf.data.CompositeData):
 #         if self._stop:
 #             thread.exit()
 
+    def simulate_batch(self, population):
+        """ doing the simulation for each individual of a population.
+
+        :param population: dictionary of layer parameters stacked in
+                           (population, layers) array
+        :rtype: np.array
+        :return: simulations (population, points)
+        """
+        nb_ind = len(list(population.values())[0])
+        result = []
+        for index in range(nb_ind):
+            for key, value in population.items():
+                self._parmeters[key][:] = value[index]
+            result.append(self.simulate())
+        return np.array(result)
+
     def evaluate(self):
         pass
 
@@ -136,22 +189,18 @@ class Simulator(paf.data.CompositeData):
                     last_name = self._parmeters["name"][index]
                     self._all_prof.append(last_name)
                     index += 1
-        for name, mat in self._mat.items():
+        materials = self._parmeters["material"]
+        indexes = []
+        for name, formula in self._stochio_formulas.items():
             fitted_value = self._filter.model.script_dict["stochio_" + name]
-            for index, _ in enumerate(self._regex_stochio.findall(mat)):
-                try:
-                    value = fitted_value["stochio" + str(index)]
-                except KeyError:
-                    res = self._regex_stochio.search(mat)
-                    value = mat[res.start()+1:res.end()]
-                mat = self._regex_stochio.sub(str(value), mat, 1)
-            f = self._physical_computer.compute_f(mat)
-            index = self._stack_name_list.index(name)
-            self._parmeters["f"][index] = f
-            self._parmeters["material"][index] = mat
-        for name in self._all_prof:
             index = self._stack_name_list.index(name)
-            f = self._physical_computer.compute_f(self._parmeters["material"]
-                                                  [index])
+            materials[index] = formula.material(fitted_value.get(
+                "values", formula.values))
+            indexes.append(index)
+        indexes.extend(self._stack_name_list.index(name)
+                       for name in self._all_prof)
+        f_list = self._physical_computer.compute_f_list(
+            [materials[index] for index in indexes])
+        for index, f in zip(indexes, f_list):
             self._parmeters["f"][index] = f
         return self.__class__.simulate(self)
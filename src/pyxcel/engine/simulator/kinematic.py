@@ -0,0 +1,228 @@
+# -*- coding: utf8 -*-
+"""
+Kinematic approximation of XRR and hybrid engine. Well above the critical
+angle, multiple reflections are negligible: the reflection coefficient is the
+sum of the Fresnel coefficients of each interface, delayed by the layers above
+with their refraction and absorption. Wave vectors are expanded in powers of
+the index contrast over sin(theta), so each stack is a few outer products of
+layer and angle terms instead of a recursion on layers.
+
+The hybrid engine calculates the Parratt recursion under a multiple of the
+critical angle and the kinematic approximation above, corrected to be
+continuous with the recursion on a few overlapping angles. It is meant for
+stacks of many different layers (sublayers of profiles), periodic stacks are
+left to the recursion.
+
+    :platform: Unix, Windows
+    :synopsis: kinematic and hybrid XRR.
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+import numpy as np
+import pyxcel.engine.simulator.periodic as periodic
+
+
+def critical_angle(n):
+    """ critical angle in degree of the densest layer of each stack
+
+    :param n: index of refraction (population, layers) substrate first,
+              ambient last
+    :rtype: numpy.ndarray
+    """
+    n = np.atleast_2d(n)
+    delta = np.max(1. - np.real(n / n[:, -1:]), axis=1)
+    return np.sqrt(2 * np.maximum(delta, 0.)) * 180. / np.pi
+
+
+def _above(values):
+    """ sum of values of the layers above each interface, values are given
+    for the layers between the substrate and the ambient
+    """
+    result = np.zeros(len(values) + 1, dtype=values.dtype)
+    result[:-1] = np.cumsum(values[::-1])[::-1]
+    return result
+
+
+def _amplitude(sin, wavelength, n, d, sigma):
+    """ kinematic reflection coefficient of one stack
+
+    :param sin: sinus of the incident angles
+    """
+    K = 4 * np.pi / wavelength * np.real(n[-1])
+    chi = (n / n[-1])**2 - 1
+    low, up = chi[:-1], chi[1:]
+    # Q = K sqrt(sin**2 + chi) to the second order in chi / sin**2
+    depth = _above(d[1:-1])
+    first = _above(d[1:-1] * chi[1:-1])
+    second = _above(d[1:-1] * chi[1:-1]**2)
+    inverse, inverse3 = 1 / (2 * sin), 1 / (8 * sin**3)
+    phase = K * (np.outer(depth, sin) + np.outer(first.real, inverse) -
+                 np.outer(second.real, inverse3))
+    # roughness (Nevot-Croce) and absorption in the layers above
+    exponent = (np.outer(-K**2 / 2 * sigma[:-1]**2, sin**2) -
+                K * (np.outer(first.imag, inverse) -
+                     np.outer(second.imag, inverse3)))
+    magnitude = np.exp(exponent)
+    cos_part = magnitude * np.cos(phase)
+    sin_part = magnitude * np.sin(phase)
+    # Fresnel coefficient (up - low) / (q_up + q_low)**2 in powers of
+    # 1 / sin**2
+    rough = (up - low) * np.exp(-K**2 / 4 * sigma[:-1]**2 * (low + up))
+    terms = ((rough, 2), (-rough * (low + up) / 2, 4),
+             (rough * ((up - low)**2 / 16 + (up + low)**2 / 4), 6))
+    result = 0
+    for weight, power in terms:
+        result = result + (
+            weight.real.dot(cos_part) - weight.imag.dot(sin_part) +
+            1.0j * (weight.real.dot(sin_part) + weight.imag.dot(cos_part))
+        ) / (4 * sin**power)
+    return result
+
+
+def kinematic_batch(theta, wavelength, n, d, sigma):
+    """ calculate XRR for a population of stack in kinematic approximation,
+    valid well above the critical angle.
+
+    :param theta: incident angles in degree (nb_angle)
+    :param wavelength: wavelength in Angstrom
+    :param n: index of refraction (population, layers) substrate first
+    :param d: thickness (population, layers)
+    :param sigma: roughness (population, layers)
+    :return: reflectivity (population, nb_angle)
+    """
+    n, d, sigma = np.broadcast_arrays(np.atleast_2d(n), np.atleast_2d(d),
+                                      np.atleast_2d(sigma))
+    sin = np.sin(np.asarray(theta, dtype=np.float64) * np.pi / 180)
+    result = np.empty((n.shape[0], sin.size))
+    for index in range(n.shape[0]):
+        result[index] = abs(_amplitude(sin, wavelength, n[index], d[index],
+                                       sigma[index]))**2
+    return result
+
+
+class HybridReflectivity(object):
+    """ refl_batch with the Parratt recursion (dynamical) under factor times
+    the critical angle and the kinematic approximation above. The kinematic
+    part is
+    multiplied by 1 + beta (switch / theta)**4, beta fitted on the first
+    angles above the switch which are calculated by both methods. The error
+    is estimated on probe angles also calculated by the recursion: the
+    brightest ones, where multiple reflections matter, the first minima and
+    angles spread over the kinematic part. Stacks whose estimated error is
+    above the tolerance are calculated again by the recursion on every angle.
+    """
+    def __init__(self, dynamical, factor=3., overlap=4, probes=8,
+                 tolerance=2e-2):
+        """ initialization
+
+        :param dynamical: function with the signature of refl_batch
+        :param factor: multiple of the critical angle where the kinematic
+                       approximation starts
+        :type factor: float
+        :param overlap: number of angles above the switch calculated by both
+                        methods for the continuity correction
+        :type overlap: int
+        :param probes: number of brightest, of minimum and of spread probe
+                       angles
+        :type probes: int
+        :param tolerance: highest estimated relative error kept, 0 to keep
+                          every kinematic result
+        :type tolerance: float
+        """
+        self.factor = factor
+        self.overlap = overlap
+        self.probes = probes
+        self.dynamical = dynamical
+        self.tolerance = tolerance
+        #: estimated relative error of the last evaluation (population)
+        self.error = np.zeros(0)
+        #: angle of the switch of the last evaluation in degree
+        self.switch = 0.
+        #: number of angles calculated by each method
+        self.dynamical_angles = 0
+        self.kinematic_angles = 0
+        #: number of stacks calculated again by the recursion
+        self.fallbacks = 0
+
+    @property
+    def max_error(self):
+        """ highest estimated relative error of the last evaluation, 0 if
+        nothing was kinematic
+        """
+        if not self.error.size:
+            return 0.
+        return float(np.max(self.error))
+
+    def _probes(self, approximation):
+        """ index of probe angles in the kinematic part
+        """
+        nb_angle = approximation.shape[1]
+        probes = [np.argsort(approximation, axis=1)[:, -self.probes:].ravel(),
+                  np.linspace(0, nb_angle-1, self.probes).astype(int)]
+        # relative errors are the highest in the first minima
+        minima = ((approximation[:, 1:-1] < approximation[:, :-2]) &
+                  (approximation[:, 1:-1] < approximation[:, 2:]))
+        for row in minima:
+            probes.append(np.flatnonzero(row)[:self.probes] + 1)
+        return np.unique(np.concatenate(probes))
+
+    def __call__(self, theta, wavelength, n, d, sigma, blocks=None):
+        """ reflectivity with the signature of refl_batch
+        """
+        n, d, sigma = np.broadcast_arrays(np.atleast_2d(n), np.atleast_2d(d),
+                                          np.atleast_2d(sigma))
+        theta = np.asarray(theta)
+        self.switch = self.factor * np.max(critical_angle(n))
+        above = np.flatnonzero(theta > self.switch)
+        above = above[np.argsort(theta[above], kind="mergesort")]
+        nb_overlap = min(self.overlap, above.size)
+        overlap, kinematic = above[:nb_overlap], above[nb_overlap:]
+        # repeated periods are already cheap for the recursion
+        if (kinematic.size <= 2*self.probes or
+                (blocks and periodic.valid_blocks(blocks, n, d, sigma))):
+            self.error = np.zeros(n.shape[0])
+            self.dynamical_angles += theta.size
+            return self.dynamical(theta, wavelength, n, d, sigma,
+                                  blocks=blocks)
+        approximation = kinematic_batch(theta[above], wavelength, n, d, sigma)
+        probes = self._probes(approximation[:, nb_overlap:])
+        below = np.flatnonzero(theta <= self.switch)
+        exact = np.concatenate((below, overlap, kinematic[probes]))
+        result = np.empty((n.shape[0], theta.size))
+        result[:, exact] = self.dynamical(theta[exact], wavelength, n, d,
+                                          sigma, blocks=blocks)
+
+        # continuity correction fitted by least square on the overlap
+        shape = approximation * (self.switch / theta[above])**4
+        reference = result[:, overlap]
+        fitted = shape[:, :nb_overlap]
+        norm = np.sum(fitted**2, axis=1)
+        beta = (np.sum(fitted * (reference-approximation[:, :nb_overlap]),
+                       axis=1) / np.where(norm > 0, norm, 1.))
+        approximation += beta[:, np.newaxis] * shape
+        approximation = approximation[:, nb_overlap:]
+        reference = result[:, kinematic[probes]]
+        self.error = np.max(abs(approximation[:, probes] - reference) /
+                            np.where(reference > 0, reference, 1.), axis=1)
+        # probes keep the value of the recursion
+        approximation[:, probes] = reference
+        result[:, kinematic] = approximation
+        self.dynamical_angles += exact.size
+        self.kinematic_angles += kinematic.size - probes.size
+        if self.tolerance > 0:
+            self._fallback(result, theta, wavelength, n, d, sigma, blocks)
+        return result
+
+    def _fallback(self, result, theta, wavelength, n, d, sigma, blocks):
+        """ calculate again by the recursion the stacks of result whose
+        estimated error is above the tolerance
+        """
+        failed = np.flatnonzero(self.error > self.tolerance)
+        if not failed.size:
+            return
+        result[failed] = self.dynamical(theta, wavelength, n[failed],
+                                        d[failed], sigma[failed],
+                                        blocks=blocks)
+        self.error[failed] = 0.
+        self.fallbacks += failed.size
+        self.dynamical_angles += theta.size*failed.size
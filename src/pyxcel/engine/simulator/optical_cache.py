@@ -0,0 +1,161 @@
+# -*- coding: utf8 -*-
+"""
+Cache of the Parratt recursion of the current candidate shared by simulators
+of a model. Each kind of solution (reflectivity or electric field) is solved
+once on the union of the angles of its simulators and scattered back.
+
+    :platform: Unix, Windows
+    :synopsis: optical solutions shared by simulators.
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+import numpy as np
+import pyxcel.engine.gixrf.el_field_no_genx as el_field
+from pyxcel.engine.simulator.xrr_no_genx import IncrementalParratt
+
+#: kind of solution: reflectivity only or complete electric field
+KINDS = ("refl", "field")
+
+
+class OpticalFieldCache(object):
+    """ solutions of the last optical parameters for each kind, on the union
+    of the angles asked by the simulators
+    """
+    def __init__(self):
+        """ initialization
+        """
+        #: angles asked by each simulator
+        self._grids = {kind: {} for kind in KINDS}
+        #: index of the angles of each simulator in the union
+        self._index = {kind: {} for kind in KINDS}
+        #: union of the angles
+        self._union = {kind: None for kind in KINDS}
+        #: optical parameters and solution of the last solve
+        self._solutions = {kind: (None, None) for kind in KINDS}
+        #: number of solution scattered from a previous solve
+        self.hits = 0
+        #: number of solve
+        self.misses = 0
+        #: incremental recursion of each kind of solution
+        self.parratt = IncrementalParratt()
+        self.elfield = el_field.IncrementalElField()
+
+    def clear(self):
+        """ forget every solution
+        """
+        self._solutions = {kind: (None, None) for kind in KINDS}
+
+    def _register(self, kind, token, theta):
+        """ index of theta in the union of angles, the union is extended if
+        the angles of token changed
+        """
+        grids = self._grids[kind]
+        if token not in grids or not np.array_equal(grids[token], theta):
+            grids[token] = np.array(theta, dtype=np.float64)
+            union = np.unique(np.concatenate(list(grids.values())))
+            self._union[kind] = union
+            self._index[kind] = {key: np.searchsorted(union, grid)
+                                 for key, grid in grids.items()}
+            self._solutions[kind] = (None, None)
+        return self._index[kind][token]
+
+    @staticmethod
+    def _same(key, old_key):
+        """ True if each value of key is equal to the one of old_key
+        """
+        if old_key is None:
+            return False
+        for value, old_value in zip(key, old_key):
+            if not np.array_equal(value, old_value):
+                return False
+        return True
+
+    @staticmethod
+    def _key(wavelength, n, d, sigma):
+        """ optical parameters used by the recursion, the thickness of the
+        ambient is only used for the field
+        """
+        return (np.array(wavelength), np.array(n), np.array(d[:-1]),
+                np.array(sigma[:-1]), np.array(d[-1:]))
+
+    def _solve(self, kind, key, solver):
+        """ solution of kind for key on the union of angles
+        """
+        old_key, solution = self._solutions[kind]
+        if self._same(key, old_key):
+            self.hits += 1
+            return solution
+        self.misses += 1
+        solution = solver(self._union[kind])
+        self._solutions[kind] = (key, solution)
+        return solution
+
+    def _field_reflectivity(self, key, theta):
+        """ reflectivity from the field solution if it was solved with the
+        same parameters and contains theta, None if not
+        """
+        old_key, field = self._solutions["field"]
+        union = self._union["field"]
+        # the field ignores the ambient index which must be 1
+        if (old_key is None or not self._same(key[:4], old_key[:4]) or
+                key[1][-1] != 1):
+            return None
+        index = np.minimum(np.searchsorted(union, theta), union.size-1)
+        if not np.array_equal(union[index], theta):
+            return None
+        self.hits += 1
+        return field.reflectivity[index]
+
+    def reflectivity(self, token, theta, wavelength, n, d, sigma,
+                     blocks=None):
+        """ reflectivity on the angles of a simulator
+
+        :param token: object asking for the solution (the simulator)
+        :param theta: incident angles in degree
+        :param n: refractive index of each layer (substrate first)
+        :param d: thickness of each layer
+        :param sigma: roughness of each layer
+        :param blocks: periodic blocks of the layers
+        :rtype: numpy.ndarray
+        """
+        key = self._key(wavelength, n, d, sigma)
+        reflectivity = self._field_reflectivity(key, theta)
+        if reflectivity is not None:
+            return reflectivity
+        index = self._register("refl", token, theta)
+
+        def solver(union):
+            """ reflectivity on union
+            """
+            return self.parratt(union, wavelength, n[np.newaxis],
+                                d[np.newaxis], sigma[np.newaxis], blocks)[0]
+        return self._solve("refl", key, solver)[index]
+
+    def reflectivity_function(self, token, blocks=None):
+        """ function with the signature of refl_batch using the cache for a
+        population of one individual
+        """
+        def reflectivity(theta, wavelength, n, d, sigma):
+            """ cached refl_batch
+            """
+            return self.reflectivity(token, theta, wavelength,
+                                     np.atleast_2d(n)[0],
+                                     np.atleast_2d(d)[0],
+                                     np.atleast_2d(sigma)[0],
+                                     blocks)[np.newaxis]
+        return reflectivity
+
+    def field(self, token, theta, wavelength, n, d, sigma, blocks=None):
+        """ electric field on the angles of a simulator
+
+        :param token: object asking for the solution (the simulator)
+        :rtype: el_field.ElField
+        """
+        index = self._register("field", token, theta)
+        key = self._key(wavelength, n, d, sigma)
+
+        def solver(union):
+            """ field on union
+            """
+            return self.elfield(union, wavelength, n, d, sigma, blocks)
+        return self._solve("field", key, solver).take(index)
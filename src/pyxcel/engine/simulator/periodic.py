@@ -0,0 +1,123 @@
+# -*- coding: utf8 -*-
+"""
+Tools for periodic blocks of layers (repeated substacks). A block is a tuple
+(start, period, repetition) in parameter arrays (substrate first): layers
+start to start + period * repetition - 1 are the same period repeated.
+
+Each step of the Parratt recursion is a Moebius transformation of the
+reflection coefficient, so one period is a 2x2 matrix raised to the number
+of repetitions by repeated squaring.
+
+    :platform: Unix, Windows
+    :synopsis: optics of periodic blocks.
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+import numpy as np
+
+
+def sample_blocks(sample, nb_layers):
+    """ periodic blocks of a sample in parameter arrays
+
+    :param sample: stack of the simulator
+    :type sample: StackData
+    :param nb_layers: length of parameter arrays (substrate and ambient
+                      included)
+    :rtype: list
+    """
+    try:
+        blocks = sample.periodic_blocks
+    except AttributeError:
+        return []
+    nb_stack = nb_layers - 2
+    # expanded layers are from the top, arrays from the substrate
+    return [(nb_stack - first - period * repetition + 1, period, repetition)
+            for first, period, repetition in blocks
+            if repetition > 1 and period > 0]
+
+
+def valid_blocks(blocks, *arrays):
+    """ blocks still periodic in every array (last axis for layers)
+
+    :rtype: list
+    """
+    result = []
+    for start, period, repetition in blocks:
+        stop = start + period * repetition
+        periodic = True
+        for array in arrays:
+            array = np.atleast_2d(array)
+            if stop > array.shape[-1] - 1:
+                periodic = False
+                break
+            block = array[:, start:stop].reshape(array.shape[0], repetition,
+                                                 period)
+            if not np.array_equal(block, np.repeat(block[:, :1], repetition,
+                                                   axis=1)):
+                periodic = False
+                break
+        if periodic:
+            result.append((start, period, repetition))
+    return result
+
+
+def layer_map(nb_layers, blocks):
+    """ index of the layer representing each layer: layers of a block are
+    represented by the layers of its first period
+    """
+    mapping = np.arange(nb_layers)
+    for start, period, repetition in blocks:
+        stop = start + period * repetition
+        mapping[start:stop] = start + np.arange(stop - start) % period
+    return mapping
+
+
+def interface_map(nb_layers, blocks):
+    """ index of the interface representing each interface (interface j is
+    between layers j and j+1): interfaces inside a block are represented by
+    the interfaces of its first period
+    """
+    mapping = np.arange(nb_layers - 1)
+    for start, period, repetition in blocks:
+        stop = start + period * repetition - 1
+        mapping[start:stop] = start + np.arange(stop - start) % period
+    return mapping
+
+
+def step_matrix(rp, p):
+    """ matrix of one step r -> (rp + r*p)/(1 + r*rp*p)
+
+    :rtype: tuple
+    """
+    return (p, rp, rp * p, np.ones(np.shape(p), dtype=np.complex128))
+
+
+def multiply(left, right):
+    """ product of two 2x2 matrices stored as tuple (a, b, c, d), normalized
+    (only the ratio is used)
+    """
+    a = left[0] * right[0] + left[1] * right[2]
+    b = left[0] * right[1] + left[1] * right[3]
+    c = left[2] * right[0] + left[3] * right[2]
+    d = left[2] * right[1] + left[3] * right[3]
+    norm = abs(a) + abs(b) + abs(c) + abs(d)
+    return (a / norm, b / norm, c / norm, d / norm)
+
+
+def power(matrix, exponent):
+    """ matrix raised to exponent by repeated squaring
+    """
+    result = None
+    while exponent:
+        if exponent & 1:
+            result = matrix if result is None else multiply(matrix, result)
+        exponent >>= 1
+        if exponent:
+            matrix = multiply(matrix, matrix)
+    return result
+
+
+def apply(matrix, r):
+    """ transformation of r by matrix
+    """
+    return (matrix[0] * r + matrix[1]) / (matrix[2] * r + matrix[3])
@@ -0,0 +1,376 @@
+# -*- coding: utf8 -*-
+"""
+Resolution kernels of the XRR and XRF convolutions. The gaussian weights only
+depend on the angle grid and on the resolution parameters, they are built once
+as sparse operators (truncated band) and kept in a least recently used cache.
+A convolution is then a sparse matrix-vector product.
+
+    :platform: Unix, Windows
+    :synopsis: cached resolution kernels.
+
+.. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
+"""
+from collections import OrderedDict
+import numpy as np
+import scipy.sparse
+
+#: number of standard deviation kept in kernels of varying resolution
+TRUNCATION = 10.
+
+
+class ResolutionKernel(object):
+    """ convolution by a sparse operator from the simulated grid to the
+    measured grid
+    """
+    def __init__(self, matrix, grid, weight=None):
+        """ initialization
+
+        :param matrix: operator (measured points, simulated points)
+        :type matrix: scipy.sparse.csr_matrix
+        :param grid: grid to simulate (read only)
+        :type grid: numpy.ndarray
+        :param weight: gaussian weights of a resolution vector (read only)
+        :type weight: numpy.ndarray
+        """
+        self.matrix = matrix
+        self.grid = grid
+        self.weight = weight
+
+    def convolute(self, intensity):
+        """ convoluted intensity
+
+        :param intensity: intensity on the grid (grid) or (population, grid)
+        :rtype: numpy.ndarray
+        """
+        intensity = np.asarray(intensity)
+        if intensity.ndim == 1:
+            return self.matrix.dot(intensity)
+        return self.matrix.dot(intensity.T).T
+
+
+class KernelCache(object):
+    """ least recently used cache of resolution kernels
+    """
+    def __init__(self, maxsize=32):
+        """ initialization
+
+        :param maxsize: maximum number of kernels kept
+        :type maxsize: int
+        """
+        self._maxsize = maxsize
+        self._kernels = OrderedDict()
+        #: number of kernel found in the cache
+        self.hits = 0
+        #: number of kernel built
+        self.misses = 0
+
+    def clear(self):
+        """ drop every kernel
+        """
+        self._kernels.clear()
+
+    def get(self, key, builder):
+        """ kernel of key, built by calling builder if it is not cached
+        """
+        try:
+            kernel = self._kernels.pop(key)
+        except KeyError:
+            self.misses += 1
+            kernel = builder()
+        else:
+            self.hits += 1
+        self._kernels[key] = kernel
+        while len(self._kernels) > self._maxsize:
+            self._kernels.popitem(last=False)
+        return kernel
+
+
+#: kernels used by simulators
+KERNELS = KernelCache()
+
+
+def _read_only(array):
+    """ array shared by every user of a kernel
+    """
+    array.flags.writeable = False
+    return array
+
+
+def _key(kind, Q, *args):
+    """ key of a kernel for the grid Q
+    """
+    Q = np.asarray(Q, dtype=np.float64)
+    return (kind, Q.shape, Q.tobytes()) + tuple(
+        np.asarray(arg, dtype=np.float64).tobytes() for arg in args)
+
+
+def vector_kernel(Q, dQ, points, range_=3):
+    """ kernel of the GenX resolution vector: each point is simulated on
+    points angles and integrated with the trapezoidal rule
+
+    :param Q: measured grid
+    :param dQ: resolution
+    :param points: number of angles for each point
+    :param range_: half width of the resolution vector in resolution unit
+    :rtype: ResolutionKernel
+    """
+    Q = np.asarray(Q, dtype=np.float64)
+
+    def build():
+        """ weights and trapezoidal coefficients of each point
+        """
+        Qstep = 2*range_*dQ/points
+        Qres = Q+(np.arange(points)-(points-1)/2)[:, np.newaxis]*Qstep
+        weight = (1/np.sqrt(2*np.pi)/dQ *
+                  np.exp(-(np.transpose(Q[:, np.newaxis])-Qres)**2/(dQ)**2/2))
+        step = np.diff(Qres, axis=0)
+        trapz_coef = np.zeros(Qres.shape)
+        trapz_coef[1:] += step/2.
+        trapz_coef[:-1] += step/2.
+        coef = trapz_coef*weight
+        coef = coef/coef.sum(axis=0)
+        nb_q = Q.size
+        rows = np.tile(np.arange(nb_q), points)
+        matrix = scipy.sparse.csr_matrix(
+            (coef.flatten(), (rows, np.arange(points*nb_q))),
+            shape=(nb_q, points*nb_q))
+        return ResolutionKernel(matrix, _read_only(Qres.flatten()),
+                                _read_only(weight))
+    return KERNELS.get(_key("vector", Q, dQ, points, range_), build)
+
+
+def fast_kernel(Q, dQ, range_=3):
+    """ kernel of a constant resolution on a grid with constant spacing, the
+    intensity is extended by its first and last values
+
+    :rtype: ResolutionKernel
+    """
+    Q = np.asarray(Q, dtype=np.float64)
+    Qstep = Q[1]-Q[0]
+
+    def build():
+        """ band operator of the gaussian
+        """
+        resvector = np.arange(-range_*dQ, range_*dQ+Qstep, Qstep)
+        weight = 1/np.sqrt(2*np.pi)/dQ*np.exp(-(resvector)**2/(dQ)**2/2)
+        weight = weight/weight.sum()
+        nb_k = resvector.shape[0]
+        nb_q = Q.size
+        # same result as np.convolve(..., mode=1) of the padded intensity
+        start = (nb_k-1)//2
+        rows = np.repeat(np.arange(nb_q), nb_k)
+        cols = np.clip(rows + start - np.tile(np.arange(nb_k), nb_q), 0,
+                       nb_q-1)
+        matrix = scipy.sparse.coo_matrix(
+            (np.tile(weight, nb_q), (rows, cols)), shape=(nb_q, nb_q))
+        return ResolutionKernel(matrix.tocsr(), _read_only(Q.copy()))
+    return KERNELS.get(_key("fast", Q, dQ, range_), build)
+
+
+def var_kernel(Q, dQ):
+    """ kernel of a varying resolution (dQ for each point of Q) integrated
+    with the trapezoidal rule on the indices, gaussians are truncated at
+    TRUNCATION standard deviations
+
+    :rtype: ResolutionKernel
+    """
+    Q = np.asarray(Q, dtype=np.float64)
+
+    def build():
+        """ truncated band operator of the gaussians
+        """
+        nb_q = Q.size
+        sigma = dQ*np.ones(nb_q)
+        order = np.argsort(Q, kind="mergesort")
+        sorted_q = Q[order]
+        low = np.searchsorted(sorted_q, Q - TRUNCATION*sigma, "left")
+        high = np.searchsorted(sorted_q, Q + TRUNCATION*sigma, "right")
+        lengths = high - low
+        rows = np.repeat(np.arange(nb_q), lengths)
+        offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        cols = order[np.repeat(low, lengths) +
+                     np.arange(lengths.sum()) - offsets]
+        trapz_coef = np.ones(nb_q)
+        trapz_coef[[0, -1]] = .5
+        values = (trapz_coef[cols] *
+                  np.exp(-(Q[cols]-Q[rows])**2/sigma[rows]**2/2))
+        norm = np.bincount(rows, weights=values, minlength=nb_q)
+        matrix = scipy.sparse.csr_matrix((values/norm[rows], (rows, cols)),
+                                         shape=(nb_q, nb_q))
+        return ResolutionKernel(matrix, _read_only(Q.copy()))
+    return KERNELS.get(_key("var", Q, dQ), build)
+
+
+def hermite_kernel(Q, dQ, points):
+    """ kernel of a gaussian resolution integrated with the Gauss-Hermite
+    quadrature: each point is simulated on points nodes
+
+    :param Q: measured grid
+    :param dQ: resolution (standard deviation)
+    :param points: number of nodes for each point
+    :rtype: ResolutionKernel
+    """
+    Q = np.asarray(Q, dtype=np.float64)
+
+    def build():
+        """ nodes and weights of each point
+        """
+        nodes, weights = np.polynomial.hermite.hermgauss(points)
+        Qres = Q+(np.sqrt(2)*dQ*nodes)[:, np.newaxis]
+        weight = (weights/np.sqrt(np.pi))[:, np.newaxis]*np.ones(Q.shape)
+        nb_q = Q.size
+        rows = np.tile(np.arange(nb_q), points)
+        matrix = scipy.sparse.csr_matrix(
+            (weight.flatten(), (rows, np.arange(points*nb_q))),
+            shape=(nb_q, points*nb_q))
+        return ResolutionKernel(matrix, _read_only(Qres.flatten()),
+                                _read_only(weight))
+    return KERNELS.get(_key("hermite", Q, dQ, points), build)
+
+
+#: maximum error of the interpolation of a resampled FFT convolution,
+#: relative to the maximum intensity
+RESAMPLING_TOLERANCE = 1e-4
+#: integral of the absolute second derivative of a gaussian times sigma**2
+_GAUSS_CURVATURE = 4/np.sqrt(2*np.pi*np.e)
+
+
+class FFTKernel(ResolutionKernel):
+    """ convolution by a gaussian of constant resolution using the spectrum
+    of the kernel. Non uniform grids are simulated on an internal uniform
+    grid and the convolution is linearly interpolated back.
+    """
+    def __init__(self, Q, dQ, range_=3, tolerance=RESAMPLING_TOLERANCE):
+        """ initialization
+
+        :param Q: measured grid
+        :param dQ: resolution
+        :param range_: half width of the kernel in resolution unit
+        :param tolerance: maximum interpolation error relative to the maximum
+                          intensity for non uniform grids
+        """
+        Q = np.asarray(Q, dtype=np.float64)
+        step = np.diff(Q)
+        #: interpolation error relative to the maximum intensity
+        self.error_bound = 0.
+        self._interpolation = None
+        if len(step) and step[0] > 0 and np.allclose(step, step[0],
+                                                     rtol=1e-6, atol=0):
+            grid = Q.copy()
+            Qstep = step[0]
+            resvector = np.arange(-range_*dQ, range_*dQ+Qstep, Qstep)
+        else:
+            # linear interpolation error is h**2/8 max|I''| and the second
+            # derivative of the convolution is below max|I|*C/dQ**2, the
+            # kernel has a whole number of steps on each side
+            half = int(np.ceil(range_/np.sqrt(8*tolerance/_GAUSS_CURVATURE)))
+            Qstep = range_*dQ/half
+            nb_q = int(np.ceil((Q.max()-Q.min())/Qstep))+1
+            grid = Q.min() + np.arange(max(nb_q, 2))*Qstep
+            resvector = np.arange(-half, half+1)*Qstep
+            self.error_bound = Qstep**2/8*_GAUSS_CURVATURE/dQ**2
+            index = np.clip(np.searchsorted(grid, Q), 1, grid.size-1)
+            self._interpolation = (index, (Q-grid[index-1])/Qstep)
+        weight = 1/np.sqrt(2*np.pi)/dQ*np.exp(-(resvector)**2/(dQ)**2/2)
+        weight = weight/weight.sum()
+        self._nb_k = resvector.shape[0]
+        size = grid.size + 3*self._nb_k - 1
+        self._size = 2**int(np.ceil(np.log2(size)))
+        self._spectrum = np.fft.rfft(weight, self._size)
+        ResolutionKernel.__init__(self, None, _read_only(grid))
+
+    def convolute(self, intensity):
+        """ convoluted intensity on the measured grid
+
+        :param intensity: intensity on the grid (grid) or (population, grid)
+        :rtype: numpy.ndarray
+        """
+        ndim = np.ndim(intensity)
+        intensity = np.atleast_2d(intensity)
+        nb_k = self._nb_k
+        nb_q = self.grid.size
+        # intensity is extended by its first and last values
+        padded = np.concatenate((np.repeat(intensity[:, :1], nb_k, axis=1),
+                                 intensity,
+                                 np.repeat(intensity[:, -1:], nb_k, axis=1)),
+                                axis=1)
+        full = np.fft.irfft(np.fft.rfft(padded, self._size, axis=1) *
+                            self._spectrum, self._size, axis=1)
+        start = nb_k + (nb_k-1)//2
+        result = full[:, start:start+nb_q]
+        if self._interpolation is not None:
+            index, fraction = self._interpolation
+            result = (result[:, index-1]*(1-fraction) +
+                      result[:, index]*fraction)
+        if ndim == 1:
+            return result[0]
+        return result
+
+
+def fft_kernel(Q, dQ, range_=3, tolerance=RESAMPLING_TOLERANCE):
+    """ kernel of a constant resolution convoluted with FFT, see FFTKernel
+
+    :rtype: FFTKernel
+    """
+    return KERNELS.get(_key("fft", Q, dQ, range_, tolerance),
+                       lambda: FFTKernel(Q, dQ, range_, tolerance))
+
+
+#: quadrature of resolution vectors: evenly spaced angles or Gauss-Hermite
+QUADRATURES = ("uniform", "gauss_hermite")
+
+
+def detector_quadrature(detector):
+    """ quadrature selected in detector data ("uniform" for detectors saved
+    without quadrature)
+
+    :rtype: str
+    """
+    try:
+        quadrature = detector["quadrature"].value
+    except KeyError:
+        return "uniform"
+    if quadrature not in QUADRATURES:
+        raise ValueError("unknown resolution quadrature: " + str(quadrature))
+    return quadrature
+
+
+def resolution_kernel(Q, dQ, points, range_=3, quadrature="uniform"):
+    """ kernel of a resolution vector with the selected quadrature
+
+    :param quadrature: one of QUADRATURES
+    :rtype: ResolutionKernel
+    """
+    if quadrature == "gauss_hermite":
+        return hermite_kernel(Q, dQ, points)
+    return vector_kernel(Q, dQ, points, range_)
+
+
+def accuracy_report(intensity, Q, dQ, nodes=(3, 5, 7, 9, 11), range_=2,
+                    reference_points=401, reference_range=6):
+    """ maximum relative error of the uniform and Gauss-Hermite resolution
+    vectors for each number of nodes. The reference is a uniform vector with
+    reference_points angles over reference_range standard deviations.
+
+    :param intensity: function giving the intensity on a grid
+    :param Q: measured grid
+    :param dQ: resolution
+    :param nodes: numbers of nodes to compare
+    :param range_: range of the uniform vectors (resintrange)
+    :return: list of tuple (nodes, uniform error, Gauss-Hermite error)
+    :rtype: list
+    """
+    def smeared(kernel):
+        """ intensity convoluted by kernel
+        """
+        return kernel.convolute(intensity(np.array(kernel.grid)))
+    reference = smeared(vector_kernel(Q, dQ, reference_points,
+                                      reference_range))
+    scale = np.abs(reference)
+    report = []
+    for points in nodes:
+        uniform = smeared(vector_kernel(Q, dQ, points, range_))
+        hermite = smeared(hermite_kernel(Q, dQ, points))
+        report.append((points, np.max(np.abs(uniform-reference)/scale),
+                       np.max(np.abs(hermite-reference)/scale)))
+    return report
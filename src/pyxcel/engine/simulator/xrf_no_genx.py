@@ -13,37 +13,19 @@ import paf.data
 import pyxcel.engine.simulator.generic
 import pyxcel.engine.gixrf.el_field_no_genx as el_field
 import pyxcel.engine.modeling.tools as tools
+import pyxcel.engine.simulator.periodic as periodic
+import pyxcel.engine.simulator.resolution as resolution
 from pyxcel.engine.gixrf import SDDeff
+from pyxcel.engine.gixrf import xraylib_cache
 from pyxcel.engine.gixrf.geom_factor import Detector_Collimator
 from pyxcel.engine.gixrf.geom_factor import Exp_configuration
 from pyxcel.engine.gixrf.geom_factor import GetGeometricCorrection
 from pyxcel.engine.simulator.xrr_no_genx import resolve_parameter
+from pyxcel.engine.simulator.xrr_no_genx import index_factor
+from pyxcel.engine.simulator.xrr_no_genx import refractive_index
 MAKE_DATA = paf.data.make_data
 
 
-def ResolutionVector(Q, dQ, points, range_=3):
-    """ copy of genx resolution vector
-    """
-    Qstep = 2 * range_ * dQ / points
-    Qres = Q + (np.arange(points)-(points-1)/2)[:, np.newaxis]*Qstep
-    weight = (1/np.sqrt(2*np.pi)/dQ *
-              np.exp(-(np.transpose(Q[:, np.newaxis])-Qres)**2/(dQ)**2/2))
-    Qret = Qres.flatten()
-    return (Qret, weight)
-
-
-# Include the resolution with Qret and weight calculated from ResolutionVector
-# and I the calculated intensity at each point. returns the intensity
-def ConvoluteResolutionVector(Qret, I, weight):
-    """ copy from GenX
-    """
-    Qret2 = Qret.reshape(weight.shape[0], weight.shape[1])
-    I2 = I.reshape(weight.shape[0], weight.shape[1])
-    norm_fact = np.trapz(weight, x=Qret2, axis=0)
-    Int = np.trapz(I2*weight, x=Qret2, axis=0)/norm_fact
-    return Int
-
-
 class Line(paf.data.CompositeData):
     """ composite data to contain line and material
     """
@@ -55,6 +37,82 @@ class Line(paf.data.CompositeData):
         paf.data.CompositeData.__init__(self, value=value, abstract="line")
 
 
+class SharedElField(object):
+    """ electric field and fluorescence yield of a sample shared by the XRF
+    simulators of several lines measured on the same angles. The field is
+    only solved again when the sample, the wavelength or the angles change.
+    """
+    def __init__(self):
+        """ initialization
+        """
+        #: value used for the last solve
+        self._key = None
+        #: fluorescence yield set with the last field
+        self._fluo = None
+        #: number of simulation reusing the field
+        self.hits = 0
+        #: number of field solve
+        self.misses = 0
+
+    def _same(self, key):
+        """ True if key is the key of the last solve
+        """
+        if self._key is None:
+            return False
+        for value, old_value in zip(key, self._key):
+            if not np.array_equal(value, old_value):
+                return False
+        return True
+
+    def fluo_yield(self, simulator, parameters, n_array):
+        """ fluorescence yield for the parameters of simulator, the field is
+        solved by simulator if it is not already known.
+
+        :param simulator: simulator asking for the field
+        :type simulator: XRFGenXSimulator
+        :param parameters: layer parameters of the simulator
+        :param n_array: refractive index of each layer
+        :rtype: el_field.FluoYield
+        """
+        wavelength = simulator["instrument"]["source"]["wavelength"].value
+        key = (simulator.theta_array, wavelength, n_array, parameters['d'],
+               parameters['sigmar'], parameters['numerical_density'],
+               list(parameters['material']))
+        if self._same(key):
+            self.hits += 1
+            return self._fluo
+        self.misses += 1
+        self._key = tuple(np.copy(value) for value in key[:-1]) + (key[-1],)
+        self._fluo = simulator.solve(parameters, n_array)
+        return self._fluo
+
+
+def share_elfield(simulators):
+    """ share the field solve between XRF simulators measured on the same
+    angles with the same wavelength, simulators must be initialized.
+
+    :param simulators: list of simulator
+    """
+    groups = []
+    for simulator in simulators:
+        if not isinstance(simulator, XRFGenXSimulator):
+            continue
+        wavelength = simulator["instrument"]["source"]["wavelength"].value
+        for group in groups:
+            if (group[0] == wavelength and
+                    np.array_equal(group[1], simulator.theta_array)):
+                group[2].append(simulator)
+                break
+        else:
+            groups.append((wavelength, simulator.theta_array, [simulator]))
+    for _, _, group in groups:
+        shared = None
+        if len(group) > 1:
+            shared = SharedElField()
+        for simulator in group:
+            simulator.shared_elfield = shared
+
+
 class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
     """ simulator for XRF
     """
@@ -67,6 +125,8 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
         pyxcel.engine.simulator.generic.Simulator.__init__(self, theta_array,
                                                            stack, instrument,
                                                            abstract)
+        #: field shared with simulators of other lines
+        self._shared_elfield = None
 
     @property
     def model_parameters(self):
@@ -80,6 +140,36 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
         """
         self._parmeters = value
 
+    @property
+    def theta_array(self):
+        """ incident angles including the resolution points
+        """
+        return self._theta_array
+
+    @property
+    def shared_elfield(self):
+        """ field shared with simulators of other lines, None if not shared
+        """
+        return self._shared_elfield
+
+    @shared_elfield.setter
+    def shared_elfield(self, value):
+        """ setter for shared field
+        """
+        self._shared_elfield = value
+
+    @property
+    def elfield(self):
+        """ incremental field solver used by simulate (hits and misses), the
+        one of the optical cache if the simulator shares it, None if the
+        angles are adaptively sampled
+        """
+        if self._adaptive_sampler is not None:
+            return None
+        if self._optical_cache is not None:
+            return self._optical_cache.elfield
+        return self._elfield
+
     def initialization(self, filter_):
         """ initializing XRF simulation.
 
@@ -110,12 +200,13 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
         range_ = self._instrument["detector"]["resintrange"].value
         res = self._instrument["detector"]["res"].value
         respoints = self._instrument["detector"]["respoints"].value
-        (twoThetaQz, weight) = ResolutionVector(twotheta_array, res, respoints,
-                                                range_)
+        self._kernel = resolution.resolution_kernel(
+            twotheta_array, res, respoints, range_,
+            resolution.detector_quadrature(self._instrument["detector"]))
+        twoThetaQz = self._kernel.grid
         self._det_angle_array = 90.-twoThetaQz/2.
         self._twoThetaQz = twoThetaQz
         self._theta_array = self._twoThetaQz / 2
-        self._weight = weight
 
         # load instrumental parameter
         self.calculate_inst()
@@ -127,13 +218,15 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
             parameters['material'][idx] = each.replace("_","")
 
         self._f_array = np.array(parameters['f'], dtype=np.complex64)
-        energy = xraylib.LineEnergy(xraylib.
-                                    SymbolToAtomicNumber(str(self._material)),
-                                    self._line)
+        energy = xraylib_cache.LineEnergy(
+            xraylib.SymbolToAtomicNumber(str(self._material)), self._line)
         self._det_efficiency = SDDeff.eff_sdd1_09_kw49([energy*1000.])
         self._my_fluo = self.create_my_fluo(parameters) # PARAMETERS CONTAINS UNCORRECTLY FORMATTED MATERIAL NAME WHEN STOCHIO SYNTAX "_" IS USED
         self._my_fluo.set_theta_array(self._theta_array)
         self._stack_name_list = list(self._parmeters['name'])
+        self._blocks = periodic.sample_blocks(self._sample,
+                                              len(self._parmeters['d']))
+        self._elfield = el_field.IncrementalElField()
 
     def calculate_inst(self):
         """ calculate instrument correction
@@ -142,12 +235,13 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
         range_ = self._instrument["detector"]["resintrange"].value
         res = self._instrument["detector"]["res"].value
         respoints = self._instrument["detector"]["respoints"].value
-        (twoThetaQz, weight) = ResolutionVector(twotheta_array, res, respoints,
-                                                range_)
+        self._kernel = resolution.resolution_kernel(
+            twotheta_array, res, respoints, range_,
+            resolution.detector_quadrature(self._instrument["detector"]))
+        twoThetaQz = self._kernel.grid
         self._det_angle_array = 90.-twoThetaQz/2.
         self._twoThetaQz = twoThetaQz
         self._theta_array = self._twoThetaQz / 2
-        self._weight = weight
         inst = self._instrument
         width_parallel_s = inst["detector"]["width_parallel_s"].value
         width_parallel_l = inst["detector"]["width_parallel_l"].value
@@ -166,21 +260,73 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
         self._geom = self.geometric_calc(self._samlen, exp_configuration,
                                          self._theta_array)
 
-    def create_my_fluo(self, parameters):
-        """ create my fluo object
+    def fluo_sample(self, parameters):
+        """ refractive index, mass density and material of each layer for my
+        fluo object
         """
         wavelength = self._instrument["source"]["wavelength"].value
         dens = np.array(parameters['numerical_density'], dtype=np.float64)
-        re = 2.8179403267e-5  # classical electron radius in Angstrom
-        n_array = (1 - dens * re * wavelength**2 / 2 / np.pi * self._f_array)
+        n_array = refractive_index(wavelength, dens, self._f_array)[0]
         material_array = np.array(parameters['material'])
         for idx, each in enumerate(material_array):
             material_array[idx] = each.replace("_","")
-        mass_dens_array = [tools.calc_mass_density(dens[lay_idx], mat) # edit material_array so that no "_" is in the array
+        # mass density is proportional to numerical density
+        for mat in material_array:
+            if mat not in self._mass_factor:
+                self._mass_factor[mat] = tools.calc_mass_density(1., mat)
+        mass_dens_array = [dens[lay_idx] * self._mass_factor[mat]
                            for lay_idx, mat in enumerate(material_array)]
+        return n_array, mass_dens_array, material_array
+
+    def create_my_fluo(self, parameters):
+        """ create my fluo object
+        """
+        self._mass_factor = {}
+        n_array, mass_dens_array, material_array = self.fluo_sample(parameters)
         return el_field.FluoYield(self._instrument, n_array, mass_dens_array,
                                   material_array)
 
+    def update_my_fluo(self, parameters):
+        """ update my fluo object for new parameters, attenuation tables are
+        only calculated for changed materials.
+        """
+        n_array, mass_dens_array, material_array = self.fluo_sample(parameters)
+        if len(self._mass_factor) > 2 * len(material_array):
+            # forget materials of previous stochiometries
+            self._mass_factor = {mat: self._mass_factor[mat]
+                                 for mat in material_array}
+        self._my_fluo.update(n_array, mass_dens_array, material_array)
+        return self._my_fluo
+
+    def solve(self, parameters, n_array):
+        """ calculate the electric field in the sample and set my fluo object
+        with it.
+
+        :param parameters: layer parameters
+        :param n_array: refractive index of each layer
+        :rtype: el_field.FluoYield
+        """
+        my_fluo = self.update_my_fluo(parameters)
+        if self._fit_inst:
+            my_fluo.set_theta_array(self._theta_array)
+        wavelength = self._instrument["source"]["wavelength"].value
+        if self._adaptive_sampler is not None:
+            elfield = self._adaptive_sampler.field(
+                self._theta_array, wavelength, n_array, parameters['d'],
+                parameters['sigmar'], self._blocks)
+        elif self._optical_cache is None:
+            elfield = self._elfield(self._theta_array, wavelength, n_array,
+                                    parameters['d'], parameters['sigmar'],
+                                    self._blocks)
+        else:
+            elfield = self._optical_cache.field(self, self._theta_array,
+                                                wavelength, n_array,
+                                                parameters['d'],
+                                                parameters['sigmar'],
+                                                self._blocks)
+        my_fluo.set_elfield(elfield)
+        return my_fluo
+
     def simulate(self):
         """ simulate XRF.
         """
@@ -210,12 +356,9 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
         if self._fit_stochio:
             #print("fit stochio - pyxcel/engin/simulator/xrf_no_genx/XRFGenXSimulator.simulate")
             self._f_array = parameters['f']
-        my_fluo = self.create_my_fluo(parameters)
-        my_fluo.set_theta_array(self._theta_array)
-        re = 2.8179403267e-5  # classical electron radius in Angstrom
         d_array = parameters['d']
         dens = parameters['numerical_density']
-        n_array = (1 - dens * re * wavelength**2/2/np.pi*self._f_array)
+        n_array = refractive_index(wavelength, dens, self._f_array)[0]
 
         # calculate some value
         sigma_array = parameters['sigmar']
@@ -226,9 +369,11 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
                                       )
 
         # calculate fluo
-        elfield = el_field.ElField(theta_array, wavelength, n_array, d_array,
-                                   sigma_array)
-        my_fluo.set_elfield(elfield)
+        if self._shared_elfield is None:
+            my_fluo = self.solve(parameters, n_array)
+        else:
+            my_fluo = self._shared_elfield.fluo_yield(self, parameters,
+                                                      n_array)
         fluo = my_fluo.fluo_int(det_angle_array-theta_array, n_array, d_array,
                                 sigma_array, mass_dens_array, material_array,
                                 self._material, line, XRF_CS)
@@ -238,10 +383,78 @@ class XRFGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
                                     self._det_efficiency, theta_array)
 
         # convolution
-        fluo = ConvoluteResolutionVector(self._twoThetaQz, fluo[:],
-                                         self._weight)
+        fluo = self._kernel.convolute(fluo)
         return fluo
 
+    def simulate_jacobian(self, directions):
+        """ simulate XRF and its derivatives. The field is calculated for the
+        simulator only (no cache, sampling nor sharing).
+
+        :param directions: list of (key, layer index) with key in "d",
+                           "sigmar" and "numerical_density" (the mass density
+                           follows), or ("I0", None), derivatives for other
+                           keys are 0
+        :return: simulation (points) and jacobian (len(directions), points)
+        """
+        pyxcel.engine.simulator.generic.Simulator.simulate(self)
+        if self._fit_inst:
+            self.calculate_inst()
+        line = self._line
+        inc_flux = self._instrument["source"]["I0"].value
+        theta_array = self._theta_array
+        det_angle_array = self._detector["det_angle_array"] - theta_array
+        wavelength = self._instrument["source"]["wavelength"].value
+        parameters = self._parmeters
+        if self._fit_stochio:
+            self._f_array = parameters['f']
+        d_array = parameters['d']
+        dens = parameters['numerical_density']
+        n_array = refractive_index(wavelength, dens, self._f_array)[0]
+        mass_dens_array = parameters['mass_density']
+        XRF_CS = el_field.calc_XRF_CS(self._material, line,
+                                      tools.wavelength_to_in_energy(wavelength)
+                                      )
+        my_fluo = self.update_my_fluo(parameters)
+        if self._fit_inst:
+            my_fluo.set_theta_array(self._theta_array)
+        elfield = el_field.ElField(theta_array, wavelength, n_array, d_array,
+                                   parameters['sigmar'])
+        my_fluo.set_elfield(elfield)
+        fluo = my_fluo.fluo_int(det_angle_array, n_array, d_array,
+                                parameters['sigmar'], mass_dens_array,
+                                my_fluo.mat_array, self._material, line,
+                                XRF_CS)
+
+        # derivatives of the layer parameters along each direction
+        shape = (len(directions), len(d_array))
+        dn = np.zeros(shape, dtype=np.complex128)
+        dd, dsigma, dmass = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        for index, (key, layer) in enumerate(directions):
+            if key == "d":
+                dd[index, layer] = 1.
+            elif key == "sigmar":
+                dsigma[index, layer] = 1.
+            elif key == "numerical_density":
+                dn[index, layer] = -index_factor(
+                    wavelength, self._f_array)[0, layer]
+                dmass[index, layer] = \
+                    self._mass_factor[my_fluo.mat_array[layer]]
+        tangent = elfield.tangent(dn, dd, dsigma)
+        jacobian = my_fluo.fluo_int_jacobian(tangent, dn, dd, dmass,
+                                             det_angle_array, n_array,
+                                             d_array, mass_dens_array,
+                                             self._material, line, XRF_CS)
+        rows = np.vstack((jacobian * inc_flux, fluo * inc_flux))
+        for index, (key, _) in enumerate(directions):
+            if key == "I0":
+                rows[index] = fluo
+
+        # instrumental correction and convolution
+        result = self._kernel.convolute(
+            el_field.fluo_quanti(rows, 1., self._geom, self._det_efficiency,
+                                 theta_array))
+        return result[-1], result[:-1]
+
     def simulate_ambiant(self, func):
         """ rewrite simulation for use ambiant
         """
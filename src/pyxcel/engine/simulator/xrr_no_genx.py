@@ -7,13 +7,15 @@ module for XRR simulator.
 
 .. moduleauthor:: Gaël PICOT <gael.picot@free.fr>
 """
+import functools
 import pyxcel.engine.simulator.generic
+import pyxcel.engine.simulator.periodic as periodic
+import pyxcel.engine.simulator.resolution as resolution
+import pyxcel.engine.simulator.kinematic as kinematic
+import pyxcel.engine.modeling.tools as tools
 import numpy as np
 import paf.data
-import sys
 from scipy.special import erf
-if sys.version_info[0] >= 3:
-    from functools import reduce
 MAKE_DATA = paf.data.make_data
 
 
@@ -32,88 +34,237 @@ def SquareIntensity(alpha, slen, beamwidth):
     return np.where(F <= 1.0, F, np.ones(F.shape))
 
 
-def resolution_vector(Q, dQ, points, range_=3):
-    """ calculate resolution vector
-    """
-    Qstep = 2*range_*dQ/points
-    Qres = Q+(np.arange(points)-(points-1)/2)[:, np.newaxis]*Qstep
-    weight = (1/np.sqrt(2*np.pi)/dQ *
-              np.exp(-(np.transpose(Q[:, np.newaxis])-Qres)**2/(dQ)**2/2))
-    Qret = Qres.flatten()
-    return (Qret, weight)
-
+def first_change(old, new):
+    """ index of the first layer with a different value in new, number of
+    layers if every value is equal
 
-def ConvoluteFast(Q, I, dQ, range_=3):
-    """ from GenX :
-        Fast convlution - constant resolution
-        constant spacing between data!
+    :param old: previous values (population, layers) or (layers)
+    :param new: new values with the same shape
+    :rtype: int
     """
-    Qstep = Q[1]-Q[0]
-    resvector = np.arange(-range_*dQ, range_*dQ+Qstep, Qstep)
-    weight = 1/np.sqrt(2*np.pi)/dQ*np.exp(-(resvector)**2/(dQ)**2/2)
-    Iconv = (np.convolve(np.r_[np.ones(resvector.shape)*I[0], I,
-                               np.ones(resvector.shape)*I[-1]],
-                         weight/weight.sum(), mode=1)
-             [resvector.shape[0]:-resvector.shape[0]])
-    return Iconv
-
-
-def ConvoluteResolutionVector(Qret, I, weight):
-    """ from GenX:
-        Include the resolution with Qret and weight calculated from
-        ResolutionVector and I the calculated intensity at each point. returns
-        the intensity
+    changed = np.flatnonzero(np.any(np.atleast_2d(old) !=
+                                    np.atleast_2d(new), axis=0))
+    if changed.size:
+        return int(changed[0])
+    return np.shape(new)[-1]
+
+
+def refl_batch(theta, wavelength, n, d, sigma, blocks=None, partials=None):
+    """ calculate XRR for a population of stack.
+
+    :param theta: incident angles in degree (nb_angle)
+    :param wavelength: wavelength in Angstrom
+    :param n: index of refraction (population, layers) substrate first
+    :param d: thickness (population, layers)
+    :param sigma: roughness (population, layers)
+    :param blocks: periodic blocks (start, period, repetition), repeated
+                   periods are computed by squaring the matrix of one period
+    :param partials: reflection coefficient under the layer at each index
+                     (dict), the recursion resumes from the highest index and
+                     new coefficients are added
+    :return: reflectivity (population, nb_angle)
     """
-    Qret2 = Qret.reshape(weight.shape[0], weight.shape[1])
-    I2 = I.reshape(weight.shape[0], weight.shape[1])
-    norm_fact = np.trapz(weight, x=Qret2, axis=0)
-    Int = np.trapz(I2*weight, x=Qret2, axis=0)/norm_fact
-    return Int
+    n = np.atleast_2d(n)
+    d = np.atleast_2d(d)
+    sigma = np.atleast_2d(sigma)
+    starts = {}
+    if blocks:
+        starts = {start: (period, repetition) for start, period, repetition
+                  in periodic.valid_blocks(blocks, n, d, sigma)}
+    # Length of k-vector in vaccum
+    k = 2*np.pi/wavelength
+    cos2 = np.cos(theta*np.pi/180)**2
+    n_amb = n[:, -1:]
 
+    def wave_vector(index):
+        """ wavevector in the layer at index
+        """
+        return 2*n_amb*k*np.sqrt(n[:, index:index+1]**2/n_amb**2 - cos2)
 
-def ConvoluteFastVar(Q, I, dQ):
-    """ From GenX :
-        Fast convolution - varying resolution
-        constant spacing between the dat.
-    """
-    weight = 1/np.sqrt(2*np.pi)/dQ*np.exp(-(Q[:, np.newaxis]-Q)**2/(dQ)**2/2)
-    Itemp = I[:, np.newaxis]*np.ones(I.shape)
-    norm_fact = np.trapz(weight, axis=0)
-    Int = np.trapz(Itemp*weight, axis=0)/norm_fact
-    return Int
+    def fresnel(Q_low, Q_up, index):
+        """ Fresnel reflectivity for the interface on layer at index
+        """
+        sig = sigma[:, index:index+1]
+        return (Q_up-Q_low)/(Q_up+Q_low)*np.exp(-Q_up*Q_low/2*sig**2)
+
+    # Paratt's recursion formula from the substrate
+    if partials:
+        index = max(partials)
+        r = partials[index]
+        Q_cur = wave_vector(index)
+    else:
+        Q_cur = wave_vector(1)
+        r = fresnel(wave_vector(0), Q_cur, 0)
+        index = 1
+    while index < n.shape[1]-1:
+        if partials is not None:
+            partials[index] = r
+        if index in starts:
+            # every period but the last one ends on the same layer
+            period, repetition = starts[index]
+            matrix = None
+            for _ in range(period):
+                Q_next = wave_vector(index+1)
+                step = periodic.step_matrix(
+                    fresnel(Q_cur, Q_next, index),
+                    np.exp(1.0j*d[:, index:index+1]*Q_cur))
+                matrix = (step if matrix is None else
+                          periodic.multiply(step, matrix))
+                Q_cur = Q_next
+                index += 1
+            r = periodic.apply(periodic.power(matrix, repetition-1), r)
+            index += period*(repetition-2)
+            Q_cur = wave_vector(index)
+            continue
+        Q_next = wave_vector(index+1)
+        rp = fresnel(Q_cur, Q_next, index)
+        p = np.exp(1.0j*d[:, index:index+1]*Q_cur)
+        r = (rp+r*p)/(1+r*rp*p)
+        Q_cur = Q_next
+        index += 1
+    return abs(r)**2
 
 
-def refl(theta, wavelength, n, d, sigma):
+def refl(theta, wavelength, n, d, sigma, blocks=None):
     """ calculate XRR
     """
-    d = d[1:-1]
-    sigma = sigma[:-1]
-    # Length of k-vector in vaccum
+    return refl_batch(theta, wavelength, n[np.newaxis], d[np.newaxis],
+                      sigma[np.newaxis], blocks)[0]
+
+
+def refl_jacobian(theta, wavelength, n, d, sigma):
+    """ calculate XRR and its derivatives. Each angle has one output, so the
+    derivative of the top coefficient with respect to the coefficient under
+    each layer is accumulated from the top after the recursion, and the
+    derivatives for every layer come from one backward pass.
+
+    :param theta: incident angles in degree (nb_angle)
+    :param wavelength: wavelength in Angstrom
+    :param n: index of refraction (layers) substrate first
+    :param d: thickness (layers)
+    :param sigma: roughness (layers)
+    :return: reflectivity (nb_angle) and dictionary of derivatives (layers,
+             nb_angle): "d", "sigmar" and "n" where "n" is complex, the
+             derivative for a real parameter x is real(jac["n"] * dn/dx)
+    """
+    nb_layer = len(n)
     k = 2*np.pi/wavelength
-    # Calculates the wavevector in each layer
-    Qj = 2*n[-1]*k*np.sqrt(n[:, np.newaxis]**2/n[-1]**2 -
-                           np.cos(theta*np.pi/180)**2)
-    # Fresnel reflectivity for the interfaces
-    rp = (Qj[1:]-Qj[:-1])/(Qj[1:]+Qj[:-1])*np.exp(-Qj[1:]*Qj[:-1]/2 *
-                                                  sigma[:, np.newaxis]**2)
-    p = np.exp(1.0j*d[:, np.newaxis]*Qj[1:-1])
-    # Setting up a matrix for the reduce function. Reduce only takes one array
-    # as argument
-    rpp = np.array(list(map(lambda x, y: [x, y], rp[1:], p)))
-
-    # Paratt's recursion formula
-    def formula(rtot, rint):
-        return (rint[0]+rtot*rint[1])/(1+rtot*rint[0]*rint[1])
-    # Implement the recursion formula
-    r = reduce(formula, rpp, rp[0])
-    return abs(r)**2
+    cos2 = np.cos(np.asarray(theta)*np.pi/180)**2
+    n_amb = n[-1]
+    Q = 2*n_amb*k*np.sqrt(n[:, np.newaxis]**2/n_amb**2 - cos2)
+    sig = np.asarray(sigma, dtype=np.float64)[:-1, np.newaxis]
+    Q_low, Q_up = Q[:-1], Q[1:]
+    roughness = np.exp(-Q_up*Q_low/2*sig**2)
+    rp = (Q_up-Q_low)/(Q_up+Q_low)*roughness
+    # derivatives of the Fresnel coefficient of each interface
+    rp_low = (-2*Q_up/(Q_up+Q_low)**2*roughness - rp*Q_up*sig**2/2)
+    rp_up = (2*Q_low/(Q_up+Q_low)**2*roughness - rp*Q_low*sig**2/2)
+    p = np.exp(1.0j*np.asarray(d)[:, np.newaxis]*Q)
+
+    # Paratt's recursion formula from the substrate, r[i] is under layer i
+    r = np.zeros(Q.shape, dtype=np.complex128)
+    r[1] = rp[0]
+    for index in range(1, nb_layer-1):
+        r[index+1] = ((rp[index] + r[index]*p[index]) /
+                      (1 + r[index]*p[index]*rp[index]))
+
+    # adjoint of rp and p from the top
+    g_rp = np.zeros(rp.shape, dtype=np.complex128)
+    g_p = np.zeros(Q.shape, dtype=np.complex128)
+    g_r = np.ones(Q.shape[1], dtype=np.complex128)
+    for index in range(nb_layer-2, 0, -1):
+        v = r[index]*p[index]
+        denominator = (1 + v*rp[index])**2
+        g_rp[index] = g_r*(1 - v**2)/denominator
+        g_v = g_r*(1 - rp[index]**2)/denominator
+        g_p[index] = g_v*r[index]
+        g_r = g_v*p[index]
+    g_rp[0] = g_r
+
+    g_Q = np.zeros(Q.shape, dtype=np.complex128)
+    g_Q[:-1] += g_rp*rp_low
+    g_Q[1:] += g_rp*rp_up
+    g_Q += g_p*1.0j*np.asarray(d)[:, np.newaxis]*p
+    jacobian = {"d": np.zeros(Q.shape), "sigmar": np.zeros(Q.shape),
+                "n": np.zeros(Q.shape, dtype=np.complex128)}
+    top = 2*np.conj(r[-1])
+    jacobian["d"][1:-1] = np.real(top*g_p[1:-1]*1.0j*Q[1:-1]*p[1:-1])
+    jacobian["sigmar"][:-1] = np.real(top*g_rp*rp*(-Q_up*Q_low*sig))
+    # Q = 2 k sqrt(n**2 - n_amb**2 cos2): the ambient index is in every Q
+    jacobian["n"][:-1] = top*g_Q[:-1]*4*k**2*n[:-1, np.newaxis]/Q[:-1]
+    jacobian["n"][-1] = top*(
+        g_Q[-1]*4*k**2*n_amb*(1-cos2)/Q[-1] -
+        np.sum(g_Q[:-1]*4*k**2*n_amb*cos2/Q[:-1], axis=0))
+    return abs(r[-1])**2, jacobian
+
+
+class IncrementalParratt(object):
+    """ refl_batch keeping the partial reflection coefficients of the last
+    evaluation: when only upper layers changed, the recursion resumes under
+    the lowest changed layer.
+    """
+    def __init__(self):
+        """ initialization
+        """
+        #: False to always compute the whole recursion
+        self.enabled = True
+        #: angles, wavelength and blocks of the last evaluation
+        self._key = None
+        #: index of refraction, thickness and roughness of the last evaluation
+        self._layers = None
+        #: reflection coefficient under each layer of the last evaluation
+        self._partials = {}
+        #: number of evaluation resumed from a previous one
+        self.hits = 0
+        #: number of evaluation of the whole recursion
+        self.misses = 0
+
+    def resume_index(self, key, n, d, sigma):
+        """ highest layer under which the last evaluation is still valid, 0
+        if nothing can be kept
+        """
+        if self._layers is None or self._key[1:] != key[1:]:
+            return 0
+        old_n, old_d, old_sigma = self._layers
+        if (not np.array_equal(self._key[0], key[0]) or
+                old_n.shape != n.shape or
+                not np.array_equal(old_n[:, -1], n[:, -1])):
+            return 0
+        # the coefficient under layer i needs the index of layer i and the
+        # thickness and roughness of layers under i
+        return min(first_change(old_n, n)-1, first_change(old_d, d),
+                   first_change(old_sigma, sigma))
+
+    def __call__(self, theta, wavelength, n, d, sigma, blocks=None):
+        """ reflectivity with the signature of refl_batch
+        """
+        n = np.atleast_2d(n)
+        d = np.atleast_2d(d)
+        sigma = np.atleast_2d(sigma)
+        if not self.enabled or n.shape[0] != 1:
+            self.misses += 1
+            return refl_batch(theta, wavelength, n, d, sigma, blocks)
+        key = (np.array(theta), wavelength, list(blocks or []))
+        resume = self.resume_index(key, n, d, sigma)
+        partials = {index: r for index, r in self._partials.items()
+                    if index <= resume}
+        if partials:
+            self.hits += 1
+        else:
+            self.misses += 1
+        result = refl_batch(theta, wavelength, n, d, sigma, blocks, partials)
+        self._key = key
+        self._layers = (n.copy(), d.copy(), sigma.copy())
+        self._partials = partials
+        return result
 
 
 def resolve_parameter(sample):
     """ equivalent to sample.resolveparameter
     """
     numpy_param_type = {"d": np.float64, "numerical_density": np.float64,
-                        "f": np.complex64, "sigmar": np.float64}
+                        "f": np.complex64, "sigmar": np.float64,
+                        "mass_density": np.float64}
     parameters = {}
     for key in sample["substrate"].keys():
         parameters[key] = [sample["substrate"][key].value]
@@ -126,54 +277,150 @@ def resolve_parameter(sample):
     return parameters
 
 
-def simulate(TwoThetaQz, parameters, instrument, samlen):
+def simulate(TwoThetaQz, parameters, instrument, samlen, refl_func=None):
     """ simulate XRR using only mpyxcel
     """
-    # access to value of parameter
-    restype = instrument["detector"]["restype"].value
-    res = instrument["detector"]["res"].value
-    respoint = instrument["detector"]["respoints"].value
-    resintrange = instrument["detector"]["resintrange"].value
-    coords = instrument["source"]["coords"].value
+    return simulate_batch(TwoThetaQz, parameters, instrument, samlen,
+                          refl_func)[0]
+
+
+def unsmeared_batch(TwoThetaQz, parameters, instrument, samlen,
+                    refl_func=None):
+    """ reflectivity with footprint correction before the resolution
+    convolution and the background.
+
+    :param refl_func: function replacing refl_batch
+    :return: reflectivity (population, len(TwoThetaQz))
+    """
+    if refl_func is None:
+        refl_func = refl_batch
     wavelength = instrument["source"]["wavelength"].value
     I0 = instrument["source"]["I0"].value
-
-    # configure instrument parameter
-    weight = 0
-    if restype == 2:
-        TwoThetaQz, weight = resolution_vector(TwoThetaQz[:], res, respoint,
-                                               resintrange)
-    theta = TwoThetaQz/2
-    if coords == 0:
-        theta = np.arcsin(TwoThetaQz/4/np.pi*wavelength)*180./np.pi
+    theta = incident_angle(TwoThetaQz, instrument)
 
     # configure sample parameter
-    re = 2.82e-13*1e2/1e-10
-    n = 1 - (parameters['numerical_density']*re*wavelength**2/2/np.pi *
-             parameters['f']*1e-4)
+    n = refractive_index(wavelength, parameters['numerical_density'],
+                         parameters['f'])
 
     # calculate reflectivity
-    R = refl(theta, wavelength, n, parameters['d'], parameters['sigmar']) * I0
+    R = refl_func(theta, wavelength, n, parameters['d'],
+                  parameters['sigmar']) * I0
+    return R*footprint(theta, instrument, samlen)
+
+
+def incident_angle(TwoThetaQz, instrument):
+    """ incident angles in degree of 2 theta or Qz values
+    """
+    if instrument["source"]["coords"].value == 0:
+        wavelength = instrument["source"]["wavelength"].value
+        return np.arcsin(TwoThetaQz/4/np.pi*wavelength)*180./np.pi
+    return TwoThetaQz/2
+
+
+def index_factor(wavelength, f):
+    """ decrement of the refractive index for a numerical density of 1
+    """
+    # complex128 as f is stored in single precision
+    f = np.atleast_2d(np.asarray(f, dtype=np.complex128))
+    return tools.electron_radius*wavelength**2/2/np.pi * f
+
 
-    # Footprint corrections
-    foocor = 1.0
+def refractive_index(wavelength, numerical_density, f):
+    """ refractive index of each layer, shared by every simulator so that
+    their optical solutions can be reused (population, layers)
+    """
+    return 1 - np.atleast_2d(numerical_density)*index_factor(wavelength, f)
+
+
+def footprint(theta, instrument, samlen):
+    """ footprint correction of each angle (1.0 if there is none)
+    """
     footype = instrument["source"]["footype"].value
     beamw = instrument["source"]["beamw"].value
-    Ibkg = instrument["detector"]["Ibkg"].value
-    resintrange = instrument["detector"]["resintrange"].value
     if footype == 1:
-        foocor = GaussIntensity(theta, samlen/2.0, samlen/2.0, beamw)
+        return GaussIntensity(theta, samlen/2.0, samlen/2.0, beamw)
     elif footype == 2:
-        foocor = SquareIntensity(theta, samlen, beamw)
-    if restype == 0:
-        R = R[:]*foocor
+        return SquareIntensity(theta, samlen, beamw)
+    return 1.0
+
+
+def resolution_grid(TwoThetaQz, instrument):
+    """ angles where the reflectivity is calculated for the resolution of the
+    detector and linear function convoluting (population, angles) arrays
+    calculated on them.
+
+    :return: grid and convolution function
+    """
+    restype = instrument["detector"]["restype"].value
+    res = instrument["detector"]["res"].value
+    respoint = instrument["detector"]["respoints"].value
+    resintrange = instrument["detector"]["resintrange"].value
+    if restype == 2:
+        kernel = resolution.resolution_kernel(
+            TwoThetaQz, res, respoint, resintrange,
+            resolution.detector_quadrature(instrument["detector"]))
+        return kernel.grid, kernel.convolute
+    elif restype == 4:
+        # constant resolution with FFT, non uniform grids are resampled
+        kernel = resolution.fft_kernel(TwoThetaQz, res, resintrange)
+        return kernel.grid, kernel.convolute
     elif restype == 1:
-        R = ConvoluteFast(TwoThetaQz, R[:]*foocor, res, resintrange)
-    elif restype == 2:
-        R = ConvoluteResolutionVector(TwoThetaQz, R[:]*foocor, weight)
+        return TwoThetaQz, resolution.fast_kernel(TwoThetaQz, res,
+                                                  resintrange).convolute
     elif restype == 3:
-        R = ConvoluteFastVar(TwoThetaQz, R[:]*foocor, res)
-    return R + Ibkg
+        return TwoThetaQz, resolution.var_kernel(TwoThetaQz, res).convolute
+    return TwoThetaQz, np.asarray
+
+
+def simulate_batch(TwoThetaQz, parameters, instrument, samlen,
+                   refl_func=None):
+    """ simulate XRR for a population of parameter set. "numerical_density",
+    "f", "d" and "sigmar" can be stacked in arrays (population, layers).
+
+    :param refl_func: function replacing refl_batch
+    :return: reflectivity (population, len(TwoThetaQz))
+    """
+    Ibkg = instrument["detector"]["Ibkg"].value
+    TwoThetaQz, convolute = resolution_grid(TwoThetaQz, instrument)
+    R = unsmeared_batch(TwoThetaQz, parameters, instrument, samlen, refl_func)
+    return convolute(R) + Ibkg
+
+
+def simulate_jacobian(TwoThetaQz, parameters, instrument, samlen,
+                      directions):
+    """ simulate XRR and its derivatives for one parameter set.
+
+    :param directions: list of (key, layer index) with key in "d",
+                       "sigmar" and "numerical_density", or (key, None) with
+                       key in "I0" and "Ibkg", derivatives for other keys
+                       are 0
+    :return: simulation (points) and jacobian (len(directions), points)
+    """
+    Ibkg = instrument["detector"]["Ibkg"].value
+    wavelength = instrument["source"]["wavelength"].value
+    I0 = instrument["source"]["I0"].value
+    TwoThetaQz, convolute = resolution_grid(TwoThetaQz, instrument)
+    theta = incident_angle(TwoThetaQz, instrument)
+    factor = index_factor(wavelength, parameters['f'])[0]
+    n = refractive_index(wavelength, parameters['numerical_density'],
+                         parameters['f'])[0]
+    R, jacobian = refl_jacobian(theta, wavelength, n, parameters['d'],
+                                parameters['sigmar'])
+    scale = I0*footprint(theta, instrument, samlen)
+    rows = []
+    for key, index in directions:
+        if key in ("d", "sigmar"):
+            rows.append(jacobian[key][index]*scale)
+        elif key == "numerical_density":
+            rows.append(np.real(-jacobian["n"][index]*factor[index])*scale)
+        elif key == "I0":
+            rows.append(R*scale/I0)
+        else:
+            rows.append(np.zeros(R.shape))
+    result = convolute(np.array(rows + [R*scale]))
+    result[[index for index, (key, _) in enumerate(directions)
+            if key == "Ibkg"]] = 1.
+    return result[-1] + Ibkg, result[:-1]
 
 
 class XRRGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
@@ -209,6 +456,34 @@ class XRRGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
         self._samlen = self["parameter"]["samplen"].value
         self._parmeters = resolve_parameter(self._sample)
         self._stack_name_list = list(self._parmeters['name'])
+        self._blocks = periodic.sample_blocks(self._sample,
+                                              len(self._parmeters['d']))
+        self._parratt = IncrementalParratt()
+        # kinematic approximation above a multiple of the critical angle
+        self._hybrid = None
+        factor = getattr(filter_, "kinematic_factor", 0.)
+        if factor > 0:
+            self._hybrid = kinematic.HybridReflectivity(self._parratt, factor)
+
+    @property
+    def parratt(self):
+        """ incremental recursion used by simulate (hits and misses), the one
+        of the optical cache if the simulator shares it, None if the angles
+        are adaptively sampled
+        """
+        if self._adaptive_sampler is not None:
+            return None
+        # the hybrid engine does not use the optical cache
+        if self._optical_cache is not None and self._hybrid is None:
+            return self._optical_cache.parratt
+        return self._parratt
+
+    @property
+    def hybrid(self):
+        """ hybrid kinematic engine of the simulator (estimated error of the
+        last evaluation), None if every angle is dynamical
+        """
+        return self._hybrid
 
     def simulate(self):
         """ simulate XRR.
@@ -218,5 +493,77 @@ class XRRGenXSimulator(pyxcel.engine.simulator.generic.Simulator):
 
         # get theta array value
         theta_array = self["theta_array"].value
+        refl_func = functools.partial(self._parratt, blocks=self._blocks)
+        if self._adaptive_sampler is not None:
+            # sampled angles change with parameters: nothing to share
+            refl_func = self._adaptive_sampler.reflectivity_function(
+                functools.partial(refl_batch, blocks=self._blocks))
+        elif self._hybrid is not None:
+            refl_func = functools.partial(self._hybrid, blocks=self._blocks)
+        elif self._optical_cache is not None:
+            refl_func = self._optical_cache.reflectivity_function(
+                self, self._blocks)
         return simulate(theta_array*2, self._parmeters,
-                        self._instrument, self._samlen)
+                        self._instrument, self._samlen, refl_func)
+
+    def simulate_jacobian(self, directions):
+        """ simulate XRR and its derivatives (see simulate_jacobian).
+
+        :param directions: list of (key, layer index) or ("I0", None) and
+                           ("Ibkg", None)
+        :return: simulation (points) and jacobian (len(directions), points)
+        """
+        pyxcel.engine.simulator.generic.Simulator.simulate(self)
+        return simulate_jacobian(self["theta_array"].value*2, self._parmeters,
+                                 self._instrument, self._samlen, directions)
+
+    def quadrature_report(self, nodes=(3, 5, 7, 9, 11)):
+        """ accuracy of the uniform and Gauss-Hermite resolution vectors for
+        the current parameters (see resolution.accuracy_report)
+
+        :param nodes: numbers of nodes to compare
+        :rtype: list
+        """
+        detector = self._instrument["detector"]
+
+        def intensity(two_theta_qz):
+            """ reflectivity before convolution
+            """
+            return unsmeared_batch(two_theta_qz, self._parmeters,
+                                   self._instrument, self._samlen)[0]
+        return resolution.accuracy_report(intensity,
+                                          self["theta_array"].value*2,
+                                          detector["res"].value, nodes,
+                                          detector["resintrange"].value)
+
+    @property
+    def resampling_error(self):
+        """ bound of the interpolation error of the FFT convolution (restype
+        4) relative to the maximum intensity, 0 if the scan is uniform or
+        convoluted otherwise
+        """
+        detector = self._instrument["detector"]
+        if detector["restype"].value != 4:
+            return 0.
+        return resolution.fft_kernel(self["theta_array"].value*2,
+                                     detector["res"].value,
+                                     detector["resintrange"].value).error_bound
+
+    def simulate_batch(self, population):
+        """ simulate XRR for a population of layer parameters in one pass.
+        """
+        if self._fit_stochio:
+            return pyxcel.engine.simulator.generic.Simulator.simulate_batch(
+                self, population)
+        for _ in range(len(population["d"])):
+            self.evaluate()
+        parameters = dict(self._parmeters)
+        parameters.update(population)
+        theta_array = self["theta_array"].value
+        refl_func = refl_batch
+        if self._hybrid is not None:
+            refl_func = self._hybrid
+        return simulate_batch(theta_array*2, parameters, self._instrument,
+                              self._samlen,
+                              functools.partial(refl_func,
+                                                blocks=self._blocks))
@@ -137,6 +137,8 @@ class FastStackEditor(QWidget):
         """ assign a data to the widget
         """
         self._data = CompositeDataObservable(data)
+        # expanded layers are computed again after each edit
+        self._data.connect_to_signal(data.invalidate_layers)
         self._data.connect_to_signal(self.refresh)
         self.refresh()
 
@@ -66,6 +66,7 @@ class ProfileFunctionEditor(QWidget):
         if computer is None:
             self._curent_func = default_func()
             self._parent.layer.add_computer(self._curent_func)
+            self._parent.invalidate_profile()
         else:
             self._curent_func = computer
             self.mat_line.setText(computer["material"].value)
@@ -76,6 +77,7 @@ class ProfileFunctionEditor(QWidget):
         """ change material definition
         """
         self._curent_func["material"] = uni(self.mat_line.text())
+        self._parent.invalidate_profile()
 
     def delete(self):
         """ delete func
@@ -94,6 +96,7 @@ class ProfileFunctionEditor(QWidget):
         func = self._centralizer.option.profile_dict[func_name]
         self._curent_func = func(uni(self.mat_line.text()))
         self._parent.layer.change_computer(self._index, self._curent_func)
+        self._parent.invalidate_profile()
         kwargs_editor = CompositeEditor(self, self._curent_func["kwargs"])
         clear_layout(self.kwargs_widget.layout())
         self.kwargs_widget.layout().addWidget(kwargs_editor)
@@ -153,6 +156,11 @@ class ProfileEditor(QWidget):
         """
         return self._layer
 
+    def invalidate_profile(self):
+        """ sublayers of the edited profile are computed again by the stack
+        """
+        self._stack.invalidate_layers(self._layer)
+
     def change_density_profile(self):
         """ slot for changing density profile
         """
@@ -164,6 +172,7 @@ class ProfileEditor(QWidget):
         """
         if isinstance(self._layer, LayerProfileData):
             self._layer.nb_lay = value
+            self.invalidate_profile()
 
     def add_profile_func(self):
         """ add a new function in profile
@@ -176,6 +185,7 @@ class ProfileEditor(QWidget):
             dens_kwargs_widget.layout().addWidget(density_editor)
             stack = self._stack.real_value["layers"].real_value
             stack[self._layer_index] = self._layer
+            self.invalidate_profile()
         index = len(self._layer["materials"]["computers"])
         new_profil = ProfileFunctionEditor(self, index)
         self._profil_funcs.append(new_profil)
@@ -185,6 +195,7 @@ class ProfileEditor(QWidget):
         """ delete a function
         """
         self._layer.remove_computer(index)
+        self.invalidate_profile()
         self.func_widget.layout().removeWidget(self._profil_funcs[index])
         del self._profil_funcs[index]
         for idx, wid in enumerate(self._profil_funcs):
@@ -222,6 +233,7 @@ class ProfileEditor(QWidget):
         self._layer = self._layer.to_one_layer()
         stack = self._stack.real_value["layers"].real_value
         stack[self._layer_index] = self._layer
+        self.invalidate_profile()
 
 
 class StackEditor(QWidget):
@@ -236,6 +248,8 @@ class StackEditor(QWidget):
         self._former.setupUi(self)
         self._data = CompositeDataObservable(data)
         self._centralizer = pyxcel.engine.centralizer.Centralizer()
+        # expanded layers are computed again after each edit
+        self._data.connect_to_signal(data.invalidate_layers)
         self._data.connect_to_signal(self.refresh)
         self._sigmai_action = None
 
@@ -576,6 +590,7 @@ class StackEditor(QWidget):
             prof_mat2["kwargs"]["amplitude"] = 1.
             i_layer.add_computer(prof_mat1)
             i_layer.add_computer(prof_mat2)
+            self._data.composite_data.invalidate_layers()
             self.refresh()
         else:
             return
@@ -0,0 +1,97 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the adaptive angular sampling.
+"""
+import unittest
+import numpy as np
+import pyxcel.engine.simulator.xrr_no_genx as xrr
+import pyxcel.engine.gixrf.el_field_no_genx as el_field
+from pyxcel.engine.simulator.adaptive import AdaptiveSampler
+
+WAVELENGTH = 1.5406
+THETA = np.linspace(0.05, 4., 8000)
+TOLERANCE = 1e-3
+
+
+def create_stack():
+    """ HfO2/TiN bilayer on silicon (substrate first)
+
+    :return: index of refraction, thickness and roughness
+    """
+    n = np.array([1-7.6e-6+1.7e-7j, 1-2.0e-5+1.3e-6j, 1-1.1e-5+6.0e-7j,
+                  1.+0j])
+    d = np.array([0., 30., 100., 0.])
+    sigma = np.array([3., 4., 5., 0.])
+    return n, d, sigma
+
+
+class AdaptiveSamplerTest(unittest.TestCase):
+    """ test sampled optics against optics on every angle.
+    """
+
+    def test_reflectivity(self):
+        """ interpolated reflectivity is within the tolerance, with fewer
+        evaluated angles
+        """
+        n, d, sigma = create_stack()
+        sampler = AdaptiveSampler(TOLERANCE)
+        result = sampler.reflectivity_function(xrr.refl_batch)(
+            THETA, WAVELENGTH, n, d, sigma)
+        expected = xrr.refl_batch(THETA, WAVELENGTH, n, d, sigma)
+        self.assertEqual(sampler.requested, THETA.size)
+        self.assertLess(sampler.evaluated, THETA.size/4)
+        # the tolerance is checked at the middle of intervals only
+        np.testing.assert_allclose(result, expected, rtol=2*TOLERANCE)
+
+    def test_field(self):
+        """ interpolated field is within the tolerance of the maximum of each
+        array
+        """
+        n, d, sigma = create_stack()
+        sampler = AdaptiveSampler(TOLERANCE)
+        result = sampler.field(THETA, WAVELENGTH, n, d, sigma)
+        expected = el_field.ElField(THETA, WAVELENGTH, n, d, sigma)
+        self.assertLess(sampler.evaluated, sampler.requested)
+        for name in el_field.ElField.ANGULAR:
+            value = getattr(expected, name)
+            error = np.abs(getattr(result, name)-value).max(axis=-1)
+            scale = np.abs(value).max(axis=-1)
+            self.assertTrue(np.all(error <= 2*TOLERANCE*scale), name)
+
+    def test_log(self):
+        """ logarithmic mode refines the minima the linear mode
+        interpolates
+        """
+        n, d, sigma = create_stack()
+        expected = xrr.refl_batch(THETA, WAVELENGTH, n, d, sigma)
+        results = {}
+        for log in (True, False):
+            sampler = AdaptiveSampler(TOLERANCE)
+            results[log] = sampler.sample(
+                THETA, lambda angles: xrr.refl_batch(angles, WAVELENGTH, n,
+                                                     d, sigma),
+                np.sum(d), WAVELENGTH, log=log)
+            results[log, "evaluated"] = sampler.evaluated
+        self.assertLess(results[False, "evaluated"],
+                        results[True, "evaluated"])
+        self.assertGreater(np.max(np.abs(results[False]/expected-1)),
+                           2*TOLERANCE)
+        np.testing.assert_allclose(results[True], expected, rtol=2*TOLERANCE)
+
+    def test_short_fringes(self):
+        """ every angle is calculated when the fringes are as short as the
+        grid
+        """
+        n, d, sigma = create_stack()
+        theta = THETA[::400]
+        sampler = AdaptiveSampler(TOLERANCE)
+        result = sampler.reflectivity_function(xrr.refl_batch)(
+            theta, WAVELENGTH, n, d, sigma)
+        self.assertEqual(sampler.evaluated, theta.size)
+        np.testing.assert_array_equal(
+            result, xrr.refl_batch(theta, WAVELENGTH, n, d, sigma))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the fluorescence yield.
+"""
+import unittest
+import numpy as np
+import xraylib
+import pyxcel.engine.gixrf.el_field_no_genx as el_field
+from pyxcel.engine.modeling.entity import (InstrumentData, XRaySourceData,
+                                           XRFDetectorData)
+
+THETA = np.linspace(0.05, 1., 100)
+DET_ANGLE = np.full(len(THETA), 90.)
+#: layers (substrate first)
+N_ARRAY = np.array([1-7.6e-6+1.7e-7j, 1-7.1e-6+9.e-8j, 1-1.6e-5+1.e-6j,
+                    1.-0j])
+D_ARRAY = np.array([0., 15., 100., 0.])
+SIGMA_ARRAY = np.array([3., 3., 5., 0.])
+MASS_DENS_ARRAY = np.array([2.33, 2.2, 5.2, 0.00125])
+
+
+def create_instrument():
+    """ XRF instrument at the Cu K alpha wavelength
+    """
+    return InstrumentData(XRaySourceData(wavelength=1.5406),
+                          XRFDetectorData(), "XRF")
+
+
+def fluo_int(fluo_yield, n_array, mat_array, one_element, transition,
+             det_angle_array=DET_ANGLE):
+    """ fluorescence intensity of a line of one_element
+    """
+    fluo_yield.set_theta_array(THETA)
+    fluo_yield.set_elfield(el_field.ElField(THETA, 1.5406, n_array, D_ARRAY,
+                                            SIGMA_ARRAY))
+    return fluo_yield.fluo_int(det_angle_array, n_array, D_ARRAY, SIGMA_ARRAY,
+                               MASS_DENS_ARRAY, mat_array, one_element,
+                               transition, 1.)
+
+
+def line_loop(fluo_yield, det_angle_array, mat_array, one_element,
+              transition):
+    """ fluorescence intensity summed layer by layer, as before the emission
+    plans
+    """
+    mm = np.size(mat_array)
+    abso_over_layers = np.ones((mm, len(THETA)))
+    for i in range(mm-2, -1, -1):
+        abso_over_layers[i] = abso_over_layers[i+1] * el_field.abso_layer(
+            MASS_DENS_ARRAY[i+1], D_ARRAY[i+1], det_angle_array,
+            fluo_yield.mu_mass_array[mat_array[i+1]][one_element][transition])
+    fluo_intensity = 0.
+    for j_layer in range(mm):
+        if one_element not in el_field.extract_elements(mat_array[j_layer]):
+            continue
+        mu_mass = fluo_yield.mu_mass_array[mat_array[j_layer]][one_element]
+        muja_over_sin_ang_det = (MASS_DENS_ARRAY[j_layer] *
+                                 mu_mass[transition] /
+                                 np.sin(det_angle_array/180.*np.pi))
+        three_comp = 0j
+        for ii in range(3):
+            arg_abs = fluo_yield.b[ii, j_layer, :] + muja_over_sin_ang_det
+            source = (.5*fluo_yield.As[ii, j_layer, :] +
+                      .5*fluo_yield.Ap[ii, j_layer, :]) / arg_abs
+            if j_layer > 0:
+                source *= 1.0 - np.exp(-D_ARRAY[j_layer]*1e-8*arg_abs)
+            three_comp = three_comp + source
+        fluo_intensity = fluo_intensity + (
+            np.real(three_comp) * abso_over_layers[j_layer+1] *
+            MASS_DENS_ARRAY[j_layer] *
+            fluo_yield.concentrations[mat_array[j_layer]][one_element])
+    return fluo_intensity
+
+
+class FluoYieldTest(unittest.TestCase):
+    """ test the updated fluorescence yield against a new one.
+    """
+
+    def test_update(self):
+        """ tables of an updated yield are the tables of a new yield, tables
+        of kept materials are not calculated again
+        """
+        old = ["Si", "SiO2", "TiN", "N2"]
+        new = ["Si", "HfO2", "TiN", "N2"]
+        n_array = N_ARRAY*np.array([1., 1.+1e-3, 1., 1.])
+        updated = el_field.FluoYield(create_instrument(), N_ARRAY,
+                                     MASS_DENS_ARRAY, old)
+        kept = updated.mu_mass_array["TiN"]["Ti"]
+        updated.update(n_array, MASS_DENS_ARRAY, new)
+        fresh = el_field.FluoYield(create_instrument(), n_array,
+                                   MASS_DENS_ARRAY, new)
+        self.assertIs(updated.mu_mass_array["TiN"]["Ti"], kept)
+        self.assertNotIn("SiO2", updated.concentrations)
+        self.assertNotIn("SiO2", updated.mu_mass_array)
+        np.testing.assert_array_equal(updated.gam, fresh.gam)
+        self.assertEqual(updated.concentrations, fresh.concentrations)
+        self.assertEqual(sorted(updated.mu_mass_array),
+                         sorted(fresh.mu_mass_array))
+        for material, elements in fresh.mu_mass_array.items():
+            self.assertEqual(sorted(updated.mu_mass_array[material]),
+                             sorted(elements))
+            for one_element, lines in elements.items():
+                self.assertEqual(
+                    updated.mu_mass_array[material][one_element], lines)
+
+    def test_fluo_int(self):
+        """ intensity of an updated yield is the intensity of a new yield
+        """
+        old = ["Si", "SiO2", "TiN", "N2"]
+        new = ["Si", "SiO2", "HfO2", "N2"]
+        updated = el_field.FluoYield(create_instrument(), N_ARRAY,
+                                     MASS_DENS_ARRAY, old)
+        fluo_int(updated, N_ARRAY, old, "Ti", xraylib.KA1_LINE)
+        updated.update(N_ARRAY, MASS_DENS_ARRAY, new)
+        result = fluo_int(updated, N_ARRAY, new, "Hf", xraylib.LA1_LINE)
+        fresh = el_field.FluoYield(create_instrument(), N_ARRAY,
+                                   MASS_DENS_ARRAY, new)
+        expected = fluo_int(fresh, N_ARRAY, new, "Hf", xraylib.LA1_LINE)
+        self.assertTrue(np.all(expected > 0))
+        np.testing.assert_allclose(result, expected, rtol=1e-12)
+
+
+class EmissionPlanTest(unittest.TestCase):
+    """ test the emission plans against the loop over layers.
+    """
+
+    def test_fluo_int(self):
+        """ intensity of the plan is the sum over emitting layers
+        """
+        mat_array = ["Si", "SiO2", "TiN", "N2"]
+        det_angle_array = np.linspace(20., 60., len(THETA))
+        fluo_yield = el_field.FluoYield(create_instrument(), N_ARRAY,
+                                        MASS_DENS_ARRAY, mat_array)
+        for one_element, transition in (("Si", xraylib.KA1_LINE),
+                                        ("O", xraylib.KA1_LINE),
+                                        ("Ti", xraylib.KA1_LINE)):
+            result = fluo_int(fluo_yield, N_ARRAY, mat_array, one_element,
+                              transition, det_angle_array)
+            expected = line_loop(fluo_yield, det_angle_array, mat_array,
+                                 one_element, transition)
+            self.assertTrue(np.all(expected > 0))
+            np.testing.assert_allclose(result, expected, rtol=1e-12,
+                                       err_msg=one_element)
+
+    def test_plan(self):
+        """ emitting layers and concentrations, plans are kept until the
+        materials change
+        """
+        mat_array = ["Si", "SiO2", "TiN", "N2"]
+        fluo_yield = el_field.FluoYield(create_instrument(), N_ARRAY,
+                                        MASS_DENS_ARRAY, mat_array)
+        plan = fluo_yield.emission_plan("Si", xraylib.KA1_LINE)
+        np.testing.assert_array_equal(plan.layers, [0, 1])
+        np.testing.assert_allclose(
+            plan.concentration,
+            [1., fluo_yield.concentrations["SiO2"]["Si"], 0., 0.])
+        fluo_yield.update(N_ARRAY*1.001, MASS_DENS_ARRAY, mat_array)
+        self.assertIs(fluo_yield.emission_plan("Si", xraylib.KA1_LINE), plan)
+        fluo_yield.update(N_ARRAY, MASS_DENS_ARRAY,
+                          ["Si", "TiN", "SiO2", "N2"])
+        plan = fluo_yield.emission_plan("Si", xraylib.KA1_LINE)
+        np.testing.assert_array_equal(plan.layers, [0, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the figures of merit.
+"""
+import unittest
+import numpy as np
+import pyxcel.engine.optimization.fom as fom
+
+NAMES = ["log", "log2n", "chi2n", "chi2bars", "chi2d", "log2d", "theta4",
+         "b_logarithmic", "b_normalized_logarithmic", "b_normalized",
+         "b_standart", "b_log_module"]
+
+
+def create_data_set():
+    """ data set decreasing from 100 to 5
+    """
+    random = np.random.RandomState(0)
+    data_set = fom.DataSet()
+    data_set.x = np.linspace(0.1, 3, 50)
+    data_set.y = 100*np.exp(-data_set.x)*(1+0.1*random.rand(50))
+    data_set.error = np.sqrt(data_set.y)
+    return data_set
+
+
+def create_simulations(data_set, population=6):
+    """ simulations around the data set (population, points)
+    """
+    random = np.random.RandomState(1)
+    shape = (population, len(data_set.y))
+    return data_set.y*(1+0.2*(random.rand(*shape)-0.5))
+
+
+class FOMTest(unittest.TestCase):
+    """ test figures of merit.
+    """
+
+    def test_batch(self):
+        """ FOM of a population is the FOM of each individual
+        """
+        data_set = create_data_set()
+        simulations = create_simulations(data_set)
+        for name in NAMES:
+            function = getattr(fom, name)(3)
+            expected = [function(simulation.copy(), data_set)
+                        for simulation in simulations]
+            np.testing.assert_allclose(function.batch(simulations.copy(),
+                                                      data_set),
+                                       expected, rtol=1e-12, err_msg=name)
+
+    def test_residuals(self):
+        """ sum of squared residuals is the FOM and their derivatives are the
+        central finite differences
+        """
+        data_set = create_data_set()
+        simulation = create_simulations(data_set, 1)[0]
+        step = 1e-6*simulation
+        for name in NAMES:
+            function = getattr(fom, name)(3)
+            residual, slope = function.residuals(simulation, data_set)
+            # absolute differences have no exact least square counterpart
+            if name not in ("log", "b_log_module"):
+                np.testing.assert_allclose(np.sum(residual**2),
+                                           function(simulation.copy(),
+                                                    data_set),
+                                           rtol=1e-10, err_msg=name)
+            upper, _ = function.residuals(simulation+step, data_set)
+            lower, _ = function.residuals(simulation-step, data_set)
+            np.testing.assert_allclose((upper-lower)/(2*step), slope,
+                                       rtol=1e-6, err_msg=name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the kinematic approximation and of the hybrid XRR engine.
+"""
+import unittest
+import numpy as np
+import pyxcel.engine.simulator.xrr_no_genx as xrr
+import pyxcel.engine.simulator.kinematic as kinematic
+
+WAVELENGTH = 1.5406
+THETA = np.linspace(0.05, 5., 3000)
+LAYERS = 40
+
+
+def create_population():
+    """ two stacks of LAYERS random layers on silicon (substrate first)
+
+    :return: index of refraction, thickness and roughness
+    """
+    random = np.random.RandomState(0)
+    n = np.concatenate(([1-7.6e-6+1.7e-7j],
+                        1-1e-5*(1+random.rand(LAYERS)) +
+                        5e-7j*random.rand(LAYERS), [1.+0j]))
+    d = np.concatenate(([0.], 5+10*random.rand(LAYERS), [0.]))
+    sigma = np.concatenate(([3.], 2+2*random.rand(LAYERS), [0.]))
+    return (np.vstack((n, n*(1+1e-6))), np.vstack((d, d*1.02)),
+            np.vstack((sigma, sigma)))
+
+
+class KinematicTest(unittest.TestCase):
+    """ test the kinematic and hybrid reflectivities against the Parratt
+    recursion.
+    """
+
+    def test_kinematic(self):
+        """ kinematic reflectivity is the dynamical one well above the
+        critical angle
+        """
+        n, d, sigma = create_population()
+        theta = THETA[THETA > 4.]
+        self.assertTrue(np.all(kinematic.critical_angle(n) < 0.4))
+        np.testing.assert_allclose(
+            kinematic.kinematic_batch(theta, WAVELENGTH, n, d, sigma),
+            xrr.refl_batch(theta, WAVELENGTH, n, d, sigma), rtol=1e-4)
+
+    def test_hybrid(self):
+        """ hybrid reflectivity is dynamical under the switch, continuous at
+        the switch, and its error is estimated on the probe angles
+        """
+        n, d, sigma = create_population()
+        expected = xrr.refl_batch(THETA, WAVELENGTH, n, d, sigma)
+        hybrid = kinematic.HybridReflectivity(xrr.refl_batch, 3.,
+                                              tolerance=0.)
+        result = hybrid(THETA, WAVELENGTH, n, d, sigma)
+        below = THETA <= hybrid.switch
+        np.testing.assert_array_equal(result[:, below], expected[:, below])
+        self.assertGreater(hybrid.kinematic_angles, 0)
+        error = np.abs(result/expected-1)
+        above = error[:, ~below]
+        # overlap and probe angles keep the value of the recursion
+        first = np.flatnonzero(np.any(above > 0, axis=0))[0]
+        self.assertTrue(np.all(above[:, first] < 2e-3))
+        self.assertTrue(np.all(hybrid.error > 0))
+        self.assertTrue(np.all(hybrid.error <= error.max(axis=1)))
+        self.assertAlmostEqual(hybrid.max_error, hybrid.error.max())
+
+    def test_fallback(self):
+        """ stacks above the tolerance are calculated by the recursion
+        """
+        n, d, sigma = create_population()
+        expected = xrr.refl_batch(THETA, WAVELENGTH, n, d, sigma)
+        estimate = kinematic.HybridReflectivity(xrr.refl_batch, 3.,
+                                                tolerance=0.)
+        approximation = estimate(THETA, WAVELENGTH, n, d, sigma)
+        tolerance = np.mean(estimate.error)
+        hybrid = kinematic.HybridReflectivity(xrr.refl_batch, 3.,
+                                              tolerance=tolerance)
+        result = hybrid(THETA, WAVELENGTH, n, d, sigma)
+        failed = estimate.error > tolerance
+        self.assertEqual(hybrid.fallbacks, 1)
+        np.testing.assert_array_equal(result[failed], expected[failed])
+        np.testing.assert_array_equal(result[~failed], approximation[~failed])
+        np.testing.assert_array_equal(hybrid.error[failed], 0.)
+        self.assertLessEqual(hybrid.max_error, tolerance)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the optical solutions shared by simulators.
+"""
+import unittest
+import numpy as np
+import pyxcel.engine.simulator.xrr_no_genx as xrr
+from pyxcel.engine.simulator.optical_cache import OpticalFieldCache
+
+WAVELENGTH = 1.5406
+THETA = np.linspace(0.05, 1.5, 150)
+DENSITY = np.array([0.0498, 0.0277, 0.0661, 0.])
+F = np.array([14.3+0.33j, 43.6+6.7j, 10.2+0.09j, 7.+0.01j],
+             dtype=np.complex64)
+D = np.array([0., 30., 100., 0.])
+SIGMA = np.array([3., 4., 5., 0.])
+
+
+class OpticalFieldCacheTest(unittest.TestCase):
+    """ test reflectivity reused from the electric field.
+    """
+
+    def test_reflectivity_from_field(self):
+        """ reflectivity of a solved field is the Parratt one
+        """
+        n = xrr.refractive_index(WAVELENGTH, DENSITY, F)[0]
+        cache = OpticalFieldCache()
+        cache.field("xrf", THETA, WAVELENGTH, n, D, SIGMA)
+        misses = cache.misses
+        reflectivity = cache.reflectivity("xrr", THETA[::3], WAVELENGTH, n,
+                                          D, SIGMA)
+        self.assertEqual(cache.misses, misses)
+        self.assertEqual(cache.hits, 1)
+        expected = xrr.refl(THETA[::3], WAVELENGTH, n, D, SIGMA)
+        np.testing.assert_allclose(reflectivity, expected, rtol=1e-12)
+
+    def test_ambient(self):
+        """ the field is not reused for an ambient with an index
+        """
+        density = DENSITY.copy()
+        density[-1] = 2.6e-5
+        n = xrr.refractive_index(WAVELENGTH, density, F)[0]
+        cache = OpticalFieldCache()
+        cache.field("xrf", THETA, WAVELENGTH, n, D, SIGMA)
+        cache.reflectivity("xrr", THETA, WAVELENGTH, n, D, SIGMA)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the evaluation of candidates in worker processes.
+"""
+import unittest
+import numpy as np
+import paf.data
+import pyxcel.engine.optimization.fom as fom
+import pyxcel.engine.optimization.parallel as parallel
+from pyxcel.engine.optimization.param_tab import ParaTab
+from pyxcel.engine.optimization.model import create_model
+from pyxcel.engine.optimization.model import initialize_simulators
+from pyxcel.engine.simulator.xrr_no_genx import XRRGenXSimulator
+from pyxcel.engine.modeling.entity import (StackData, LayerData,
+                                           InstrumentData, XRaySourceData,
+                                           XRRDetectorData)
+try:
+    import pyxcel.engine.optimization.multi_combined as multi_combined
+except (ImportError, NameError):
+    # the combiners report the evolution of the fit through Qt signals
+    multi_combined = None
+MAKE_DATA = paf.data.make_data
+
+TAB = ("#Parameter    Value    Fit    Min    Max    Error \n"
+       "L1.setD\t30\tTrue\t20\t40\t0\tNone\n"
+       "L2.setSigmar\t5\tTrue\t1\t8\t0\tg1\n"
+       "L3.setSigmar\t5\tTrue\t1\t8\t0\tg1\n"
+       "L2.setMass_density\t5.2\tTrue\t4\t6\t0\tNone\n"
+       "L3.setNumerical_density\t0.06\tTrue\t0.05\t0.07\t0\tNone\n")
+THETA = np.linspace(0.1, 3., 200)
+
+
+def create_stack():
+    """ three layers on silicon, f is calculated at the Cu K alpha
+    wavelength
+    """
+    layers = [LayerData("N2", "Amb", 0., 0.00125, 0., 0.),
+              LayerData("Si", "Sub", 0., 2.33, 0., 3.),
+              LayerData("HfO2", "L1", 0., 9.68, 30., 4.),
+              LayerData("TiN", "L2", 0., 5.2, 100., 5.),
+              LayerData("SiO2", "L3", 0., 2.2, 15., 3.)]
+    for layer in layers:
+        layer["mass_density"] = layer["mass_density"].value
+    stack = StackData("stack", layers[0], layers[1], layers[2:])
+    stack.wavelength = 1.5406
+    return stack
+
+
+class Problem(object):
+    """ combination of the figures of merit, as the problem of the scipy
+    combiner for a single simulation
+    """
+    def __init__(self):
+        """ initialization
+        """
+        self.fom_func = []
+        self.fom_factors = []
+        self.theta_array = []
+
+    def set_p(self, p):
+        """ set the number of fitted parameters
+        """
+        self.fom_func = [function(p) for function in self.fom_func]
+
+    def fom_batch(self, simulations, datas):
+        """ combined figure of merit of each row of simulations
+        """
+        foms = [function.batch(simulations, datas)
+                for function in self.fom_func]
+        combined = sum(factor*value
+                       for factor, value in zip(self.fom_factors, foms))
+        return combined, foms
+
+
+class FitFilter(object):
+    """ optimisation filter ready to be described
+    """
+    fit_stochio = False
+    fit_inst = False
+    adaptive_tolerance = 0.
+    kinematic_factor = 0.
+
+    def __init__(self):
+        """ initialization: the data set is the simulation of the tab
+        """
+        simulator = XRRGenXSimulator()
+        simulator["parameter"] = MAKE_DATA({"samplen": 50.}, composite=True)
+        instrument = InstrumentData(XRaySourceData(wavelength=1.5406,
+                                                   beamw=0.1),
+                                    XRRDetectorData(res=0.005, restype=1),
+                                    "XRR")
+        instrument["name"] = "XRR"
+        samples = MAKE_DATA([{"sample": create_stack()}])
+        self._data = {"samples": samples,
+                      "instruments": MAKE_DATA([instrument])}
+        problem = Problem()
+        problem.theta_array = [THETA]
+        problem.fom_factors = [1.]
+        self._items = {"FOM": problem, "simulators": MAKE_DATA([simulator]),
+                       "parameters": MAKE_DATA([simulator["parameter"]]),
+                       "fom_func": MAKE_DATA([fom.chi2bars])}
+        self.para_tab = ParaTab()
+        self.para_tab.string_value = TAB
+        self.data_set = fom.DataSet()
+        self.data_set.x = THETA
+        self.data_set.y = np.ones(len(THETA))
+        self.data_set.error = np.ones(len(THETA))
+        worker = parallel.ModelWorker(parallel.ModelDescription(self))
+        self.data_set.y = worker.model.simulate()
+        self.data_set.error = np.sqrt(self.data_set.y)
+
+    def __getitem__(self, key):
+        """ filter parameters
+        """
+        return self._items[key]
+
+    def get_data(self, port_name):
+        """ filter inputs
+        """
+        return self._data[port_name]
+
+
+def prepare(opti_filter, fit_filter, workers):
+    """ give to opti_filter the model of fit_filter, as run does before
+    optimize
+    """
+    for key in ("simulators", "parameters", "fom_func"):
+        opti_filter[key] = fit_filter[key]
+    opti_filter["workers"] = workers
+    opti_filter["pop_size"] = 2
+    opti_filter["max_gen"] = 3
+    opti_filter.para_tab.string_value = TAB
+    opti_filter._fit_stochio = False
+    opti_filter._fit_inst = False
+    # no report during the fit
+    opti_filter._refresh_speed = 10**6
+    samples = fit_filter.get_data("samples")
+    instruments = fit_filter.get_data("instruments")
+    # data of the input ports
+    opti_filter._data.update(samples=samples, instruments=instruments)
+    opti_filter._mod = create_model(samples, instruments,
+                                    opti_filter["simulators"])
+    problem = opti_filter["FOM"]
+    problem.fom_func = opti_filter["fom_func"].value
+    problem.set_p(len(opti_filter.para_tab.bounds))
+    problem.fom_factors = [1.]
+    problem.callback = opti_filter.report
+    problem.theta_array = [THETA]
+    opti_filter._fom = opti_filter.create_fom(problem.fom)
+    initialize_simulators(opti_filter.model, opti_filter["simulators"],
+                          opti_filter["parameters"], [THETA], samples,
+                          instruments, opti_filter)
+    opti_filter._data_set = fit_filter.data_set
+    nb_x = len(opti_filter.para_tab.bounds)
+    opti_filter._selected_error_set = np.zeros((opti_filter.pop_size,
+                                                nb_x + 1))
+    opti_filter._best_history = np.zeros((4, nb_x + 1))
+    opti_filter.para_tab.compile(opti_filter.model.script_dict)
+
+
+class ParallelTest(unittest.TestCase):
+    """ test the worker model and the pool against the serial FOM.
+    """
+
+    def setUp(self):
+        """ description of a fit and candidates inside the bounds of TAB
+        """
+        self.filter = FitFilter()
+        self.description = parallel.ModelDescription(self.filter)
+        random = np.random.RandomState(0)
+        low, high = np.transpose([(20, 40), (1, 8), (4, 6), (0.05, 0.07)])
+        self.candidates = low + (high-low)*random.rand(6, 4)
+
+    def test_worker(self):
+        """ fom of a worker is the fom of each candidate applied line by line
+        """
+        worker = parallel.ModelWorker(self.description)
+        combined, foms = worker.evaluate(self.candidates)
+        expected = []
+        for x in self.candidates:
+            tab = ParaTab()
+            tab.string_value = TAB
+            tab.apply_to_param(worker.model.script_dict, x)
+            expected.append(fom.chi2bars(4)(worker.model.simulate(),
+                                            self.filter.data_set))
+        self.assertTrue(np.all(np.isfinite(expected)))
+        np.testing.assert_allclose(combined, expected, rtol=1e-12)
+        np.testing.assert_allclose(foms, [expected], rtol=1e-12)
+
+    def test_pool(self):
+        """ fom of the pool is the fom of a single worker
+        """
+        expected = parallel.ModelWorker(self.description).evaluate(
+            self.candidates)
+        pool = parallel.PoolEvaluator(self.description, 2)
+        try:
+            combined, foms = pool.evaluate(self.candidates)
+        finally:
+            pool.close()
+        np.testing.assert_allclose(combined, expected[0], rtol=1e-12)
+        np.testing.assert_allclose(foms, expected[1], rtol=1e-12)
+
+    def test_stopped(self):
+        """ a stopped evaluation terminates the pool
+        """
+        # long enough to be stopped before the end
+        candidates = np.repeat(self.candidates, 700, axis=0)
+        pool = parallel.PoolEvaluator(self.description, 2)
+        combined, foms = pool.evaluate(candidates, lambda: True)
+        np.testing.assert_array_equal(combined, 1e20)
+        self.assertIsNone(foms)
+        combined, foms = pool.evaluate(self.candidates)
+        np.testing.assert_array_equal(combined, 1e20)
+        self.assertIsNone(foms)
+
+
+@unittest.skipIf(multi_combined is None, "PyQt is not installed")
+class InspyredPoolTest(unittest.TestCase):
+    """ test the pool evaluator of the inspyred combiner.
+    """
+
+    def test_evaluator(self):
+        """ fitness of the pool is the serial fitness
+        """
+        serial = multi_combined.OptimisationFilter()
+        prepare(serial, FitFilter(), 1)
+        pooled = multi_combined.OptimisationFilter()
+        prepare(pooled, FitFilter(), 2)
+        candidates = list(np.random.RandomState(0).rand(6, 4) *
+                          [20, 7, 2, 0.02] + [20, 1, 4, 0.05])
+        pooled._pool = parallel.PoolEvaluator(
+            parallel.ModelDescription(pooled), 2)
+        try:
+            fitness = pooled.pool_evaluator(candidates, {})
+        finally:
+            pooled._pool.close()
+        np.testing.assert_allclose(fitness, serial._fom(candidates, {}),
+                                   rtol=1e-12)
+
+    def test_best_simulation(self):
+        """ the simulation kept with the best candidate is its simulation
+        """
+        opti_filter = multi_combined.OptimisationFilter()
+        prepare(opti_filter, FitFilter(), 2)
+        opti_filter.optimize()
+        best = opti_filter._simu_best
+        opti_filter.para_tab.apply_to_param(opti_filter.model.script_dict,
+                                            opti_filter._x_best)
+        np.testing.assert_allclose(best, opti_filter.model.simulate(),
+                                   rtol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
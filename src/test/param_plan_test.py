@@ -0,0 +1,91 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the compiled parameter tab.
+"""
+import unittest
+import numpy as np
+from pyxcel.engine.optimization.param_tab import ParaTab
+
+#: L2 and L3 share a roughness
+FITTED_TAB = ("#Parameter    Value    Fit    Min    Max    Error \n"
+              "L1.setD\t30\tTrue\t20\t40\t0\tNone\n"
+              "L2.setSigmar\t5\tTrue\t1\t8\t0\tg1\n"
+              "L3.setSigmar\t5\tTrue\t1\t8\t0\tg1\n"
+              "L2.setMass_density\t5.2\tTrue\t4\t6\t0\tNone\n"
+              "L3.setNumerical_density\t0.06\tTrue\t0.05\t0.07\t0\tNone\n")
+#: with a not fitted line
+TAB = FITTED_TAB + "L3.setD\t15\tFalse\t10\t20\t0\tNone\n"
+KEYS = ("d", "sigmar", "numerical_density", "mass_density")
+
+
+def create_dict(repetition=1):
+    """ dictionary of a model with its parameters (substrate first), L2 and
+    L1 are repeated as in a substack
+    """
+    def column(substrate, l3, l2, l1, ambient):
+        """ value of each layer
+        """
+        return np.array([substrate, l3] + [l2, l1]*repetition + [ambient])
+    parameters = {"name": column("Sub", "L3", "L2", "L1", "Amb"),
+                  "material": column("Si", "SiO2", "TiN", "HfO2", "N2"),
+                  "d": column(0., 10., 100., 30., 0.),
+                  "sigmar": column(3., 3., 5., 4., 0.),
+                  "numerical_density": column(0.0499, 0.0662, 0.0960, 0.0831,
+                                              5.4e-5),
+                  "mass_density": column(2.33, 2.2, 5.2, 9.68, 0.00125)}
+    return {"parameters": parameters}
+
+
+class ParamPlanTest(unittest.TestCase):
+    """ test the compiled plan against the tab applied line by line.
+    """
+
+    def setUp(self):
+        """ population inside the bounds of TAB
+        """
+        random = np.random.RandomState(0)
+        low, high = np.transpose([(20, 40), (1, 8), (4, 6), (0.05, 0.07)])
+        self.xs = low + (high-low)*random.rand(5, 4)
+
+    def test_apply(self):
+        """ scattered vector is the vector applied line by line
+        """
+        for x in self.xs:
+            expected = create_dict()
+            tab = ParaTab()
+            tab.string_value = FITTED_TAB
+            tab.apply_to_param(expected, x)
+            result = create_dict()
+            tab = ParaTab()
+            tab.string_value = FITTED_TAB
+            tab.compile(result)
+            tab.apply_to_param(result, x)
+            for key in KEYS:
+                np.testing.assert_allclose(result["parameters"][key],
+                                           expected["parameters"][key],
+                                           rtol=1e-14, err_msg=key)
+
+    def test_batch(self):
+        """ each row of a batch is the applied vector
+        """
+        pyxcel_dict = create_dict(repetition=2)
+        tab = ParaTab()
+        tab.string_value = TAB
+        plan = tab.compile(pyxcel_dict)
+        self.assertTrue(plan.batchable)
+        population = plan.batch(self.xs)
+        np.testing.assert_array_equal(population["d"][:, 1], 15.)
+        # every repetition of a layer is fitted
+        np.testing.assert_array_equal(population["d"][:, 3], self.xs[:, 0])
+        np.testing.assert_array_equal(population["d"][:, 5], self.xs[:, 0])
+        for index, x in enumerate(self.xs):
+            plan.apply(x)
+            for key in KEYS:
+                np.testing.assert_array_equal(population[key][index],
+                                              pyxcel_dict["parameters"][key],
+                                              err_msg=key)
+
+
+if __name__ == "__main__":
+    unittest.main()
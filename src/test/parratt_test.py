@@ -0,0 +1,217 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the Parratt recursion and of the electric field.
+"""
+import unittest
+import numpy as np
+import pyxcel.engine.simulator.xrr_no_genx as xrr
+import paf.data
+import pyxcel.engine.gixrf.el_field_no_genx as el_field
+from pyxcel.engine.simulator.optical_cache import OpticalFieldCache
+from pyxcel.engine.simulator.adaptive import AdaptiveSampler
+from pyxcel.engine.modeling.entity import (StackData, LayerData,
+                                           InstrumentData, XRaySourceData,
+                                           XRRDetectorData)
+MAKE_DATA = paf.data.make_data
+
+WAVELENGTH = 1.5406
+THETA = np.linspace(0.05, 4, 400)
+REPETITION = 20
+#: periodic blocks (start, period, repetition) of the stack
+BLOCKS = [(1, 2, REPETITION)]
+FIELDS = ("Et", "Er", "Ht", "Hr", "Xs", "Xp")
+
+
+def create_stack():
+    """ substrate, REPETITION periods of two layers, a cap and the ambient
+
+    :return: index of refraction, thickness and roughness (substrate first)
+    """
+    n = np.array([1-7.6e-6+1.7e-7j] +
+                 [1-2.0e-5+1.3e-6j, 1-1.1e-5+6.0e-7j] * REPETITION +
+                 [1-7.0e-6+1.0e-7j, 1.+0j])
+    d = np.array([0.] + [20., 35.] * REPETITION + [15., 0.])
+    sigma = np.array([3.] + [4., 5.] * REPETITION + [3., 0.])
+    return n, d, sigma
+
+
+class Filter(object):
+    """ filter without option for the simulators
+    """
+    def __getitem__(self, key):
+        """ no parameter
+        """
+        raise KeyError(key)
+
+
+def create_simulator():
+    """ initialized XRR simulator of two layers on silicon
+    """
+    layers = [LayerData("N2", "Amb", 0., 0.00125, 0., 0.),
+              LayerData("Si", "Sub", 0., 2.33, 0., 3.),
+              LayerData("HfO2", "L1", 0., 9.68, 30., 4.),
+              LayerData("TiN", "L2", 0., 5.2, 100., 5.)]
+    for layer in layers:
+        layer["mass_density"] = layer["mass_density"].value
+    stack = StackData("stack", layers[0], layers[1], layers[2:])
+    stack.wavelength = WAVELENGTH
+    instrument = InstrumentData(XRaySourceData(wavelength=WAVELENGTH),
+                                XRRDetectorData(res=0.005), "XRR")
+    simulator = xrr.XRRGenXSimulator(MAKE_DATA(THETA), stack,
+                                     instrument=instrument)
+    simulator["parameter"] = MAKE_DATA({"samplen": 50.}, composite=True)
+    simulator.initialization(Filter())
+    return simulator
+
+
+class ParrattTest(unittest.TestCase):
+    """ test the Parratt engines against the plain recursion.
+    """
+
+    def test_periodic_blocks(self):
+        """ periods computed once are the expanded recursion
+        """
+        n, d, sigma = create_stack()
+        np.testing.assert_allclose(
+            xrr.refl(THETA, WAVELENGTH, n, d, sigma, BLOCKS),
+            xrr.refl(THETA, WAVELENGTH, n, d, sigma), rtol=6.5e-14)
+        field = el_field.ElField(THETA[:100], WAVELENGTH, n, d, sigma,
+                                 BLOCKS)
+        expected = el_field.ElField(THETA[:100], WAVELENGTH, n, d, sigma)
+        for name in FIELDS:
+            np.testing.assert_allclose(getattr(field, name),
+                                       getattr(expected, name),
+                                       rtol=6.5e-14, atol=1e-300,
+                                       err_msg=name)
+
+    def test_broken_period(self):
+        """ a block which is no longer periodic is expanded
+        """
+        n, d, sigma = create_stack()
+        d[5] += 1.
+        np.testing.assert_allclose(
+            xrr.refl(THETA, WAVELENGTH, n, d, sigma, BLOCKS),
+            xrr.refl(THETA, WAVELENGTH, n, d, sigma), rtol=1e-15)
+
+    def test_incremental_parratt(self):
+        """ recursion resumed under a changed upper layer is the whole one
+        """
+        n, d, sigma = create_stack()
+        parratt = xrr.IncrementalParratt()
+        parratt(THETA, WAVELENGTH, n, d, sigma)
+        for key, array in (("d", d), ("sigma", sigma), ("n", n)):
+            array[-3] *= 1.01
+            np.testing.assert_allclose(
+                parratt(THETA, WAVELENGTH, n, d, sigma)[0],
+                xrr.refl(THETA, WAVELENGTH, n, d, sigma), rtol=1e-13,
+                err_msg=key)
+        self.assertEqual(parratt.hits, 3)
+        self.assertEqual(parratt.misses, 1)
+
+    def test_simulator(self):
+        """ counters of the simulator are the ones of the recursion used
+        """
+        simulator = create_simulator()
+        parratt = simulator.parratt
+        simulator.simulate()
+        # top layer (substrate first)
+        simulator.model_parameters["d"][-2] += 1.
+        simulator.simulate()
+        self.assertEqual((parratt.hits, parratt.misses), (1, 1))
+        cache = OpticalFieldCache()
+        simulator.optical_cache = cache
+        self.assertIs(simulator.parratt, cache.parratt)
+        simulator.simulate()
+        simulator.model_parameters["d"][-2] += 1.
+        simulator.simulate()
+        self.assertEqual((cache.parratt.hits, cache.parratt.misses), (1, 1))
+        self.assertEqual((parratt.hits, parratt.misses), (1, 1))
+        simulator.adaptive_sampler = AdaptiveSampler()
+        self.assertIsNone(simulator.parratt)
+
+    def test_incremental_field(self):
+        """ field resumed under a changed upper layer is the whole one
+        """
+        n, d, sigma = create_stack()
+        theta = THETA[:100]
+        field = el_field.IncrementalElField()
+        field(theta, WAVELENGTH, n, d, sigma)
+        for key, array in (("d", d), ("sigma", sigma), ("n", n)):
+            array[-3] *= 1.01
+            result = field(theta, WAVELENGTH, n, d, sigma)
+            expected = el_field.ElField(theta, WAVELENGTH, n, d, sigma)
+            for name in FIELDS:
+                np.testing.assert_allclose(getattr(result, name),
+                                           getattr(expected, name),
+                                           rtol=1e-13, atol=1e-300,
+                                           err_msg=key + name)
+        self.assertEqual(field.hits, 3)
+        self.assertEqual(field.misses, 1)
+
+    def test_reflectivity_jacobian(self):
+        """ analytic derivatives are the central finite differences
+        """
+        n, d, sigma = [array[-6:] for array in create_stack()]
+        reflectivity, jacobian = xrr.refl_jacobian(THETA, WAVELENGTH, n, d,
+                                                   sigma)
+        np.testing.assert_allclose(reflectivity,
+                                   xrr.refl(THETA, WAVELENGTH, n, d, sigma),
+                                   rtol=1e-13)
+        # key, step and direction of n, d and sigma
+        directions = (("d", 1e-4, 0., 1., 0.),
+                      ("sigmar", 1e-4, 0., 0., 1.),
+                      ("n", 1e-9, 1., 0., 0.),
+                      ("n", 1e-9, 1.0j, 0., 0.))
+        for index in range(len(n)):
+            layer = np.arange(len(n)) == index
+            for key, step, dn, dd, dsigma in directions:
+                upper = xrr.refl(THETA, WAVELENGTH, n+step*dn*layer,
+                                 d+step*dd*layer, sigma+step*dsigma*layer)
+                lower = xrr.refl(THETA, WAVELENGTH, n-step*dn*layer,
+                                 d-step*dd*layer, sigma-step*dsigma*layer)
+                difference = (upper-lower)/(2*step)
+                derivative = jacobian[key][index]
+                if key == "n":
+                    derivative = np.real(derivative*dn)
+                scale = max(np.max(np.abs(difference)), 1e-300)
+                self.assertLess(np.max(np.abs(derivative-difference))/scale,
+                                1e-5, msg="%s %d" % (key, index))
+
+    def test_field_tangent(self):
+        """ tangent of the field is the central finite differences
+        """
+        n, d, sigma = [array[-6:] for array in create_stack()]
+        theta = THETA[:100]
+        nb_layer = len(n)
+        # one direction per layer for the real and imaginary part of n, d
+        # and sigma
+        dn = np.zeros((4*nb_layer, nb_layer), dtype=np.complex128)
+        dd = np.zeros((4*nb_layer, nb_layer))
+        dsigma = np.zeros((4*nb_layer, nb_layer))
+        for index in range(nb_layer):
+            dn[index, index] = 1e-6
+            dn[nb_layer+index, index] = 1e-7j
+            dd[2*nb_layer+index, index] = 1.
+            dsigma[3*nb_layer+index, index] = 1.
+        field = el_field.ElField(theta, WAVELENGTH, n, d, sigma)
+        tangent = field.tangent(dn, dd, dsigma)
+        step = 1e-4
+        for index in range(4*nb_layer):
+            upper = el_field.ElField(theta, WAVELENGTH, n+step*dn[index],
+                                     d+step*dd[index],
+                                     sigma+step*dsigma[index])
+            lower = el_field.ElField(theta, WAVELENGTH, n-step*dn[index],
+                                     d-step*dd[index],
+                                     sigma-step*dsigma[index])
+            for name in FIELDS:
+                difference = (getattr(upper, name) -
+                              getattr(lower, name))/(2*step)
+                scale = max(np.max(np.abs(difference)), 1e-12)
+                self.assertLess(
+                    np.max(np.abs(tangent[name][index]-difference))/scale,
+                    1e-5, msg="%s %d" % (name, index))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the tabulated atomic scattering factors.
+"""
+import unittest
+import numpy as np
+import xraylib
+import pyxcel.engine.modeling.tools as tools
+from pyxcel.engine.modeling.entity import XraylibPhysicalComputer
+
+MATERIALS = ["SiO2", "HfO2", "TiN0.8", "Al2O3", "Si", "Ga1In2As3"]
+WAVELENGTHS = (1.5406, 0.7093)
+
+
+def xraylib_f(material, wavelength):
+    """ structure factor summed element by element from xraylib
+    """
+    energy = tools.wavelength_to_in_energy(wavelength)/1000.
+    compound = xraylib.CompoundParser(material)
+    result = 0j
+    for atomic_number, atoms in zip(compound["Elements"],
+                                    compound["nAtoms"]):
+        f0, f_re, f_im = xraylib.Atomic_Factors(atomic_number, energy, 0., 1.)
+        result += atoms/compound["nAtomsAll"]*(f0 + f_re - 1.0j*f_im)
+    return result
+
+
+class PhysicalComputerTest(unittest.TestCase):
+    """ test structure factors of the table against xraylib.
+    """
+
+    def test_compute_f(self):
+        """ structure factor of a material is the one of xraylib
+        """
+        for wavelength in WAVELENGTHS:
+            computer = XraylibPhysicalComputer(wavelength)
+            for material in MATERIALS:
+                self.assertAlmostEqual(computer.compute_f(material),
+                                       xraylib_f(material, wavelength),
+                                       delta=1e-10)
+
+    def test_compute_f_many(self):
+        """ structure factors of a matrix of materials are the ones of each
+        material
+        """
+        computer = XraylibPhysicalComputer(1.5406)
+        expected = [computer.compute_f(material) for material in MATERIALS]
+        matrix, elements = tools.FORMULAS.stoichio_matrix(MATERIALS)
+        atomic_numbers = [xraylib.SymbolToAtomicNumber(element)
+                          for element in elements]
+        np.testing.assert_allclose(computer.compute_f_many(matrix, elements),
+                                   expected, rtol=1e-12)
+        np.testing.assert_allclose(
+            computer.compute_f_many(matrix, atomic_numbers), expected,
+            rtol=1e-12)
+        np.testing.assert_allclose(computer.compute_f_list(MATERIALS),
+                                   expected, rtol=1e-12)
+
+    def test_f_table(self):
+        """ one table per energy is shared by every computer, the oldest
+        tables are dropped
+        """
+        table = XraylibPhysicalComputer(1.5406).f_table
+        self.assertIs(XraylibPhysicalComputer(1.5406).f_table, table)
+        self.assertFalse(table.flags.writeable)
+        self.assertAlmostEqual(table[14], xraylib_f("Si", 1.5406),
+                               delta=1e-12)
+        for index in range(XraylibPhysicalComputer.max_f_tables):
+            XraylibPhysicalComputer(0.5+0.1*index).f_table
+        self.assertIsNot(XraylibPhysicalComputer(1.5406).f_table, table)
+
+
+if __name__ == "__main__":
+    unittest.main()
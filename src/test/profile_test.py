@@ -0,0 +1,152 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the concentration profiles.
+"""
+import unittest
+import numpy as np
+import periodictable
+import pyxcel.engine.modeling.profile as profile
+import pyxcel.engine.modeling.tools as tools
+from pyxcel.engine.modeling.entity import (StackData, LayerData,
+                                           LayerProfileData,
+                                           XraylibPhysicalComputer)
+from pyxcel.engine.optimization.param_tab import ParaTab
+from pyxcel.engine.simulator.xrr_no_genx import resolve_parameter
+
+
+def create_profile(type_="num"):
+    """ TiN/SiO2 interface of 10 sublayers with a HfO2 gaussian
+    """
+    layer = LayerProfileData(name="mix", d=20., sigmar=4.)
+    layer.nb_lay = 10
+    if type_ == "num":
+        layer["densities"] = profile.LinearDensityProfile(0.066, 0.096)
+    else:
+        layer["densities"] = profile.LinearDensityProfile(2.2, 5.2, "mass")
+    layer.add_computer(profile.GaussianInterface("TiN"))
+    layer.add_computer(profile.AntiGaussianInterface("SiO2"))
+    layer.add_computer(profile.Gaussian("HfO2"))
+    layer.phy_cmp = XraylibPhysicalComputer(1.5406)
+    return layer
+
+
+def create_stack():
+    """ HfO2 layer on the profile of create_profile on silicon
+    """
+    layers = [LayerData("N2", "Amb", 0., 0.00125, 0., 0.),
+              LayerData("Si", "Sub", 0., 2.33, 0., 3.),
+              LayerData("HfO2", "L1", 0., 9.68, 30., 4.)]
+    stack = StackData("stack", layers[0], layers[1],
+                      layers[2:] + [create_profile()])
+    stack.wavelength = 1.5406
+    return stack
+
+
+class ProfileConcTest(unittest.TestCase):
+    """ test the stoichio matrix of a profile against its formulas.
+    """
+
+    def test_stoichio_matrix(self):
+        """ rows are the normalized stoichiometries of the formula of each
+        sublayer
+        """
+        layer = create_profile()
+        matrix, elements = layer["materials"].stoichio_matrix(layer.x)
+        self.assertEqual(matrix.shape, (10, 5))
+        self.assertEqual(sorted(elements), ["Hf", "N", "O", "Si", "Ti"])
+        np.testing.assert_allclose(matrix.sum(axis=1), 1., rtol=1e-12)
+        materials = layer["materials"](layer.x)
+        self.assertEqual(materials, layer["materials"].materials(matrix))
+        for row, material in zip(matrix, materials):
+            parsed = tools.Formula(material)
+            column = [elements.index(str(element))
+                      for element in parsed.elements]
+            # formulas keep 6 digits
+            np.testing.assert_allclose(parsed.stoichios_norm, row[column],
+                                       atol=2e-6, err_msg=material)
+        conc = layer.element_conc()
+        for index, element in enumerate(elements):
+            np.testing.assert_array_equal(conc[element], matrix[:, index])
+
+    def test_computer(self):
+        """ columns follow the computers of the profile
+        """
+        layer = create_profile()
+        layer.remove_computer(2)
+        matrix, elements = layer["materials"].stoichio_matrix(layer.x)
+        self.assertEqual(sorted(elements), ["N", "O", "Si", "Ti"])
+        self.assertEqual(matrix.shape, (10, 4))
+
+    def test_to_param(self):
+        """ densities and structure factors are the ones of the formulas
+        """
+        for type_ in ("num", "mass"):
+            layer = create_profile(type_)
+            param = layer.to_param()
+            # molar mass of the formula as written
+            mass_factors = np.array(
+                [periodictable.formula(material).mass
+                 for material in param["materials"]])*1e24/tools.Avogadro_const
+            np.testing.assert_allclose(param["mass_densities"],
+                                       param["num_densities"]*mass_factors,
+                                       rtol=1e-12, err_msg=type_)
+        computer = layer.phy_cmp
+        for sublayer in layer.to_stack():
+            material = tools.Formula(sublayer["material"].value).normalized
+            self.assertAlmostEqual(sublayer["f"].value,
+                                   computer.compute_f(material),
+                                   delta=1e-4)
+
+
+class ToParametersTest(unittest.TestCase):
+    """ test the sublayers written in parameters against the parameters of
+    the expanded stack.
+    """
+
+    def test_to_parameters(self):
+        """ sublayers written in the parameters are the ones of to_stack
+        """
+        stack = create_stack()
+        layer = stack.real_value["layers"][1]
+        parameters = resolve_parameter(stack)
+        names = list(parameters["name"])
+        start = names.index("mix_start")
+        end = names.index("mix_end")
+        layer["densities"]["end"] = 0.08
+        layer["materials"]["computers"][2]["kwargs"]["amplitude"] = 0.1
+        layer.to_parameters(parameters, end, start)
+        stack.invalidate_layers(layer)
+        expected = resolve_parameter(stack)
+        self.assertEqual(list(parameters["material"]),
+                         list(expected["material"]))
+        for key in ("d", "numerical_density", "sigmar"):
+            np.testing.assert_allclose(parameters[key], expected[key],
+                                       rtol=1e-12, err_msg=key)
+        np.testing.assert_allclose(
+            parameters["mass_density"][end:start+1],
+            layer.to_param()["mass_densities"][::-1], rtol=1e-12)
+        # sublayers fill the profile
+        self.assertAlmostEqual(np.sum(parameters["d"][end:start+1]), 20.,
+                               delta=1e-12)
+
+    def test_recalculator(self):
+        """ recalculator of the parameter tab writes the sublayers and
+        invalidates the expanded layers of the profile
+        """
+        stack = create_stack()
+        layer = stack.real_value["layers"][1]
+        parameters = resolve_parameter(stack)
+        recalculator = ParaTab().profile_recalculator(
+            {"stack": stack, "parameters": parameters}, "mix")
+        layers = stack.expanded_layers
+        layer["densities"]["start"] = 0.05
+        recalculator()
+        self.assertIsNot(stack.expanded_layers, layers)
+        np.testing.assert_allclose(
+            parameters["numerical_density"],
+            resolve_parameter(stack)["numerical_density"], rtol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the resolution kernels against the dense GenX convolutions.
+"""
+import unittest
+import numpy as np
+import pyxcel.engine.simulator.resolution as resolution
+
+Q = np.linspace(0.1, 8, 2000)
+DQ = 0.02
+
+
+def intensity(q):
+    """ oscillating decreasing intensity
+    """
+    return np.exp(-q)*(1+0.3*np.sin(20*q))
+
+
+def trapz(y, x=None, axis=-1):
+    """ trapezoidal rule (numpy.trapz is not in every numpy version)
+    """
+    y = np.moveaxis(y, axis, -1)
+    if x is None:
+        step = 1.
+    else:
+        step = np.diff(np.moveaxis(x, axis, -1), axis=-1)
+    return np.sum(step*(y[..., 1:]+y[..., :-1])/2., axis=-1)
+
+
+def dense_fast(q, values, dQ, range_=3):
+    """ GenX constant resolution convolution
+    """
+    Qstep = q[1]-q[0]
+    resvector = np.arange(-range_*dQ, range_*dQ+Qstep, Qstep)
+    weight = 1/np.sqrt(2*np.pi)/dQ*np.exp(-(resvector)**2/(dQ)**2/2)
+    padded = np.r_[np.ones(resvector.shape)*values[0], values,
+                   np.ones(resvector.shape)*values[-1]]
+    result = np.convolve(padded, weight/weight.sum(), mode="same")
+    return result[resvector.shape[0]:-resvector.shape[0]]
+
+
+def dense_var(q, values, dQ):
+    """ GenX varying resolution convolution
+    """
+    weight = 1/np.sqrt(2*np.pi)/dQ*np.exp(-(q[:, np.newaxis]-q)**2/dQ**2/2)
+    return (trapz(values[:, np.newaxis]*weight, axis=0) /
+            trapz(weight, axis=0))
+
+
+def dense_vector(q, dQ, points, range_=3):
+    """ GenX resolution vector convolution of intensity
+    """
+    Qstep = 2*range_*dQ/points
+    Qres = q+(np.arange(points)-(points-1)/2)[:, np.newaxis]*Qstep
+    weight = 1/np.sqrt(2*np.pi)/dQ*np.exp(-(q-Qres)**2/dQ**2/2)
+    return (trapz(intensity(Qres)*weight, x=Qres, axis=0) /
+            trapz(weight, x=Qres, axis=0))
+
+
+class ResolutionTest(unittest.TestCase):
+    """ test the sparse, FFT and Gauss-Hermite kernels.
+    """
+
+    def test_fast_kernel(self):
+        """ band operator is the padded GenX convolution
+        """
+        kernel = resolution.fast_kernel(Q, DQ)
+        np.testing.assert_allclose(kernel.convolute(intensity(Q)),
+                                   dense_fast(Q, intensity(Q), DQ),
+                                   rtol=1e-12)
+
+    def test_var_kernel(self):
+        """ truncated band operator is the dense GenX convolution
+        """
+        dQ = 0.01+0.01*Q/8
+        kernel = resolution.var_kernel(Q, dQ)
+        np.testing.assert_allclose(kernel.convolute(intensity(Q)),
+                                   dense_var(Q, intensity(Q), dQ),
+                                   rtol=1e-12)
+
+    def test_vector_kernel(self):
+        """ resolution vector operator is the GenX trapezoidal integration
+        """
+        kernel = resolution.vector_kernel(Q, DQ, 5, 2)
+        np.testing.assert_allclose(kernel.convolute(intensity(kernel.grid)),
+                                   dense_vector(Q, DQ, 5, 2), rtol=1e-12)
+
+    def test_population(self):
+        """ each row of a population is convoluted alone
+        """
+        kernel = resolution.fast_kernel(Q, DQ)
+        population = np.vstack((intensity(Q), 2*intensity(Q)))
+        np.testing.assert_allclose(kernel.convolute(population),
+                                   [kernel.convolute(row)
+                                    for row in population], rtol=1e-14)
+
+    def test_hermite_polynomial(self):
+        """ Gauss-Hermite quadrature is exact for polynomials of degree lower
+        than twice the number of nodes
+        """
+        kernel = resolution.hermite_kernel(Q, DQ, 3)
+        # moments of the gaussian: E[(q+x)**4] = q**4+6 q**2 dQ**2+3 dQ**4
+        np.testing.assert_allclose(kernel.convolute(kernel.grid**4),
+                                   Q**4 + 6*Q**2*DQ**2 + 3*DQ**4,
+                                   rtol=1e-12)
+
+    def test_hermite_accuracy(self):
+        """ Gauss-Hermite converges to a fine uniform resolution vector
+        """
+        reference = resolution.vector_kernel(Q, DQ, 401, 6)
+        reference = reference.convolute(intensity(reference.grid))
+        kernel = resolution.hermite_kernel(Q, DQ, 5)
+        np.testing.assert_allclose(kernel.convolute(intensity(kernel.grid)),
+                                   reference, rtol=1e-8)
+
+    def test_fft_uniform(self):
+        """ FFT convolution of a uniform grid is the band operator
+        """
+        kernel = resolution.fft_kernel(Q, 0.05)
+        population = np.vstack((intensity(Q), 2*intensity(Q)))
+        np.testing.assert_allclose(
+            kernel.convolute(population),
+            resolution.fast_kernel(Q, 0.05).convolute(population),
+            rtol=1e-11)
+
+    def test_fft_resampled(self):
+        """ FFT convolution of a non uniform grid stays within its
+        interpolation error bound
+        """
+        q = np.sort(np.concatenate((np.linspace(0.1, 2, 500),
+                                    np.geomspace(2.01, 8, 300))))
+        kernel = resolution.fft_kernel(q, 0.05)
+        fine = np.linspace(0.1, 8, 200001)
+        reference = np.interp(q, fine, resolution.fft_kernel(
+            fine, 0.05).convolute(intensity(fine)))
+        error = np.max(np.abs(kernel.convolute(intensity(kernel.grid)) -
+                              reference))
+        self.assertGreater(kernel.error_bound, 0.)
+        self.assertLess(error, kernel.error_bound*np.max(intensity(fine)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the field shared by the XRF simulators of several lines.
+"""
+import unittest
+import numpy as np
+import paf.data
+import pyxcel.engine.simulator.xrf_no_genx as xrf
+from pyxcel.engine.modeling.entity import (StackData, LayerData,
+                                           InstrumentData, XRaySourceData,
+                                           XRFDetectorData)
+MAKE_DATA = paf.data.make_data
+
+THETA = np.linspace(0.05, 1., 50)
+LINES = (("Ti", "KA1_LINE"), ("Si", "KA1_LINE"), ("O", "KA1_LINE"))
+
+
+def create_stack():
+    """ three layers on silicon
+    """
+    layers = [LayerData("N2", "Amb", 0., 0.00125, 0., 0.),
+              LayerData("Si", "Sub", 0., 2.33, 0., 3.),
+              LayerData("HfO2", "L1", 0., 9.68, 30., 4.),
+              LayerData("TiN", "L2", 0., 5.2, 100., 5.),
+              LayerData("SiO2", "L3", 0., 2.2, 15., 3.)]
+    for layer in layers:
+        layer["mass_density"] = layer["mass_density"].value
+    stack = StackData("stack", layers[0], layers[1], layers[2:])
+    stack.wavelength = 1.5406
+    return stack
+
+
+class Filter(object):
+    """ filter without option for the simulators
+    """
+    def __getitem__(self, key):
+        """ no parameter
+        """
+        raise KeyError(key)
+
+
+def create_simulators(theta_array=THETA):
+    """ initialized XRF simulator of each line of LINES
+    """
+    simulators = []
+    for element, line in LINES:
+        instrument = InstrumentData(XRaySourceData(wavelength=1.5406),
+                                    XRFDetectorData(), "XRF")
+        simulator = xrf.XRFGenXSimulator(MAKE_DATA(theta_array),
+                                         create_stack(), instrument)
+        value = xrf.Line()
+        value["line"] = "xraylib." + line
+        value["material"] = element
+        simulator["parameter"] = MAKE_DATA({"config": "theta-2theta",
+                                            "line": value, "samplen": 50},
+                                           composite=True)
+        simulator.initialization(Filter())
+        simulators.append(simulator)
+    return simulators
+
+
+class SharedElFieldTest(unittest.TestCase):
+    """ test shared simulators against independent simulators.
+    """
+
+    def test_share(self):
+        """ simulators on the same angles share one field
+        """
+        simulators = create_simulators()
+        simulators.append(create_simulators(THETA[::2])[0])
+        xrf.share_elfield(simulators)
+        shared = simulators[0].shared_elfield
+        self.assertIsNotNone(shared)
+        for simulator in simulators[1:3]:
+            self.assertIs(simulator.shared_elfield, shared)
+        self.assertIsNone(simulators[3].shared_elfield)
+
+    def test_simulate(self):
+        """ lines reuse the field of the first line until the layers
+        change
+        """
+        simulators = create_simulators()
+        xrf.share_elfield(simulators)
+        shared = simulators[0].shared_elfield
+        expected = create_simulators()
+        for change in (None, ("d", 3, 90.), ("sigmar", 2, 6.),
+                       ("numerical_density", 2, 0.08)):
+            if change is not None:
+                key, index, value = change
+                for simulator in simulators + expected:
+                    simulator.model_parameters[key][index] = value
+            for simulator, alone in zip(simulators, expected):
+                np.testing.assert_allclose(simulator.simulate(),
+                                           alone.simulate(), rtol=1e-12)
+        self.assertEqual((shared.hits, shared.misses), (8, 4))
+        for simulator in simulators:
+            simulator.simulate()
+        self.assertEqual((shared.hits, shared.misses), (11, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the expanded layers of a stack.
+"""
+import unittest
+import pyxcel.engine.modeling.profile as profile
+from pyxcel.engine.modeling.entity import (StackData, LayerData,
+                                           LayerProfileData)
+
+
+def create_stack():
+    """ HfO2/TiN bilayer and a graded SiO2/TiN interface on silicon
+    """
+    layers = [LayerData("N2", "Amb", 0., 0.00125, 0., 0.),
+              LayerData("Si", "Sub", 0., 2.33, 0., 3.),
+              LayerData("HfO2", "L1", 0., 9.68, 30., 4.),
+              LayerData("TiN", "L2", 0., 5.2, 100., 5.)]
+    mix = LayerProfileData(name="mix", d=2.)
+    mix.nb_lay = 4
+    mix["densities"] = profile.LinearDensityProfile(0.066, 0.096)
+    mix.add_computer(profile.GaussianInterface("TiN"))
+    mix.add_computer(profile.AntiGaussianInterface("SiO2"))
+    stack = StackData("stack", layers[0], layers[1], layers[2:] + [mix])
+    stack.wavelength = 1.5406
+    return stack
+
+
+class StackDataTest(unittest.TestCase):
+    """ test the expanded layers kept between reads.
+    """
+
+    def test_read(self):
+        """ layers are expanded once
+        """
+        stack = create_stack()
+        layers = stack["layers"]
+        self.assertEqual(len(layers), 6)
+        self.assertIs(stack["layers"], layers)
+        self.assertIs(stack.expanded_layers, stack.expanded_layers)
+        version = stack.layers_version
+        stack.expanded_layers
+        self.assertEqual(stack.layers_version, version)
+        self.assertRaises(TypeError, layers.append, LayerData())
+        self.assertRaises(TypeError, layers.__delitem__, 0)
+
+    def test_profile(self):
+        """ only the invalidated profile is expanded again
+        """
+        stack = create_stack()
+        mix = stack.real_value["layers"][2]
+        sublayers = stack.expanded_layers[2:]
+        version = stack.layers_version
+        stack.del_substack(0)
+        self.assertGreater(stack.layers_version, version)
+        self.assertEqual(stack.expanded_layers[2:], sublayers)
+        mix.nb_lay = 8
+        stack.invalidate_layers(mix)
+        self.assertEqual(len(stack.expanded_layers), 10)
+
+    def test_repetition(self):
+        """ a repetition is expanded after its creation
+        """
+        stack = create_stack()
+        sublayers = stack.expanded_layers[2:]
+        stack.create_substack(0, 1, 3)
+        layers = stack.expanded_layers
+        self.assertEqual(len(layers), 10)
+        self.assertEqual([layer["name"].value for layer in layers[:6]],
+                         ["L1", "L2"] * 3)
+        self.assertEqual(layers[6:], sublayers)
+        stack.del_substack(0)
+        self.assertEqual(len(stack.expanded_layers), 6)
+
+    def test_periodic_blocks(self):
+        """ repeated substacks are blocks of the expanded layers
+        """
+        stack = create_stack()
+        self.assertEqual(stack.periodic_blocks, [])
+        stack.create_substack(0, 1, 3)
+        self.assertEqual(stack.periodic_blocks, [(0, 2, 3)])
+        stack.del_substack(0)
+        self.assertEqual(stack.periodic_blocks, [])
+
+    def test_computer(self):
+        """ sublayers are computed again at an other energy
+        """
+        stack = create_stack()
+        sublayers = stack.expanded_layers[2:]
+        stack.wavelength = 1.5406
+        self.assertEqual(stack.expanded_layers[2:], sublayers)
+        stack.wavelength = 0.7093
+        sublayers = stack.expanded_layers[2:]
+        self.assertEqual(len(sublayers), 4)
+        expected = [stack.physical_computer.compute_f(layer["material"])
+                    for layer in sublayers]
+        for layer, f in zip(sublayers, expected):
+            self.assertAlmostEqual(layer["f"].value, f, delta=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the chemical formula service.
+"""
+import re
+import unittest
+import numpy as np
+import periodictable
+import xraylib
+import pyxcel.engine.modeling.tools as tools
+
+FORMULAS = ["SiO2", "HfO2", "TiN", "Si", "Al2O3", "TiN0.8", "Ga1In2As3"]
+#: formulas with stochio markers and values of their fitted coefficients
+MARKED = [("Hf_0.5Si_0.5O2", [0.3, 0.7]),
+          ("Si(Ti_2O_3)_2N", [1.5, 2.5, 3.]),
+          ("((HfO_2)_3Si)_0.5Al2", [1.8, 2., 0.25]),
+          ("Ga(In2As_3)2", [2.5])]
+
+
+def rewritten(marked_formula, values):
+    """ formula with each marked coefficient replaced by its value, as the
+    stochio markers were rewritten with regular expressions
+    """
+    regex = re.compile(r"_\d*\.?\d*")
+    for value in values:
+        marked_formula = regex.sub(str(value), marked_formula, 1)
+    return marked_formula
+
+
+def parsed_stoichios(formula, atomic_numbers):
+    """ number of atom of each element of formula parsed by xraylib
+    """
+    parsed = xraylib.CompoundParser(formula)
+    atoms = dict(zip(parsed["Elements"], parsed["nAtoms"]))
+    return [atoms.get(atomic_number, 0.) for atomic_number in atomic_numbers]
+
+
+class FormulaServiceTest(unittest.TestCase):
+    """ test parsed formulas against periodictable.
+    """
+
+    def test_molar_mass(self):
+        """ molar mass of the normalized formula is the one of
+        periodictable
+        """
+        # elements are sorted by atomic number
+        normalized = {"SiO2": "O0.666667Si0.333333",
+                      "Al2O3": "O0.600000Al0.400000",
+                      "TiN0.8": "N0.444444Ti0.555556",
+                      "Si": "Si1.000000"}
+        service = tools.FormulaService()
+        for formula, expected in normalized.items():
+            self.assertEqual(service.get(formula).normalized, expected)
+            self.assertAlmostEqual(service.get(formula).molar_mass,
+                                   periodictable.formula(expected).mass,
+                                   delta=1e-12)
+
+    def test_densities(self):
+        """ mass and numerical densities are inverse transformations
+        """
+        for formula in FORMULAS:
+            mass_density = tools.calc_mass_density(0.05, formula)
+            self.assertAlmostEqual(
+                tools.calc_num_density(mass_density, formula), 0.05,
+                delta=1e-15)
+        np.testing.assert_allclose(
+            tools.FORMULAS.mass_factors(FORMULAS),
+            [tools.calc_mass_density(1., formula) for formula in FORMULAS],
+            rtol=1e-14)
+
+    def test_stoichio_matrix(self):
+        """ number of atom of each element in each formula
+        """
+        service = tools.FormulaService()
+        matrix, elements = service.stoichio_matrix(
+            ["SiO2", "HfO2", "Hf0.5Si0.5O2"])
+        self.assertEqual(elements, ["O", "Si", "Hf"])
+        np.testing.assert_allclose(matrix, [[2., 1., 0.], [2., 0., 1.],
+                                            [2., 0.5, 0.5]], rtol=1e-12)
+        matrix, _ = service.stoichio_matrix(FORMULAS, normalized=True)
+        np.testing.assert_allclose(matrix.sum(axis=1), 1., rtol=1e-12)
+
+    def test_cache(self):
+        """ each formula is parsed once, markers are ignored
+        """
+        service = tools.FormulaService(maxsize=2)
+        service.get("Si_O_2")
+        service.get("SiO2")
+        self.assertEqual((service.hits, service.misses), (1, 1))
+        service.get("HfO2")
+        service.get("TiN")
+        service.get("SiO2")
+        self.assertEqual((service.hits, service.misses), (1, 4))
+
+
+class StochioFormulaTest(unittest.TestCase):
+    """ test formulas with stochio markers against rewritten formulas.
+    """
+
+    def test_stoichios(self):
+        """ number of atom of each element is the one of the rewritten
+        formula, nested groups included
+        """
+        for marked_formula, values in MARKED:
+            formula = tools.StochioFormula(marked_formula)
+            self.assertEqual(len(formula.values), len(values))
+            expected = rewritten(marked_formula, values)
+            self.assertEqual(formula.formula(values), expected)
+            np.testing.assert_allclose(
+                formula.stoichios(values),
+                parsed_stoichios(expected, formula.atomic_numbers),
+                rtol=1e-12, err_msg=marked_formula)
+            # default values are the ones of the marked formula
+            np.testing.assert_allclose(
+                formula.stoichios(),
+                parsed_stoichios(tools.clear_marker(marked_formula),
+                                 formula.atomic_numbers),
+                rtol=1e-12, err_msg=marked_formula)
+
+    def test_population(self):
+        """ values of a population give one row of stoichiometries each
+        """
+        formula = tools.StochioFormula("Si(Ti_2O_3)_2N")
+        population = np.array([[1.5, 2.5, 3.], [1., 2., 1.], [0., 1., 2.]])
+        np.testing.assert_allclose(
+            formula.stoichios(population),
+            [formula.stoichios(values) for values in population],
+            rtol=1e-12)
+
+    def test_formula(self):
+        """ markers are kept on asked coefficients, materials are registered
+        without parsing
+        """
+        formula = tools.StochioFormula("Hf_0.5Si_0.5O2")
+        self.assertEqual(formula.elements, ["O", "Si", "Hf"])
+        self.assertEqual(formula.formula([0.3, 0.7], marked=(1,)),
+                         "Hf0.3Si_0.7O2")
+        material = formula.material([0.3, 0.7])
+        registered = tools.FORMULAS.get(material)
+        expected = tools.Formula(material)
+        np.testing.assert_allclose(registered.stoichios_norm,
+                                   expected.stoichios_norm, rtol=1e-12)
+        self.assertAlmostEqual(registered.molar_mass, expected.molar_mass,
+                               delta=1e-12)
+        self.assertRaises(ValueError, tools.StochioFormula, "Si(O_2")
+        self.assertRaises(ValueError, tools.StochioFormula, "Xx_2")
+
+
+if __name__ == "__main__":
+    unittest.main()
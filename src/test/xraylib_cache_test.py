@@ -0,0 +1,98 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the cache of xraylib values.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import xraylib
+from pyxcel.engine.gixrf import xraylib_cache
+from pyxcel.engine.gixrf.xraylib_cache import XraylibCache
+
+ENERGIES = [1.74, 4.51, 8.04, 17.]
+
+
+class XraylibCacheTest(unittest.TestCase):
+    """ test the memory and the on-disk store against xraylib.
+    """
+
+    def setUp(self):
+        """ temporary directory of the on-disk store
+        """
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """ remove the on-disk store
+        """
+        shutil.rmtree(self.directory)
+
+    def test_values(self):
+        """ cached values are the xraylib ones
+        """
+        cache = XraylibCache()
+        np.testing.assert_array_equal(
+            cache.get_many("CS_Total", [(14, energy) for energy in ENERGIES]),
+            [xraylib.CS_Total(14, energy) for energy in ENERGIES])
+        self.assertEqual(cache.get("CS_Total_CP", "SiO2", np.float64(8.04)),
+                         xraylib.CS_Total_CP("SiO2", 8.04))
+        self.assertEqual((cache.hits, cache.misses), (0, 5))
+        cache.get("CS_Total", np.int64(14), 8.04)
+        self.assertEqual((cache.hits, cache.misses), (1, 5))
+
+    def test_least_recently_used(self):
+        """ the least recently used value is dropped
+        """
+        cache = XraylibCache(maxsize=2)
+        cache.get("CS_Total", 14, 8.04)
+        cache.get("CS_Total", 22, 8.04)
+        cache.get("CS_Total", 14, 8.04)
+        cache.get("CS_Total", 72, 8.04)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        cache.get("CS_Total", 14, 8.04)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        cache.get("CS_Total", 22, 8.04)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def test_store(self):
+        """ values of the on-disk store are read by another cache
+        """
+        path = os.path.join(self.directory, "xraylib.sqlite")
+        cache = XraylibCache(path=path)
+        expected = cache.get_many("CS_Total",
+                                  [(22, energy) for energy in ENERGIES])
+        cache.close()
+        self.assertIsNone(cache.path)
+        other = XraylibCache(path=path)
+        np.testing.assert_array_equal(
+            other.get_many("CS_Total", [(22, energy) for energy in ENERGIES]),
+            expected)
+        self.assertEqual((other.hits, other.misses), (len(ENERGIES), 0))
+        other.close()
+
+    def test_invalid_line(self):
+        """ xraylib errors are raised and not kept, an element has no energy
+        for the lines it does not have
+        """
+        cache = XraylibCache()
+        args = (14, xraylib.LA1_LINE, 17.)
+        try:
+            expected = xraylib.CS_FluorLine_Kissel_Cascade(*args)
+        except ValueError:
+            for _ in range(2):
+                self.assertRaises(ValueError, cache.get,
+                                  "CS_FluorLine_Kissel_Cascade", *args)
+            self.assertEqual((cache.hits, cache.misses), (0, 0))
+        else:
+            self.assertEqual(cache.get("CS_FluorLine_Kissel_Cascade", *args),
+                             expected)
+        np.testing.assert_array_equal(
+            xraylib_cache.line_energies(14, [xraylib.KA1_LINE,
+                                             xraylib.LA1_LINE]),
+            [xraylib.LineEnergy(14, xraylib.KA1_LINE), 0.])
+
+
+if __name__ == "__main__":
+    unittest.main()
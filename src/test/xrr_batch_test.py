@@ -0,0 +1,108 @@
+# pylint: disable=import-error
+# -*- coding: utf8 -*-
+"""
+test of the population-batched XRR simulation.
+"""
+import unittest
+import numpy as np
+import paf.data
+import pyxcel.engine.simulator.xrr_no_genx as xrr
+from pyxcel.engine.modeling.entity import (StackData, LayerData,
+                                           InstrumentData, XRaySourceData,
+                                           XRRDetectorData)
+MAKE_DATA = paf.data.make_data
+
+THETA = np.linspace(0.1, 3., 300)
+#: resolution convolution types
+RESTYPES = (0, 1, 2, 3, 4)
+
+
+def create_parameters(population=4):
+    """ parameters of a stack of two layers (substrate first) with the
+    thickness and the roughness varying over the population
+    """
+    random = np.random.RandomState(0)
+    shape = (population, 1)
+    d = np.array([0., 15., 100., 0.]) * (1 + 0.1*random.rand(*shape))
+    sigmar = np.array([3., 3., 5., 0.]) * (1 + 0.2*random.rand(*shape))
+    d[:, [0, -1]] = 0.
+    sigmar[:, -1] = 0.
+    return {"d": d, "sigmar": sigmar,
+            "numerical_density": np.array([0.0499, 0.0662, 0.0960, 5.4e-5]),
+            "f": np.array([14.3+0.33j, 10.6+0.1j, 18.3+1.2j, 7.+0.01j],
+                          dtype=np.complex64)}
+
+
+def create_instrument(restype):
+    """ XRR instrument with a resolution convolution of type restype
+    """
+    source = XRaySourceData(wavelength=1.5406, footype=2, beamw=0.1)
+    detector = XRRDetectorData(res=0.005, respoints=5, restype=restype,
+                               resintrange=2)
+    return InstrumentData(source, detector, "XRR")
+
+
+class Filter(object):
+    """ filter without option for the simulators
+    """
+    def __getitem__(self, key):
+        """ no parameter
+        """
+        raise KeyError(key)
+
+
+def create_simulator(theta, restype):
+    """ initialized XRR simulator of two layers on silicon
+    """
+    layers = [LayerData("N2", "Amb", 0., 0.00125, 0., 0.),
+              LayerData("Si", "Sub", 0., 2.33, 0., 3.),
+              LayerData("HfO2", "L1", 0., 9.68, 15., 3.),
+              LayerData("TiN", "L2", 0., 5.2, 100., 5.)]
+    for layer in layers:
+        layer["mass_density"] = layer["mass_density"].value
+    stack = StackData("stack", layers[0], layers[1], layers[2:])
+    stack.wavelength = 1.5406
+    simulator = xrr.XRRGenXSimulator(MAKE_DATA(theta), stack,
+                                     instrument=create_instrument(restype))
+    simulator["parameter"] = MAKE_DATA({"samplen": 50.}, composite=True)
+    simulator.initialization(Filter())
+    return simulator
+
+
+class XRRBatchTest(unittest.TestCase):
+    """ test the batched simulation against the simulation of each row.
+    """
+
+    def test_rows(self):
+        """ each row of a batch is the simulation of its parameters
+        """
+        population = create_parameters()
+        for restype in RESTYPES:
+            instrument = create_instrument(restype)
+            batch = xrr.simulate_batch(THETA, population, instrument, 50.)
+            self.assertEqual(batch.shape, (4, len(THETA)))
+            for index in range(4):
+                parameters = dict(population, d=population["d"][index],
+                                  sigmar=population["sigmar"][index])
+                np.testing.assert_allclose(
+                    batch[index],
+                    xrr.simulate(THETA, parameters, instrument, 50.),
+                    rtol=1e-12, err_msg=str(restype))
+
+    def test_resampling_error(self):
+        """ FFT convolution of a non uniform scan reports its interpolation
+        error bound
+        """
+        self.assertEqual(create_simulator(THETA, 4).resampling_error, 0.)
+        theta = np.sort(np.concatenate((THETA, [0.155, 1.2345])))
+        self.assertEqual(create_simulator(theta, 2).resampling_error, 0.)
+        simulator = create_simulator(theta, 4)
+        self.assertGreater(simulator.resampling_error, 0.)
+        self.assertLessEqual(simulator.resampling_error,
+                             xrr.resolution.RESAMPLING_TOLERANCE)
+        simulation = simulator.simulate()
+        self.assertEqual(simulation.shape, theta.shape)
+
+
+if __name__ == "__main__":
+    unittest.main()